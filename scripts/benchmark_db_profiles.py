@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Compare server.py --db-profile settings on a read-heavy listing workload.
+
+Builds a scratch database with synthetic cards (or copies --db), then for each
+profile runs the API's listing helpers with a fresh connection per call, the
+way request handlers do, and reports mean/p95 latency per operation.
+
+Usage:
+  python3 scripts/benchmark_db_profiles.py --cards 20000
+  python3 scripts/benchmark_db_profiles.py --db flashcards.sqlite3 --rounds 50
+"""
+
+from __future__ import annotations
+
+import argparse
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import server  # noqa: E402
+from benchmark_payload_compression import synthetic_rows  # noqa: E402
+
+
+def build_database(path: Path, cards: int) -> None:
+    server.DB_PATH = path
+    server.init_db()
+    for _, card in synthetic_rows(cards):
+        server.upsert_record("cards", card)
+    for topic in range(40):
+        server.upsert_record("topics", {"id": f"topic-{topic}", "subjectId": "subject-1", "name": f"Topic {topic}"})
+
+
+def workload() -> dict[str, Callable[[], object]]:
+    topic_ids = [f"topic-{i}" for i in range(0, 40, 4)]
+    return {
+        "list cards": lambda: server.list_records("cards"),
+        "cards by topic": lambda: server.list_records_by_json_field("cards", "topicId", topic_ids),
+        "card counts": lambda: server.count_cards_by_topic_ids(topic_ids),
+        "get card": lambda: server.get_record("cards", "card-000042"),
+    }
+
+
+def run_profile(profile: str, rounds: int) -> dict[str, tuple[float, float]]:
+    server.DB_PROFILE = profile
+    results = {}
+    for name, call in workload().items():
+        call()  # warm the OS page cache so profiles are compared on equal footing
+        timings = []
+        for _ in range(rounds):
+            t0 = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - t0) * 1000.0)
+        timings.sort()
+        results[name] = (statistics.mean(timings), timings[int(0.95 * (len(timings) - 1))])
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark SQLite --db-profile settings.")
+    parser.add_argument("--db", default="", help="Benchmark a copy of this database instead of synthetic data.")
+    parser.add_argument("--cards", type=int, default=10000, help="Synthetic cards to generate (default: 10000).")
+    parser.add_argument("--rounds", type=int, default=20, help="Timed calls per operation and profile.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "bench.sqlite3"
+        if args.db:
+            shutil.copy2(Path(args.db).expanduser(), db_path)
+            server.DB_PATH = db_path
+            server.init_db()
+        else:
+            build_database(db_path, args.cards)
+        print(f"Database: {db_path.stat().st_size / 1024 / 1024:.1f} MB, schema v{server.SCHEMA_LAYOUT}")
+
+        names = list(workload())
+        print(f"{'profile':<12}" + "".join(f"{name:>24}" for name in names))
+        for profile in server.DB_PROFILES:
+            results = run_profile(profile, max(1, args.rounds))
+            cells = "".join(f"{results[name][0]:>13.2f} / {results[name][1]:>6.2f}" for name in names)
+            print(f"{profile:<12}{cells}")
+        print("(mean / p95 ms per call)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Measure size and CPU impact of at-rest payload compression.
+
+Reads card/cardbank/knowledge payloads from a flashcards database (or builds
+synthetic cards with --synthetic), encodes them with every codec supported by
+server.py and reports stored bytes, compressed row share, encode/decode cost
+and the resulting database file size after VACUUM.
+
+Usage:
+  python3 scripts/benchmark_payload_compression.py --db flashcards.sqlite3
+  python3 scripts/benchmark_payload_compression.py --synthetic 5000
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import server  # noqa: E402
+
+
+WORDS = (
+    "carbon emission energy reporting scope market price policy sector climate "
+    "warming budget offset capture storage grid demand supply renewable target "
+    "the of and to in is for that which with by from as on are"
+).split()
+
+
+def load_rows(db_path: Path) -> list[tuple[str, dict]]:
+    rows: list[tuple[str, dict]] = []
+    with sqlite3.connect(f"file:{db_path}?mode=ro", uri=True) as conn:
+        server.DB_PATH = db_path
+        server.SCHEMA_LAYOUT = server.detect_schema_layout(conn)
+    for store in server.PAYLOAD_COMPRESS_STORES:
+        rows.extend((store, record) for record in server.list_records(store))
+    return rows
+
+
+def synthetic_rows(count: int, seed: int = 7) -> list[tuple[str, dict]]:
+    rng = random.Random(seed)
+
+    def sentence(n: int) -> str:
+        return " ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + "."
+
+    rows: list[tuple[str, dict]] = []
+    for i in range(count):
+        mcq = i % 3 == 0
+        created = f"2026-01-{1 + i % 28:02d}T10:00:00.000Z"
+        card = {
+            "id": f"card-{i:06d}",
+            "topicId": f"topic-{i % 40}",
+            "type": "mcq" if mcq else "qa",
+            "textAlign": "center",
+            "questionTextAlign": "center",
+            "answerTextAlign": "center",
+            "optionsTextAlign": "center",
+            "prompt": " ".join(sentence(rng.randint(8, 20)) for _ in range(rng.randint(1, 4))),
+            "answer": " ".join(sentence(rng.randint(6, 18)) for _ in range(rng.randint(1, 6))),
+            "options": [
+                {"text": sentence(rng.randint(3, 9)), "correct": k == 0, "order": k + 1} for k in range(4)
+            ]
+            if mcq
+            else [],
+            "optionsRequireOrder": False,
+            "explanation": sentence(12) if mcq else "",
+            "imagesQ": [],
+            "imagesA": [],
+            "createdAt": created,
+            "meta": {"createdAt": created, "updatedAt": created},
+        }
+        rows.append(("cards", card))
+    return rows
+
+
+def vacuumed_size(stored: list[tuple[str, str, str]]) -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.sqlite3"
+        with sqlite3.connect(path) as conn:
+            conn.execute(
+                "CREATE TABLE records (store TEXT NOT NULL, record_key TEXT NOT NULL, payload TEXT NOT NULL, "
+                "updated_at INTEGER NOT NULL, PRIMARY KEY (store, record_key))"
+            )
+            conn.executemany("INSERT INTO records VALUES (?, ?, ?, 0)", stored)
+            conn.commit()
+            conn.execute("VACUUM")
+        return path.stat().st_size
+
+
+def bench_codec(codec: str, rows: list[tuple[str, dict]]) -> dict:
+    plain = [(store, record, json.dumps(record, separators=(",", ":"), ensure_ascii=False)) for store, record in rows]
+    t0 = time.perf_counter()
+    stored = [server.encode_payload(store, record, payload, codec) for store, record, payload in plain]
+    encode_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for payload in stored:
+        server.decode_payload(payload)
+    decode_s = time.perf_counter() - t0
+    key_rows = [
+        (store, str(record.get(server.KEY_FIELDS[store], i)), payload)
+        for i, ((store, record, _), payload) in enumerate(zip(plain, stored))
+    ]
+    n = max(1, len(rows))
+    return {
+        "codec": codec,
+        "bytes": sum(len(payload.encode("utf-8")) for payload in stored),
+        "compressed": sum(1 for payload in stored if server.PAYLOAD_CODEC_KEY in payload[:4096]),
+        "encode_us": encode_s * 1e6 / n,
+        "decode_us": decode_s * 1e6 / n,
+        "db_bytes": vacuumed_size(key_rows),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark at-rest payload compression codecs.")
+    parser.add_argument("--db", default=str(server.DB_PATH), help="Database to read payloads from.")
+    parser.add_argument("--synthetic", type=int, default=0, help="Benchmark N synthetic cards instead of --db.")
+    args = parser.parse_args()
+
+    if args.synthetic > 0:
+        rows = synthetic_rows(args.synthetic)
+        source = f"{len(rows)} synthetic cards"
+    else:
+        db_path = Path(args.db).expanduser().resolve()
+        if not db_path.exists():
+            raise SystemExit(f"Database not found: {db_path}")
+        rows = load_rows(db_path)
+        source = f"{len(rows)} payloads from {db_path}"
+    if not rows:
+        raise SystemExit("No card/cardbank/knowledge payloads to benchmark.")
+
+    print(f"Source: {source}")
+    print(f"{'codec':<7} {'payload KB':>11} {'ratio':>6} {'compressed':>11} {'enc us/row':>11} {'dec us/row':>11} {'db KB':>9}")
+    baseline = None
+    for codec in server.PAYLOAD_CODECS:
+        result = bench_codec(codec, rows)
+        baseline = baseline or result
+        print(
+            f"{codec:<7} {result['bytes'] / 1024:>11.1f} {result['bytes'] / baseline['bytes']:>6.2f} "
+            f"{result['compressed']:>5}/{len(rows):<5} {result['encode_us']:>11.1f} {result['decode_us']:>11.1f} "
+            f"{result['db_bytes'] / 1024:>9.1f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
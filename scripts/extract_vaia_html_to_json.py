@@ -21,20 +21,60 @@ python3 scripts/extract_vaia_html_to_json.py \
   --input vaia_content.html \
   --output polymer_technologie_injection_molding_import.json \
   --subject "Polymer Technologie"
+
+The input is read and parsed in chunks; finished cards are written to the
+output as soon as they are parsed, so memory stays bounded for large exports.
+Use `--output -` to stream the JSON to stdout.
+
+Batch usage (one process per export, cross-file de-duplication):
+python3 scripts/extract_vaia_html_to_json.py \
+  --input-dir exports/ \
+  --output-dir imports/ \
+  --subject "Polymer Technologie" \
+  --jobs 8
+
+`--manifest` takes a JSON list of paths or objects
+`{"input": "...", "subject": "...", "default_topic": "..."}` instead of a
+directory. Use `--output` to merge all files into one import JSON or
+`--output-dir` to write one JSON per input file.
+
+`--db flashcards.sqlite3` writes the cards straight into the app database
+(resolving or creating subjects and topics by name and populating both the
+`cards` and `cardbank` stores) in a single transaction, instead of or in
+addition to the JSON output.
 """
 
 from __future__ import annotations
 
 import argparse
+import contextlib
+import hashlib
 import json
+import os
 import re
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from html.parser import HTMLParser
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, Iterator, List, Sequence, TextIO, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from server import (  # noqa: E402  (shares the server's import, payload storage and MinHash formats)
+    NEAR_DUPE_THRESHOLD,
+    CardImporter,
+    MinHashIndex,
+    create_blobs_table,
+)
 
 
 BLOCK_TAGS = {"p", "div", "li", "tr", "br", "ul", "ol", "table"}
 PLACEHOLDER_VALUES = {"frfrf"}
+READ_CHUNK_CHARS = 64 * 1024
+HTML_SUFFIXES = {".html", ".htm"}
+# Private cache of cleaned fields set by normalize_card; never written to output rows.
+NORMALIZED_KEY = "_normalized"
 
 
 def _normalize_ws_line(text: str) -> str:
@@ -103,11 +143,15 @@ class FlashcardExtractor(HTMLParser):
     Parses two card layouts:
     1) Vaia preview cards: <app-flashcard-list-item> with two <app-flashcard-froala-view> blocks.
     2) App card tiles: alternating "card-tile-title" (Q/A) + "card-tile-body".
+
+    When `on_card` is given, every finished card is passed to it instead of
+    being collected in `self.cards`, so the parser can be fed incrementally.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, on_card: Callable[[Dict[str, Any]], None] | None = None) -> None:
         super().__init__(convert_charrefs=True)
 
+        self.on_card = on_card
         self.in_card = False
         self.card_depth = 0
         self.current_card: Dict[str, Any] | None = None
@@ -195,6 +239,12 @@ class FlashcardExtractor(HTMLParser):
             deduped.append(item)
         return deduped
 
+    def _emit_card(self, card: Dict[str, Any]) -> None:
+        if self.on_card is not None:
+            self.on_card(card)
+        else:
+            self.cards.append(card)
+
     def _finalize_card(self) -> None:
         if not self.current_card:
             return
@@ -216,7 +266,7 @@ class FlashcardExtractor(HTMLParser):
             if not answer and mcq_options:
                 answer = str(mcq_options[0]["text"])
             if question and answer:
-                self.cards.append(
+                self._emit_card(
                     {
                         "topic": topic,
                         "question": question,
@@ -240,7 +290,7 @@ class FlashcardExtractor(HTMLParser):
                 include_images=True,
             )
             if question and answer:
-                self.cards.append({"topic": topic, "question": question, "answer": answer, "type": "qa"})
+                self._emit_card({"topic": topic, "question": question, "answer": answer, "type": "qa"})
         self.current_card = None
 
     def handle_starttag(self, tag: str, attrs_list: List[tuple[str, str | None]]) -> None:
@@ -373,40 +423,132 @@ class FlashcardExtractor(HTMLParser):
         self._finalize_card()
 
 
-def dedupe_cards(cards: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def iter_text_chunks(path: Path, chunk_chars: int = READ_CHUNK_CHARS) -> Iterator[str]:
+    with path.open("r", encoding="utf-8", errors="ignore") as handle:
+        while True:
+            chunk = handle.read(max(1, chunk_chars))
+            if not chunk:
+                return
+            yield chunk
+
+
+def extract_cards_streaming(
+    input_path: Path,
+    on_card: Callable[[Dict[str, Any]], None],
+    chunk_chars: int = READ_CHUNK_CHARS,
+) -> None:
+    """Feed `input_path` to a FlashcardExtractor chunk by chunk, emitting cards as they finish."""
+    extractor = FlashcardExtractor(on_card=on_card)
+    for chunk in iter_text_chunks(input_path, chunk_chars):
+        extractor.feed(chunk)
+    extractor.close()
+    extractor.finalize()
+
+
+class CardJsonWriter:
+    """
+    Writes `{"cards": [...]}` one row at a time.
+
+    The output is byte-identical to `json.dumps({"cards": rows}, ensure_ascii=False, indent=2)`.
+    """
+
+    def __init__(self, stream: TextIO) -> None:
+        self.stream = stream
+        self.count = 0
+        self.closed = False
+
+    def write(self, row: Dict[str, Any]) -> None:
+        body = json.dumps(row, ensure_ascii=False, indent=2).replace("\n", "\n    ")
+        self.stream.write(("{\n  \"cards\": [\n    " if self.count == 0 else ",\n    ") + body)
+        self.count += 1
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.stream.write("\n  ]\n}" if self.count else '{\n  "cards": []\n}')
+        self.stream.flush()
+
+    def __enter__(self) -> "CardJsonWriter":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def normalize_card(card: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Clean every text field of `card` exactly once and cache the result on the card.
+
+    Later stages (placeholder filter, dedupe, build_rows) read the cached values
+    instead of re-running `clean_text`.
+    """
+    cached = card.get(NORMALIZED_KEY)
+    if isinstance(cached, dict):
+        return cached
+    options: List[Dict[str, Any]] = []
+    options_raw = card.get("options", [])
+    if isinstance(options_raw, list):
+        for opt in options_raw:
+            if not isinstance(opt, dict):
+                continue
+            text = clean_text(str(opt.get("text", "")))
+            if text:
+                options.append({"text": text, "correct": bool(opt.get("correct", False))})
+    normalized = {
+        "topic": clean_text(str(card.get("topic", ""))),
+        "question": clean_text(str(card.get("question", ""))),
+        "answer": clean_text(str(card.get("answer", ""))),
+        "type": str(card.get("type", "qa")).strip().lower() or "qa",
+        "options": options,
+    }
+    card[NORMALIZED_KEY] = normalized
+    return normalized
+
+
+def card_dedupe_key(card: Dict[str, Any]) -> str:
+    """Return a compact hash of the normalized card fields ('' if question or answer is empty)."""
+    norm = normalize_card(card)
+    if not norm["question"] or not norm["answer"]:
+        return ""
+    digest = hashlib.blake2b(digest_size=16)
+    for value in (norm["topic"], norm["question"], norm["answer"], norm["type"]):
+        digest.update(value.encode("utf-8"))
+        digest.update(b"\x1f")
+    for opt in norm["options"]:
+        digest.update(opt["text"].encode("utf-8"))
+        digest.update(b"\x1e1" if opt["correct"] else b"\x1e0")
+    return digest.hexdigest()
+
+
+def dedupe_cards(
+    cards: List[Dict[str, Any]],
+    near_duplicates: bool = False,
+    threshold: float = NEAR_DUPE_THRESHOLD,
+) -> List[Dict[str, Any]]:
     unique: List[Dict[str, Any]] = []
     seen = set()
+    near_index = MinHashIndex(threshold=threshold) if near_duplicates else None
     for card in cards:
-        q = clean_text(str(card.get("question", "")))
-        a = clean_text(str(card.get("answer", "")))
-        if not q or not a:
-            continue
-        normalized = {
-            "topic": clean_text(str(card.get("topic", ""))),
-            "question": q,
-            "answer": a,
-            "type": str(card.get("type", "qa")).strip().lower() or "qa",
-            "options": card.get("options", []),
-        }
-        key = json.dumps(normalized, ensure_ascii=False, sort_keys=True)
-        if key in seen:
+        key = card_dedupe_key(card)
+        if not key or key in seen:
             continue
         seen.add(key)
+        if near_index is not None and not near_index.add_if_new(near_index.signature(normalize_card(card)["question"])):
+            continue
         unique.append(card)
     return unique
 
 
+def is_placeholder_card(card: Dict[str, Any]) -> bool:
+    norm = normalize_card(card)
+    return norm["question"].lower() in PLACEHOLDER_VALUES and norm["answer"].lower() in PLACEHOLDER_VALUES
+
+
 def filter_placeholders(cards: List[Dict[str, Any]], keep_placeholders: bool) -> List[Dict[str, Any]]:
     if keep_placeholders:
         return cards
-    filtered: List[Dict[str, Any]] = []
-    for card in cards:
-        q = clean_text(str(card.get("question", "")))
-        a = clean_text(str(card.get("answer", "")))
-        if q.lower() in PLACEHOLDER_VALUES and a.lower() in PLACEHOLDER_VALUES:
-            continue
-        filtered.append(card)
-    return filtered
+    return [card for card in cards if not is_placeholder_card(card)]
 
 
 def build_rows(
@@ -417,22 +559,14 @@ def build_rows(
 ) -> List[Dict[str, Any]]:
     rows: List[Dict[str, Any]] = []
     for card in cards:
-        question = clean_text(str(card.get("question", "")))
-        answer = clean_text(str(card.get("answer", "")))
-        topic = clean_text(str(card.get("topic", ""))) or default_topic
-        safe_type = str(card.get("type", "qa")).strip().lower()
+        norm = normalize_card(card)
+        question = norm["question"]
+        answer = norm["answer"]
+        topic = norm["topic"] or default_topic
+        safe_type = norm["type"]
         if safe_type not in {"qa", "mcq"}:
             safe_type = "qa"
-        options_raw = card.get("options", [])
-        options: List[Dict[str, Any]] = []
-        if isinstance(options_raw, list):
-            for opt in options_raw:
-                if not isinstance(opt, dict):
-                    continue
-                text = clean_text(str(opt.get("text", "")))
-                if not text:
-                    continue
-                options.append({"text": text, "correct": bool(opt.get("correct", False))})
+        options = [dict(opt) for opt in norm["options"]]
 
         if not include_images:
             question = remove_image_markers(question)
@@ -459,9 +593,20 @@ def build_rows(
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Extract flashcards from Vaia-like HTML to JSON import format.")
-    parser.add_argument("--input", required=True, help="Path to source HTML file.")
-    parser.add_argument("--output", required=True, help="Path to target JSON file.")
-    parser.add_argument("--subject", required=True, help="Subject name to set on all extracted cards.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="Path to source HTML file.")
+    source.add_argument("--input-dir", help="Batch mode: directory of HTML exports (*.html, *.htm).")
+    source.add_argument("--manifest", help="Batch mode: JSON manifest listing HTML exports.")
+    parser.add_argument("--output", help="Path to target JSON file ('-' for stdout).")
+    parser.add_argument(
+        "--db",
+        help="Also (or instead) import the cards directly into this flashcards SQLite database.",
+    )
+    parser.add_argument("--output-dir", help="Batch mode: write one JSON per input file into this directory.")
+    parser.add_argument(
+        "--subject",
+        help="Subject name to set on all extracted cards (batch default: manifest entry or file name).",
+    )
     parser.add_argument(
         "--default-topic",
         "--topic",
@@ -479,49 +624,382 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Keep obvious placeholder cards like 'frfrf'.",
     )
+    parser.add_argument(
+        "--near-dupes",
+        action="store_true",
+        help="Also drop cards whose question is a near-duplicate (MinHash over question text).",
+    )
+    parser.add_argument(
+        "--near-dupe-threshold",
+        type=float,
+        default=NEAR_DUPE_THRESHOLD,
+        help=f"Estimated Jaccard similarity treated as near-duplicate (default: {NEAR_DUPE_THRESHOLD}).",
+    )
     parser.add_argument(
         "--no-image-markers",
         action="store_true",
         help="Remove '[Image] ...' markers from output question/answer text.",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=READ_CHUNK_CHARS,
+        help=f"Characters read from the input per parser feed (default: {READ_CHUNK_CHARS}).",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=0,
+        help="Batch mode: worker processes (default: CPU count).",
+    )
+    args = parser.parse_args()
+    if args.input:
+        if not args.output and not args.db:
+            parser.error("--output or --db is required with --input")
+        if not args.subject:
+            parser.error("--subject is required with --input")
+        if args.output_dir:
+            parser.error("--output-dir is only supported in batch mode")
+    elif args.output and args.output_dir:
+        parser.error("batch mode takes only one of --output or --output-dir")
+    elif not (args.output or args.output_dir or args.db):
+        parser.error("batch mode needs --output, --output-dir or --db")
+    return args
+
+
+class SqliteCardImporter(CardImporter):
+    """
+    Writes extracted rows straight into the app's `records` table of the
+    database at `db_path` (created when missing), using the server's
+    CardImporter. All inserts share one transaction that is committed once
+    in `commit()`.
+    """
+
+    def __init__(self, db_path: Path) -> None:
+        self.db_path = db_path
+        conn = sqlite3.connect(str(db_path), timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS records (
+                store TEXT NOT NULL,
+                record_key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                updated_at INTEGER NOT NULL,
+                PRIMARY KEY (store, record_key)
+            )
+            """
+        )
+        create_blobs_table(conn)
+        super().__init__(conn)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "SqliteCardImporter":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc_info: Any) -> None:
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            self.close()
+
+
+def print_db_summary(importer: SqliteCardImporter, log: TextIO) -> None:
+    stats = importer.stats
+    print(
+        f"Database: {importer.db_path} (subjects created={stats['subjects_created']}, "
+        f"topics created={stats['topics_created']}, cards inserted={stats['cards_inserted']}, "
+        f"already present={stats['cards_skipped']})",
+        file=log,
+    )
+
+
+def load_batch_jobs(args: argparse.Namespace) -> List[Dict[str, str]]:
+    """Resolve --input-dir/--manifest into `{"input", "subject", "default_topic"}` jobs."""
+    fallback_topic = str(args.default_topic or "").strip()
+    entries: List[Dict[str, str]] = []
+    if args.input_dir:
+        input_dir = Path(args.input_dir)
+        if not input_dir.is_dir():
+            raise FileNotFoundError(f"Input directory not found: {input_dir}")
+        for path in sorted(input_dir.iterdir()):
+            if path.is_file() and path.suffix.lower() in HTML_SUFFIXES:
+                entries.append({"input": str(path)})
+        base_dir = input_dir
+    else:
+        manifest_path = Path(args.manifest)
+        if not manifest_path.exists():
+            raise FileNotFoundError(f"Manifest not found: {manifest_path}")
+        raw = json.loads(manifest_path.read_text(encoding="utf-8"))
+        if isinstance(raw, dict):
+            raw = raw.get("files", [])
+        if not isinstance(raw, list):
+            raise ValueError("Manifest must be a JSON list (or an object with a 'files' list)")
+        for item in raw:
+            if isinstance(item, str):
+                entries.append({"input": item})
+            elif isinstance(item, dict) and str(item.get("input", "")).strip():
+                entries.append({key: str(value) for key, value in item.items() if value is not None})
+            else:
+                raise ValueError(f"Invalid manifest entry: {item!r}")
+        base_dir = manifest_path.parent
+
+    jobs: List[Dict[str, str]] = []
+    for entry in entries:
+        input_path = Path(entry["input"])
+        if not input_path.is_absolute():
+            input_path = base_dir / input_path if args.manifest else input_path
+        if not input_path.exists():
+            raise FileNotFoundError(f"Input HTML not found: {input_path}")
+        subject = str(entry.get("subject") or args.subject or input_path.stem).strip()
+        default_topic = entry.get("default_topic") or entry.get("topic") or fallback_topic
+        jobs.append(
+            {
+                "input": str(input_path),
+                "subject": subject,
+                "default_topic": clean_text(str(default_topic).strip()) or "Imported Topic",
+            }
+        )
+    return jobs
+
+
+def extract_file_rows(
+    job: Dict[str, str],
+    keep_placeholders: bool,
+    include_images: bool,
+    chunk_chars: int,
+    near_duplicates: bool = False,
+) -> Dict[str, Any]:
+    """
+    Worker entry point for batch mode: parse one export with its own extractor.
+
+    Returns the rows as `(dedupe_key, minhash_signature, rows)` entries so the
+    parent can merge and de-duplicate across files without re-cleaning any text.
+    """
+    t0 = time.perf_counter()
+    entries: List[Tuple[str, Sequence[int] | None, List[Dict[str, Any]]]] = []
+    stats = {"raw": 0, "topic_detected": 0}
+    signer = MinHashIndex() if near_duplicates else None
+
+    def handle_card(card: Dict[str, Any]) -> None:
+        stats["raw"] += 1
+        if not keep_placeholders and is_placeholder_card(card):
+            return
+        key = card_dedupe_key(card)
+        if not key:
+            return
+        if normalize_card(card)["topic"]:
+            stats["topic_detected"] += 1
+        rows = build_rows(
+            [card],
+            subject=job["subject"],
+            default_topic=job["default_topic"],
+            include_images=include_images,
+        )
+        signature = signer.signature(normalize_card(card)["question"]) if signer is not None else None
+        entries.append((key, signature, rows))
+
+    extract_cards_streaming(Path(job["input"]), handle_card, chunk_chars=chunk_chars)
+    return {
+        "input": job["input"],
+        "subject": job["subject"],
+        "entries": entries,
+        "raw": stats["raw"],
+        "topic_detected": stats["topic_detected"],
+        "parse_ms": (time.perf_counter() - t0) * 1000.0,
+    }
+
+
+def run_batch(args: argparse.Namespace) -> int:
+    t_start = time.perf_counter()
+    jobs = load_batch_jobs(args)
+    if not jobs:
+        print("No HTML exports found.")
+        return 0
+
+    include_images = not bool(args.no_image_markers)
+    keep_placeholders = bool(args.keep_placeholders)
+    dedupe = not args.no_dedupe
+    near_duplicates = dedupe and bool(args.near_dupes)
+    chunk_chars = int(args.chunk_size)
+    workers = max(1, min(int(args.jobs) or (os.cpu_count() or 1), len(jobs)))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(extract_file_rows, job, keep_placeholders, include_images, chunk_chars, near_duplicates)
+            for job in jobs
+        ]
+        # Merge in input order so "first file wins" is deterministic for duplicates.
+        results = [future.result() for future in futures]
+
+    output_dir = Path(args.output_dir) if args.output_dir else None
+    if output_dir is not None:
+        output_dir.mkdir(parents=True, exist_ok=True)
+    merged_writer: CardJsonWriter | None = None
+    merged_stream: TextIO | None = None
+    to_stdout = bool(args.output) and str(args.output).strip() == "-"
+    if args.output:
+        merged_stream = sys.stdout if to_stdout else Path(args.output).open("w", encoding="utf-8")
+        merged_writer = CardJsonWriter(merged_stream)
+
+    log = sys.stderr if to_stdout else sys.stdout
+    importer = SqliteCardImporter(Path(args.db)) if args.db else None
+    seen_keys: set[Tuple[str, str]] = set()
+    near_indexes: Dict[str, MinHashIndex] = {}
+    used_names: set[str] = set()
+    totals = {"raw": 0, "written": 0, "duplicates": 0, "mcq": 0}
+    failed = True
+    try:
+        for result in results:
+            file_writer: CardJsonWriter | None = None
+            file_stream: TextIO | None = None
+            output_label = str(args.output or args.db)
+            if output_dir is not None:
+                stem = Path(result["input"]).stem
+                name = f"{stem}.json"
+                suffix = 2
+                while name in used_names:
+                    name = f"{stem}_{suffix}.json"
+                    suffix += 1
+                used_names.add(name)
+                output_label = str(output_dir / name)
+                file_stream = (output_dir / name).open("w", encoding="utf-8")
+                file_writer = CardJsonWriter(file_stream)
+            writer = file_writer or merged_writer
+
+            written = 0
+            duplicates = 0
+            for key, signature, rows in result["entries"]:
+                if dedupe:
+                    scoped_key = (result["subject"], key)
+                    if scoped_key in seen_keys:
+                        duplicates += 1
+                        continue
+                    seen_keys.add(scoped_key)
+                if signature is not None:
+                    near_index = near_indexes.get(result["subject"])
+                    if near_index is None:
+                        near_index = near_indexes[result["subject"]] = MinHashIndex(
+                            threshold=float(args.near_dupe_threshold)
+                        )
+                    if not near_index.add_if_new(signature):
+                        duplicates += 1
+                        continue
+                for row in rows:
+                    if writer is not None:
+                        writer.write(row)
+                    if importer is not None:
+                        importer.add(row)
+                    written += 1
+                    if str(row.get("type", "")).lower() == "mcq":
+                        totals["mcq"] += 1
+            if file_writer is not None and file_stream is not None:
+                file_writer.close()
+                file_stream.close()
+
+            totals["raw"] += int(result["raw"])
+            totals["written"] += written
+            totals["duplicates"] += duplicates
+            print(
+                f"- {result['input']} -> {output_label}: raw={result['raw']}, "
+                f"topics={result['topic_detected']}, duplicates={duplicates}, written={written}, "
+                f"parse_ms={result['parse_ms']:.1f}",
+                file=log,
+            )
+        failed = False
+    finally:
+        if merged_writer is not None and merged_stream is not None:
+            merged_writer.close()
+            if not to_stdout:
+                merged_stream.close()
+        if importer is not None:
+            if failed:
+                importer.conn.rollback()
+            else:
+                importer.commit()
+            importer.close()
+
+    print(f"Files processed: {len(results)} (workers={workers})", file=log)
+    print(f"Raw cards parsed: {totals['raw']}", file=log)
+    print(f"Duplicates removed: {totals['duplicates']}", file=log)
+    print(f"MCQ cards detected: {totals['mcq']}", file=log)
+    print(f"Final cards written: {totals['written']}", file=log)
+    if importer is not None:
+        print_db_summary(importer, log)
+    print(f"Total time: {(time.perf_counter() - t_start) * 1000.0:.1f} ms", file=log)
+    return 0
 
 
 def main() -> int:
     args = parse_args()
+    if not args.input:
+        return run_batch(args)
     input_path = Path(args.input)
-    output_path = Path(args.output)
+    to_stdout = str(args.output or "").strip() == "-"
+    output_path = Path(args.output) if args.output else None
     if not input_path.exists():
         raise FileNotFoundError(f"Input HTML not found: {input_path}")
 
-    html = input_path.read_text(encoding="utf-8", errors="ignore")
-    extractor = FlashcardExtractor()
-    extractor.feed(html)
-    extractor.finalize()
-
-    combined = extractor.cards
-    combined = filter_placeholders(combined, keep_placeholders=bool(args.keep_placeholders))
-    if not args.no_dedupe:
-        combined = dedupe_cards(combined)
-
-    rows = build_rows(
-        combined,
-        subject=str(args.subject).strip(),
-        default_topic=clean_text(str(args.default_topic).strip()) or "Imported Topic",
-        include_images=not bool(args.no_image_markers),
-    )
-    payload = {"cards": rows}
-    output_path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
-
-    topic_detected_count = sum(1 for card in combined if clean_text(str(card.get("topic", ""))))
-    mcq_count = sum(1 for card in rows if str(card.get("type", "")).lower() == "mcq")
-
-    print(f"Input: {input_path}")
-    print(f"Output: {output_path}")
-    print(f"Raw cards parsed: {len(extractor.cards)}")
-    print(f"Cards with detected topic tag: {topic_detected_count}")
-    print(f"MCQ cards detected: {mcq_count}")
-    print(f"Final cards written: {len(rows)}")
+    subject = str(args.subject).strip()
+    default_topic = clean_text(str(args.default_topic).strip()) or "Imported Topic"
+    include_images = not bool(args.no_image_markers)
+    keep_placeholders = bool(args.keep_placeholders)
+    dedupe = not args.no_dedupe
+    seen_keys: set[str] = set()
+    near_index = MinHashIndex(threshold=float(args.near_dupe_threshold)) if dedupe and args.near_dupes else None
+    stats = {"raw": 0, "topic_detected": 0, "mcq": 0, "written": 0}
+    writer: CardJsonWriter | None = None
+    importer: SqliteCardImporter | None = None
+
+    def handle_card(card: Dict[str, Any]) -> None:
+        stats["raw"] += 1
+        if not keep_placeholders and is_placeholder_card(card):
+            return
+        if dedupe:
+            key = card_dedupe_key(card)
+            if not key or key in seen_keys:
+                return
+            seen_keys.add(key)
+            if near_index is not None and not near_index.add_if_new(
+                near_index.signature(normalize_card(card)["question"])
+            ):
+                return
+        if normalize_card(card)["topic"]:
+            stats["topic_detected"] += 1
+        for row in build_rows([card], subject=subject, default_topic=default_topic, include_images=include_images):
+            if writer is not None:
+                writer.write(row)
+            if importer is not None:
+                importer.add(row)
+            stats["written"] += 1
+            if str(row.get("type", "")).lower() == "mcq":
+                stats["mcq"] += 1
+
+    with contextlib.ExitStack() as stack:
+        if output_path is not None:
+            out_stream = sys.stdout if to_stdout else stack.enter_context(output_path.open("w", encoding="utf-8"))
+            writer = stack.enter_context(CardJsonWriter(out_stream))
+        if args.db:
+            importer = stack.enter_context(SqliteCardImporter(Path(args.db)))
+        extract_cards_streaming(input_path, handle_card, chunk_chars=int(args.chunk_size))
+
+    # Keep stdout clean for the JSON stream when writing to '-'.
+    log = sys.stderr if to_stdout else sys.stdout
+    print(f"Input: {input_path}", file=log)
+    if output_path is not None:
+        print(f"Output: {'<stdout>' if to_stdout else output_path}", file=log)
+    print(f"Raw cards parsed: {stats['raw']}", file=log)
+    print(f"Cards with detected topic tag: {stats['topic_detected']}", file=log)
+    print(f"MCQ cards detected: {stats['mcq']}", file=log)
+    print(f"Final cards written: {stats['written']}", file=log)
+    if importer is not None:
+        print_db_summary(importer, log)
     return 0
 
 
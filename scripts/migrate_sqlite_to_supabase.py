@@ -20,6 +20,9 @@ from collections import Counter
 from datetime import datetime, timezone
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from server import resolve_payload  # noqa: E402  (reads compressed or deduplicated payloads)
+
 DEFAULT_DB_PATH = Path(__file__).resolve().parents[1] / 'flashcards.sqlite3'
 DEFAULT_TABLE = 'records'
 
@@ -60,26 +63,23 @@ def load_local_rows(db_path: Path, stores: list[str] | None = None, owner_id: st
     params.extend(stores)
   query += ' ORDER BY store, updated_at, record_key'
 
+  out: list[dict] = []
   with sqlite3.connect(str(db_path)) as conn:
     conn.row_factory = sqlite3.Row
-    rows = conn.execute(query, params).fetchall()
-
-  out: list[dict] = []
-  for row in rows:
-    payload_raw = row['payload']
-    try:
-      payload = json.loads(payload_raw)
-    except Exception as exc:
-      raise ValueError(f"Invalid JSON payload for {row['store']}/{row['record_key']}: {exc}") from exc
-
-    out.append({
-      'store': str(row['store']),
-      'record_key': str(row['record_key']),
-      'payload': payload,
-      'updated_at': to_iso_timestamp(row['updated_at'])
-    })
-    if owner_id:
-      out[-1]['owner_id'] = owner_id
+    for row in conn.execute(query, params).fetchall():
+      # Upload the full record, not the server's compressed/deduplicated storage form.
+      payload = resolve_payload(conn, row['payload'])
+      if payload is None:
+        raise ValueError(f"Invalid JSON payload for {row['store']}/{row['record_key']}")
+
+      out.append({
+        'store': str(row['store']),
+        'record_key': str(row['record_key']),
+        'payload': payload,
+        'updated_at': to_iso_timestamp(row['updated_at'])
+      })
+      if owner_id:
+        out[-1]['owner_id'] = owner_id
 
   return out
 
@@ -0,0 +1,663 @@
+#!/usr/bin/env python3
+"""
+Sync one subject's Q/A cards in flashcards.sqlite3 from a rebuilt JSON file.
+
+The rebuilt JSON maps topic keys to lists of
+`{"question_id": "...", "question": "...", "answer": "..."}` items. A mapping
+file translates rebuilt topic keys to app topic names:
+
+{"subject": "Carbon Management", "topics": {"Topic 1: Global Warming": "Global Warming"}}
+
+(a plain `{"rebuilt key": "app topic"}` object works too; without a mapping
+every rebuilt key is used as the topic name).
+
+The script updates both `cards` and `cardbank` stores. It reuses existing card
+ids where possible, only inserts new ids for questions that do not match
+existing cards, and deletes cards that no longer appear in the rebuilt source.
+The full diff is computed first and then applied with `executemany` in one
+transaction; `--dry-run` prints the diff without touching the database.
+
+Typical usage:
+python3 scripts/sync_subject_from_rebuilt.py \
+  --db flashcards.sqlite3 \
+  --json carbon_management_rebuilt.json \
+  --mapping carbon_management_mapping.json \
+  --dry-run
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import difflib
+import heapq
+import json
+import re
+import sqlite3
+import sys
+import time
+import uuid
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from server import (  # noqa: E402  (reads and writes compressed or deduplicated payloads)
+    PAYLOAD_BLOBS_TABLE,
+    collect_payload_blobs,
+    create_blobs_table,
+    prepare_payload,
+    resolve_payload,
+)
+
+
+# Candidate generation for match_cards.
+CANDIDATES_PER_QUESTION = 24
+MIN_POSTING_CAP = 32
+# Above this many leftover pairs, pass 3 pairs candidate-less leftovers in order instead of scoring all.
+PASS3_FULL_SCORE_LIMIT = 40_000
+LOW_CONFIDENCE_SCORE = 0.75
+DIFF_PREVIEW_CHARS = 70
+
+
+def normalize(text: str) -> str:
+    normalized = (text or "").strip().lower()
+    normalized = (
+        normalized.replace("´", "'")
+        .replace("’", "'")
+        .replace("‘", "'")
+        .replace("–", "-")
+        .replace("—", "-")
+        .replace("“", '"')
+        .replace("”", '"')
+    )
+    normalized = re.sub(r"\s+", " ", normalized)
+    return normalized
+
+
+def qid_number(question_id: str) -> int:
+    match = re.search(r"\d+", question_id or "")
+    return int(match.group(0)) if match else 0
+
+
+def similarity_score(a: str, b: str) -> float:
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 2.0
+    seq_ratio = difflib.SequenceMatcher(None, a, b).ratio()
+    return max(cheap_similarity(a, b, set(a.split()), set(b.split())), seq_ratio)
+
+
+def cheap_similarity(a: str, b: str, a_tokens: set[str], b_tokens: set[str]) -> float:
+    """The prefix-bonus and token-Jaccard parts of similarity_score, i.e. everything but SequenceMatcher."""
+    shortest = min(len(a), len(b))
+    longest = max(len(a), len(b))
+    prefix_bonus = 0.0
+    if shortest >= 24 and (a.startswith(b) or b.startswith(a)):
+        prefix_bonus = 1.3 + (shortest / longest) * 0.5
+
+    jaccard = (len(a_tokens & b_tokens) / len(a_tokens | b_tokens)) if (a_tokens or b_tokens) else 0.0
+    token_score = jaccard * 0.95
+    return max(prefix_bonus, token_score)
+
+
+def ratio_upper_bound(a: str, b: str, a_chars: Counter[str], b_chars: Counter[str]) -> float:
+    """SequenceMatcher.quick_ratio() from precomputed character counts; never below ratio()."""
+    if len(a_chars) > len(b_chars):
+        a_chars, b_chars = b_chars, a_chars
+    return 2.0 * sum(min(count, b_chars[char]) for char, count in a_chars.items()) / (len(a) + len(b))
+
+
+@dataclass
+class ExistingCard:
+    card_id: str
+    payload: dict
+    norm_question: str
+    norm_answer: str
+
+
+def question_features(text: str) -> set[str]:
+    """Word tokens plus character trigrams, used as inverted-index keys."""
+    features = {f"w:{token}" for token in text.split()}
+    padded = f" {text} "
+    features.update(f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+    return features
+
+
+class QuestionIndex:
+    """Token/trigram inverted index over normalized questions for candidate generation."""
+
+    def __init__(self, questions: list[str]) -> None:
+        self.postings: dict[str, list[int]] = {}
+        for idx, question in enumerate(questions):
+            for feature in question_features(question):
+                self.postings.setdefault(feature, []).append(idx)
+        # Features shared by most questions ("the", " wh") carry no signal and
+        # would make every lookup linear in the number of cards.
+        self.max_posting = max(MIN_POSTING_CAP, len(questions) // 4)
+
+    def candidates(self, question: str, limit: int) -> list[int]:
+        hits: Counter[int] = Counter()
+        for feature in question_features(question):
+            posting = self.postings.get(feature)
+            if posting and len(posting) <= self.max_posting:
+                hits.update(posting)
+        return [idx for idx, _ in hits.most_common(limit)]
+
+
+def match_cards(
+    existing_cards: list[ExistingCard],
+    rebuilt_items: list[dict],
+) -> tuple[dict[int, int], list[int], list[int], list[tuple[int, int, float]]]:
+    """Return mapping new_idx -> existing_idx with one-to-one assignments."""
+    mapped: dict[int, int] = {}
+    scored_matches: list[tuple[int, int, float]] = []
+
+    remaining_new = set(range(len(rebuilt_items)))
+    remaining_existing = set(range(len(existing_cards)))
+    new_questions = [normalize(item["question"]) for item in rebuilt_items]
+
+    existing_by_q: dict[str, deque[int]] = {}
+    for idx, card in enumerate(existing_cards):
+        existing_by_q.setdefault(card.norm_question, deque()).append(idx)
+
+    def assign(new_idx: int, existing_idx: int, score: float) -> None:
+        mapped[new_idx] = existing_idx
+        scored_matches.append((new_idx, existing_idx, score))
+        remaining_new.discard(new_idx)
+        remaining_existing.discard(existing_idx)
+
+    # Pass 1: exact normalized question match.
+    for new_idx, nq in enumerate(new_questions):
+        candidates = existing_by_q.get(nq)
+        while candidates and candidates[0] not in remaining_existing:
+            candidates.popleft()
+        if candidates:
+            assign(new_idx, candidates.popleft(), 2.0)
+
+    if not remaining_new or not remaining_existing:
+        return mapped, sorted(remaining_new), sorted(remaining_existing), scored_matches
+
+    scores: dict[tuple[int, int], float] = {}
+    existing_questions = [card.norm_question for card in existing_cards]
+    new_tokens: dict[int, set[str]] = {}
+    existing_tokens: dict[int, set[str]] = {}
+    new_chars: dict[int, Counter[str]] = {}
+    existing_chars: dict[int, Counter[str]] = {}
+
+    def pair_score(new_idx: int, existing_idx: int) -> float:
+        key = (new_idx, existing_idx)
+        score = scores.get(key)
+        if score is None:
+            score = similarity_score(new_questions[new_idx], existing_questions[existing_idx])
+            scores[key] = score
+        return score
+
+    def pair_bound(new_idx: int, existing_idx: int) -> float:
+        """Exact score when it is cheap to get, otherwise an upper bound that drain() resolves lazily."""
+        key = (new_idx, existing_idx)
+        score = scores.get(key)
+        if score is not None:
+            return score
+        a, b = new_questions[new_idx], existing_questions[existing_idx]
+        if not a or not b or a == b:
+            return pair_score(new_idx, existing_idx)
+        if new_idx not in new_tokens:
+            new_tokens[new_idx] = set(a.split())
+            new_chars[new_idx] = Counter(a)
+        if existing_idx not in existing_tokens:
+            existing_tokens[existing_idx] = set(b.split())
+            existing_chars[existing_idx] = Counter(b)
+        cheap = cheap_similarity(a, b, new_tokens[new_idx], existing_tokens[existing_idx])
+        upper = ratio_upper_bound(a, b, new_chars[new_idx], existing_chars[existing_idx])
+        if upper <= cheap:
+            # SequenceMatcher cannot raise the score, so the cheap part is the exact score.
+            scores[key] = cheap
+            return cheap
+        return upper
+
+    def drain(heap: list[tuple[float, int, int]], min_score: float) -> None:
+        # Best-first one-to-one assignment. Indices are stored negated so ties prefer higher
+        # indices like the old pass 2 reverse sort, or as-is so they prefer lower ones like pass 3.
+        # Entries may hold an upper bound: the exact score is only computed once such an entry
+        # reaches the top with both cards still free, and it is requeued if the score is lower.
+        # Bounds never undershoot, so assignments come out exactly as with eager scoring.
+        while heap:
+            neg_score, neg_new, neg_existing = heap[0]
+            if -neg_score < min_score:
+                return
+            heapq.heappop(heap)
+            new_idx, existing_idx = abs(neg_new), abs(neg_existing)
+            if new_idx not in remaining_new or existing_idx not in remaining_existing:
+                continue
+            score = pair_score(new_idx, existing_idx)
+            if score < -neg_score:
+                heapq.heappush(heap, (-score, neg_new, neg_existing))
+                continue
+            assign(new_idx, existing_idx, score)
+
+    # Pass 2: high-confidence global matching over indexed candidate pairs only.
+    index = QuestionIndex(existing_questions)
+    heap: list[tuple[float, int, int]] = []
+    for new_idx in remaining_new:
+        for existing_idx in index.candidates(new_questions[new_idx], CANDIDATES_PER_QUESTION):
+            if existing_idx in remaining_existing:
+                heap.append((-pair_bound(new_idx, existing_idx), -new_idx, -existing_idx))
+    heapq.heapify(heap)
+    drain(heap, 0.60)
+
+    # Pass 3: force map the leftovers best-first (keeps IDs stable when counts match).
+    # Their cross product is small enough to rank globally in the usual case;
+    # pass 2 scores are reused. Oversized leftovers take their remaining
+    # candidate pairs first and are then paired in order.
+    if remaining_new and remaining_existing:
+        if len(remaining_new) * len(remaining_existing) <= PASS3_FULL_SCORE_LIMIT:
+            heap = [
+                (-pair_bound(new_idx, existing_idx), new_idx, existing_idx)
+                for new_idx in remaining_new
+                for existing_idx in remaining_existing
+            ]
+            heapq.heapify(heap)
+            drain(heap, float("-inf"))
+        else:
+            drain(heap, float("-inf"))
+            for new_idx, existing_idx in zip(sorted(remaining_new), sorted(remaining_existing)):
+                assign(new_idx, existing_idx, pair_score(new_idx, existing_idx))
+
+    return mapped, sorted(remaining_new), sorted(remaining_existing), scored_matches
+
+
+def now_iso() -> str:
+    return dt.datetime.now(dt.timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def build_card_payload(
+    topic_id: str,
+    question: str,
+    answer: str,
+    template: dict | None = None,
+    created_at: str = "",
+) -> dict:
+    template = template or {}
+    created_at = created_at or now_iso()
+    payload = {
+        "id": "",
+        "topicId": topic_id,
+        "type": template.get("type", "qa"),
+        "textAlign": template.get("textAlign", "center"),
+        "questionTextAlign": template.get("questionTextAlign", "center"),
+        "answerTextAlign": template.get("answerTextAlign", "center"),
+        "optionsTextAlign": template.get("optionsTextAlign", "left"),
+        "prompt": question,
+        "answer": answer,
+        "options": template.get("options", []),
+        "imagesQ": [],
+        "imagesA": [],
+        "imageDataQ": "",
+        "imageDataA": "",
+        "createdAt": created_at,
+        "meta": {"createdAt": created_at, "updatedAt": created_at},
+    }
+    return payload
+
+
+@dataclass
+class TopicPlan:
+    topic_name: str
+    topic_id: str
+    existing_count: int
+    rebuilt_count: int
+    low_confidence: int = 0
+    updates: list[tuple[str, dict, dict]] = field(default_factory=list)
+    inserts: list[dict] = field(default_factory=list)
+    deletes: list[ExistingCard] = field(default_factory=list)
+
+
+@dataclass
+class SyncPlan:
+    subject_id: str
+    topics: list[TopicPlan]
+    created_topics: list[dict] = field(default_factory=list)
+
+    @property
+    def total_updated(self) -> int:
+        return sum(len(topic.updates) for topic in self.topics)
+
+    @property
+    def total_inserted(self) -> int:
+        return sum(len(topic.inserts) for topic in self.topics)
+
+    @property
+    def total_deleted(self) -> int:
+        return sum(len(topic.deletes) for topic in self.topics)
+
+
+def load_mapping(mapping_path: Path | None, rebuilt_raw: dict) -> tuple[str, dict[str, str]]:
+    """Return (subject name from the mapping file or '', rebuilt topic key -> app topic name)."""
+    if mapping_path is None:
+        return "", {key: key for key, value in rebuilt_raw.items() if isinstance(value, list)}
+    raw = json.loads(mapping_path.read_text(encoding="utf-8"))
+    if not isinstance(raw, dict):
+        raise SystemExit(f"Mapping file must be a JSON object: {mapping_path}")
+    subject = ""
+    topics = raw
+    if isinstance(raw.get("topics"), dict):
+        subject = str(raw.get("subject", "") or "").strip()
+        topics = raw["topics"]
+    return subject, {str(key): str(value) for key, value in topics.items()}
+
+
+def load_rebuilt_topics(rebuilt_raw: dict, topic_map: dict[str, str]) -> dict[str, list[dict]]:
+    missing_topics = [t for t in topic_map if t not in rebuilt_raw]
+    if missing_topics:
+        raise SystemExit(f"Rebuilt JSON missing topics: {missing_topics}")
+    rebuilt_by_topic: dict[str, list[dict]] = {}
+    for rebuilt_topic_key, app_topic_name in topic_map.items():
+        cards = sorted(rebuilt_raw[rebuilt_topic_key], key=lambda item: qid_number(item.get("question_id", "")))
+        rebuilt_by_topic.setdefault(app_topic_name, []).extend(cards)
+    return rebuilt_by_topic
+
+
+def backup_database(db_path: Path, label: str) -> Path:
+    """Snapshot via the SQLite backup API so pages still in the WAL file are included."""
+    stamp = dt.datetime.now().strftime("%Y%m%d_%H%M%S")
+    backup_path = db_path.with_name(f"{db_path.stem}.backup_before_{label}_{stamp}{db_path.suffix}")
+    source = sqlite3.connect(str(db_path), timeout=30)
+    target = sqlite3.connect(str(backup_path))
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    return backup_path
+
+
+def plan_subject_sync(
+    conn: sqlite3.Connection,
+    subject_name: str,
+    rebuilt_by_topic: dict[str, list[dict]],
+    create_topics: bool = False,
+) -> SyncPlan:
+    """Compute the full card diff for one subject without writing anything."""
+    subject_row = conn.execute(
+        """
+        select record_key, payload
+        from records
+        where store='subjects' and json_extract(payload, '$.name') = ?
+        limit 1
+        """,
+        (subject_name,),
+    ).fetchone()
+    if subject_row is None:
+        raise SystemExit(f"Subject not found: {subject_name}")
+    subject_id = subject_row["record_key"]
+
+    topic_rows = conn.execute(
+        """
+        select record_key as topic_id, json_extract(payload, '$.name') as topic_name
+        from records
+        where store='topics' and json_extract(payload, '$.subjectId') = ?
+        """,
+        (subject_id,),
+    ).fetchall()
+    topic_id_by_name = {row["topic_name"]: row["topic_id"] for row in topic_rows}
+    created_topics: list[dict] = []
+    for app_topic_name in rebuilt_by_topic:
+        if app_topic_name in topic_id_by_name:
+            continue
+        if not create_topics:
+            raise SystemExit(f"Topic not found under subject '{subject_name}': {app_topic_name}")
+        topic = {"id": str(uuid.uuid4()), "subjectId": subject_id, "name": app_topic_name}
+        created_topics.append(topic)
+        topic_id_by_name[app_topic_name] = topic["id"]
+
+    existing_rows = conn.execute(
+        """
+        select c.record_key as card_id,
+               c.payload as payload,
+               json_extract(t.payload, '$.name') as topic_name
+        from records c
+        join records t
+          on t.store='topics' and t.record_key=json_extract(c.payload, '$.topicId')
+        where c.store='cards' and json_extract(t.payload, '$.subjectId') = ?
+        """,
+        (subject_id,),
+    ).fetchall()
+
+    existing_by_topic: dict[str, list[ExistingCard]] = {}
+    for row in existing_rows:
+        payload = resolve_payload(conn, row["payload"]) or {}
+        existing_by_topic.setdefault(row["topic_name"], []).append(
+            ExistingCard(
+                card_id=row["card_id"],
+                payload=payload,
+                norm_question=normalize(payload.get("prompt", "")),
+                norm_answer=normalize(payload.get("answer", "")),
+            )
+        )
+
+    stamp = now_iso()
+    plan = SyncPlan(subject_id=subject_id, topics=[], created_topics=created_topics)
+    for topic_name, rebuilt_cards in rebuilt_by_topic.items():
+        existing_cards = existing_by_topic.get(topic_name, [])
+        mapped, _, unmatched_existing, scored = match_cards(existing_cards, rebuilt_cards)
+        topic_id = topic_id_by_name[topic_name]
+        topic_plan = TopicPlan(
+            topic_name=topic_name,
+            topic_id=topic_id,
+            existing_count=len(existing_cards),
+            rebuilt_count=len(rebuilt_cards),
+            low_confidence=sum(1 for _, _, s in scored if s < LOW_CONFIDENCE_SCORE),
+        )
+        template_payload = existing_cards[0].payload if existing_cards else None
+
+        for new_idx, rebuilt_item in enumerate(rebuilt_cards):
+            question = rebuilt_item["question"]
+            answer = rebuilt_item["answer"]
+            if new_idx in mapped:
+                card = existing_cards[mapped[new_idx]]
+                changed = card.norm_question != normalize(question) or card.norm_answer != normalize(answer)
+                if not changed:
+                    continue
+                payload = dict(card.payload)
+                payload["prompt"] = question
+                payload["answer"] = answer
+                payload["topicId"] = topic_id
+                meta = payload.get("meta")
+                meta = dict(meta) if isinstance(meta, dict) else {}
+                meta["updatedAt"] = stamp
+                payload["meta"] = meta
+                topic_plan.updates.append((card.card_id, card.payload, payload))
+            else:
+                payload = build_card_payload(
+                    topic_id=topic_id,
+                    question=question,
+                    answer=answer,
+                    template=template_payload,
+                    created_at=stamp,
+                )
+                payload["id"] = str(uuid.uuid4())
+                topic_plan.inserts.append(payload)
+
+        # Delete leftovers if any existing cards were not matched to rebuilt source.
+        # This keeps DB exactly aligned to rebuilt JSON.
+        topic_plan.deletes = [existing_cards[idx] for idx in unmatched_existing]
+        plan.topics.append(topic_plan)
+    return plan
+
+
+def _preview(text: str) -> str:
+    flat = " ".join(str(text or "").split())
+    return flat if len(flat) <= DIFF_PREVIEW_CHARS else flat[: DIFF_PREVIEW_CHARS - 3] + "..."
+
+
+def print_plan_diff(plan: SyncPlan) -> None:
+    for topic in plan.created_topics:
+        print(f"+ topic {topic['id']}: {topic['name']}")
+    for topic_plan in plan.topics:
+        print(f"\n[{topic_plan.topic_name}]")
+        for card_id, before, after in topic_plan.updates:
+            print(f"~ {card_id}")
+            if normalize(before.get("prompt", "")) != normalize(after["prompt"]):
+                print(f"    Q- {_preview(before.get('prompt', ''))}")
+                print(f"    Q+ {_preview(after['prompt'])}")
+            if normalize(before.get("answer", "")) != normalize(after["answer"]):
+                print(f"    A- {_preview(before.get('answer', ''))}")
+                print(f"    A+ {_preview(after['answer'])}")
+        for payload in topic_plan.inserts:
+            print(f"+ {payload['id']}: {_preview(payload['prompt'])}")
+        for card in topic_plan.deletes:
+            print(f"- {card.card_id}: {_preview(card.payload.get('prompt', ''))}")
+
+
+def apply_plan(conn: sqlite3.Connection, plan: SyncPlan) -> None:
+    """
+    Write the whole plan in one transaction using executemany per statement.
+    Payloads are stored the way server.py stores them: card content shared by
+    cards and cardbank goes into one payload blob both rows reference, and
+    blobs left unreferenced by updated or deleted cards are collected after.
+    """
+    ts = int(time.time() * 1000)
+    blobs: dict[str, str] = {}
+
+    def stored(store: str, payload: dict) -> str:
+        row_payload, blob = prepare_payload(store, payload)
+        if blob is not None:
+            blobs[blob[0]] = blob[1]
+        return row_payload
+
+    topic_rows = [("topics", topic["id"], stored("topics", topic), ts) for topic in plan.created_topics]
+    update_rows: list[tuple[str, int, str, str]] = []
+    insert_rows: list[tuple[str, str, str, int]] = []
+    delete_rows: list[tuple[str, str]] = []
+    for topic_plan in plan.topics:
+        for card_id, _, payload in topic_plan.updates:
+            update_rows.extend((stored(store, payload), ts, store, card_id) for store in ("cards", "cardbank"))
+        for payload in topic_plan.inserts:
+            insert_rows.extend((store, payload["id"], stored(store, payload), ts) for store in ("cards", "cardbank"))
+        for card in topic_plan.deletes:
+            delete_rows.extend((store, card.card_id) for store in ("cards", "cardbank"))
+
+    with conn:
+        create_blobs_table(conn)
+        conn.executemany(
+            f"insert or ignore into {PAYLOAD_BLOBS_TABLE} (content_hash, content) values (?, ?)",
+            blobs.items(),
+        )
+        conn.executemany(
+            "insert into records(store, record_key, payload, updated_at) values (?, ?, ?, ?)",
+            topic_rows + insert_rows,
+        )
+        conn.executemany(
+            "update records set payload=?, updated_at=? where store=? and record_key=?",
+            update_rows,
+        )
+        conn.executemany("delete from records where store=? and record_key=?", delete_rows)
+    if update_rows or delete_rows:
+        collect_payload_blobs(conn)
+
+
+def print_post_update_counts(conn: sqlite3.Connection, subject_id: str, subject_name: str) -> None:
+    verify_rows = conn.execute(
+        """
+        select json_extract(t.payload, '$.name') as topic_name, count(*) as cnt
+        from records c
+        join records t
+          on t.store='topics' and t.record_key=json_extract(c.payload, '$.topicId')
+        where c.store='cards' and json_extract(t.payload, '$.subjectId')=?
+        group by topic_name
+        order by topic_name
+        """,
+        (subject_id,),
+    ).fetchall()
+    print("\nPost-update counts:")
+    total_cards = 0
+    for row in verify_rows:
+        total_cards += int(row["cnt"])
+        print(f"- {row['topic_name']}: {row['cnt']}")
+    print(f"Total cards in '{subject_name}': {total_cards}")
+
+
+def build_arg_parser(
+    description: str = __doc__,
+    json_default: str = "",
+    subject_default: str = "",
+) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="flashcards.sqlite3", help="Path to sqlite database")
+    parser.add_argument("--json", default=json_default or None, required=not json_default, help="Path to rebuilt JSON")
+    parser.add_argument("--mapping", default="", help="JSON file mapping rebuilt topic keys to app topic names")
+    parser.add_argument("--subject", default=subject_default, help="Subject name (overrides the mapping file)")
+    parser.add_argument("--create-topics", action="store_true", help="Create mapped topics missing under the subject")
+    parser.add_argument("--dry-run", action="store_true", help="Print the diff without writing to the database")
+    parser.add_argument("--no-backup", action="store_true", help="Skip DB backup creation")
+    return parser
+
+
+def run_sync(
+    args: argparse.Namespace,
+    default_topic_map: dict[str, str] | None = None,
+    backup_label: str = "subject_sync",
+) -> int:
+    db_path = Path(args.db)
+    rebuilt_path = Path(args.json)
+    if not db_path.exists():
+        raise SystemExit(f"Database not found: {db_path}")
+    if not rebuilt_path.exists():
+        raise SystemExit(f"Rebuilt JSON not found: {rebuilt_path}")
+
+    rebuilt_raw = json.loads(rebuilt_path.read_text(encoding="utf-8"))
+    mapping_path = Path(args.mapping) if args.mapping else None
+    if mapping_path is not None and not mapping_path.exists():
+        raise SystemExit(f"Mapping file not found: {mapping_path}")
+    mapping_subject, topic_map = load_mapping(mapping_path, rebuilt_raw)
+    if mapping_path is None and default_topic_map is not None:
+        topic_map = dict(default_topic_map)
+    subject_name = str(args.subject or "").strip() or mapping_subject
+    if not subject_name:
+        raise SystemExit("No subject given: pass --subject or set \"subject\" in the mapping file")
+    rebuilt_by_topic = load_rebuilt_topics(rebuilt_raw, topic_map)
+
+    conn = sqlite3.connect(str(db_path), timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        plan = plan_subject_sync(conn, subject_name, rebuilt_by_topic, create_topics=bool(args.create_topics))
+        for topic_plan in plan.topics:
+            if topic_plan.low_confidence:
+                print(f"[{topic_plan.topic_name}] low-confidence matches: {topic_plan.low_confidence}")
+
+        if args.dry_run:
+            print_plan_diff(plan)
+        else:
+            if not args.no_backup:
+                backup_path = backup_database(db_path, backup_label)
+                print(f"Backup created: {backup_path}")
+            apply_plan(conn, plan)
+
+        print("\nTopic summary:")
+        for topic_plan in plan.topics:
+            print(
+                f"- {topic_plan.topic_name}: existing={topic_plan.existing_count}, rebuilt={topic_plan.rebuilt_count}, "
+                f"updated={len(topic_plan.updates)}, inserted={len(topic_plan.inserts)}, deleted={len(topic_plan.deletes)}"
+            )
+        if args.dry_run:
+            print("\nDry run: no changes written.")
+        else:
+            print_post_update_counts(conn, plan.subject_id, subject_name)
+        print(
+            f"Mutations: updated={plan.total_updated}, inserted={plan.total_inserted}, "
+            f"deleted={plan.total_deleted}, topics created={len(plan.created_topics)}"
+        )
+    finally:
+        conn.close()
+
+    return 0
+
+
+def main() -> int:
+    return run_sync(build_arg_parser().parse_args())
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -8,17 +8,152 @@
 from __future__ import annotations
 
 import argparse
+import base64
+import codecs
+import contextlib
+import cProfile
+import functools
 import gzip
+import hashlib
+import io
+import itertools
 import json
+import math
+import os
+import pstats
+import queue
+import random
+import re
+import secrets
+import socket
+import shutil
 import sqlite3
 import sys
+import threading
 import time
+import uuid
+import zipfile
+import zlib
+from array import array
+from collections import Counter, OrderedDict, deque
+from datetime import datetime, timezone
 from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+from typing import Callable
 from urllib.parse import parse_qs, unquote, urlparse
 
+try:
+    import zstandard
+except ImportError:  # optional: zstd responses are offered only when installed
+    zstandard = None
+try:
+    import brotli
+except ImportError:  # optional: br responses are offered only when installed
+    brotli = None
+try:
+    import numpy
+except ImportError:  # optional: review forecasts and MinHash signatures fall back to plain loops
+    numpy = None
+
 ROOT_DIR = Path(__file__).resolve().parent
 DB_PATH = ROOT_DIR / "flashcards.sqlite3"
+BACKUP_DIR = ROOT_DIR / "backups"
+PROFILE_DIR = ROOT_DIR / "profiles"
+SHARD_DIR = ROOT_DIR / "shards"
+BACKUP_PREFIX = "flashcards-"
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP_S = 0.002
+LOOPBACK_ADDRESSES = {"127.0.0.1", "::1", "localhost"}
+CHANGE_BUFFER_SIZE = 2048
+CHANGE_PAYLOAD_MAX_BYTES = 64 * 1024
+CHANGE_SUBJECT_CACHE_SIZE = 8192
+SSE_HEARTBEAT_S = 15.0
+SSE_RETRY_MS = 3000
+# Bounded worker pool (--workers > 0). Lower number = served first.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+POOL_QUEUE_SIZE = 256
+POOL_KEEPALIVE_TIMEOUT_S = 5.0
+POOL_RETRY_AFTER_S = 1
+POOL_MAX_STREAMS = 32
+POOL_PEEK_BYTES = 512
+# Per-owner shards (--shard-dir): open shard handles kept warm and owner id format.
+SHARD_MAX_OPEN = 64
+SHARD_IDLE_S = 300.0
+SHARD_OWNER_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# Background maintenance (--maintenance-interval-s): PRAGMA optimize/ANALYZE, blob GC, incremental
+# vacuum and WAL truncation, started only after MAINTENANCE_QUIET_S without requests while the
+# request rate (EWMA over MAINTENANCE_RATE_WINDOW_S) is low, and cut off at the time budget.
+MAINTENANCE_INTERVAL_S = 60.0
+MAINTENANCE_QUIET_S = 10.0
+MAINTENANCE_IDLE_RPS = 0.5
+MAINTENANCE_RATE_WINDOW_S = 30.0
+MAINTENANCE_BUDGET_MS = 500.0
+MAINTENANCE_BUSY_MS = 100
+MAINTENANCE_ANALYZE_S = 6 * 3600.0
+MAINTENANCE_ANALYSIS_LIMIT = 1000
+MAINTENANCE_BLOBS_S = 3600.0
+MAINTENANCE_WAL_BYTES = 4 * 1024 * 1024
+MAINTENANCE_VACUUM_STEP_PAGES = 256
+# Review-load forecast (/api/review/forecast). FSRS forgetting curve R = (1 + FACTOR * t / S) ^ DECAY,
+# the same constants the client uses for its scheduling fallback.
+FORECAST_DAYS_DEFAULT = 30
+FORECAST_DAYS_MAX = 365
+FORECAST_CACHE_SIZE = 32
+FSRS_DECAY = -0.5
+FSRS_FACTOR = 19 / 81
+DAY_MS = 86_400_000
+# Server-built study sessions (/api/sessions): bounded TTL cache of ordered card-id queues.
+SESSION_MAX = 256
+SESSION_TTL_S = 2 * 3600.0
+SESSION_WINDOW_DEFAULT = 5
+SESSION_WINDOW_MAX = 50
+SESSION_SIZE_MAX = 5000
+SESSION_FILTERS = ("all", "notMastered", "correct", "wrong", "partial", "notAnswered", "notAnsweredYet")
+SESSION_IMAGE_FIELDS = ("imagesQ", "imagesA", "imagesExplain", "imageDataQ", "imageDataA", "imageData")
+SQL_IN_CHUNK = 500
+# Near-duplicate cards (/api/cards/duplicates): MinHash over 5-char shingles of the loose prompt,
+# LSH with 16 bands x 4 rows (a pair at Jaccard 0.85 shares a band with probability > 0.9999).
+NEAR_DUPE_THRESHOLD = 0.85
+NEAR_DUPE_THRESHOLD_MIN = 0.5
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+MINHASH_SHINGLE_CHARS = 5
+MINHASH_SEED = 0x5EED
+DUPLICATE_STORES = ("cards", "cardbank")
+DUPLICATE_CACHE_SIZE = 8
+LOOSE_STRIP_RE = re.compile(r"[^\w\s]+")
+# Bulk card import (POST /api/import and scripts/extract_vaia_html_to_json.py --db).
+IMPORT_BATCH = 500
+IMPORT_READ_CHUNK = 64 * 1024
+IMPORT_MAX_ROW_BYTES = 8 * 1024 * 1024
+IMPORT_SUBJECT_ACCENT = "#2dd4bf"
+# Same image marker sources the browser JSON import lifts into imagesQ/imagesA.
+IMPORT_IMAGE_MARKER_RE = re.compile(r"\[image\]\s*(sb://\S+|https?://\S+|/storage/v1/object/\S+)", re.IGNORECASE)
+IMPORT_CARDS_ARRAY_RE = re.compile(r'"cards"\s*:\s*\[')
+# Subject export (GET /api/export): stores in stream order and the chunk size written to the socket.
+EXPORT_STORES = ("subjects", "topics", "cards", "cardbank", "progress")
+EXPORT_FLUSH_BYTES = 64 * 1024
+EXPORT_FORMAT_VERSION = 1
+PROFILE_KEEP = 100
+PROFILE_STACK_INTERVAL_S = 0.005
+# Never profiled: admin endpoints (they serve the profiles) and long-lived streams.
+PROFILE_EXCLUDED_PREFIXES = ("/api/admin/", "/api/changes/stream")
+RESPONSE_MIN_COMPRESS_BYTES = 1024
+RESPONSE_MEDIUM_BYTES = 64 * 1024
+RESPONSE_LARGE_BYTES = 1024 * 1024
+# Load average per CPU above which responses use the fastest level.
+RESPONSE_BUSY_LOAD = 1.0
+# Levels per codec for (small body, medium body, large body or busy CPU).
+RESPONSE_CODEC_LEVELS = {
+    "zstd": (9, 5, 1),
+    "br": (6, 4, 1),
+    "gzip": (6, 5, 1),
+    "deflate": (6, 5, 1),
+}
+RESPONSE_CACHE_MIN_BYTES = 8 * 1024
+RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
 
 KEY_FIELDS = {
     "subjects": "id",
@@ -37,22 +172,1016 @@ BENIGN_NETWORK_ERRORS = (
 )
 
 
-def init_db() -> None:
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("PRAGMA journal_mode=WAL;")
-        conn.execute("PRAGMA synchronous=NORMAL;")
+SCHEMA_V1 = 1
+SCHEMA_V2 = 2
+STORE_TABLE_PREFIX = "store_"
+OTHER_STORES_TABLE = "records_other"
+# Small, hot rows are cheaper in a clustered WITHOUT ROWID b-tree; stores with
+# large payloads (cards, cardbank, knowledge) keep rowid tables.
+STORE_TABLE_OPTIONS = {"progress": "WITHOUT ROWID"}
+# Expression indexes matching the json_extract filters used by the HTTP API.
+STORE_JSON_INDEXES = {
+    "topics": ["subjectId"],
+    "cards": ["topicId"],
+    "cardbank": ["topicId"],
+}
+MIGRATION_BATCH_ROWS = 2000
+
+# Active storage layout, detected in init_db() and switched by migrate_to_v2().
+SCHEMA_LAYOUT = SCHEMA_V1
+_SCHEMA_LOCK = threading.Lock()
+
+
+# Per-thread request context: queue wait handed from pool workers, per-request SQL
+# counters and the owner shard a request is routed to.
+REQUEST_CONTEXT = threading.local()
+
+SQL_SLOW_MS = 20.0
+SQL_STATS_MAX_STATEMENTS = 500
+_SQL_PLACEHOLDER_RUN = re.compile(r"\?(\s*,\s*\?)+")
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace and IN (?, ?, ...) lists so one statement shape maps to one key."""
+    return _SQL_PLACEHOLDER_RUN.sub("?+", " ".join(sql.split()))
+
+
+class SqlStats:
+    """
+    Per-statement timing collected by InstrumentedConnection (--sql-stats).
+
+    Keeps totals per normalized statement and, the first time a statement
+    exceeds `slow_ms`, its EXPLAIN QUERY PLAN so full scans stand out.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.slow_ms = SQL_SLOW_MS
+        self.log_slow = False
+        self._lock = threading.Lock()
+        self._statements: dict[str, dict] = {}
+
+    def record(self, conn: sqlite3.Connection, sql: str, params, elapsed_ms: float, rows: int) -> None:
+        key = normalize_sql(sql)
+        context_count = getattr(REQUEST_CONTEXT, "sql_count", 0)
+        REQUEST_CONTEXT.sql_count = context_count + 1
+        REQUEST_CONTEXT.sql_ms = getattr(REQUEST_CONTEXT, "sql_ms", 0.0) + elapsed_ms
+        with self._lock:
+            entry = self._statements.get(key)
+            if entry is None:
+                if len(self._statements) >= SQL_STATS_MAX_STATEMENTS:
+                    return
+                entry = {
+                    "sql": key,
+                    "count": 0,
+                    "totalMs": 0.0,
+                    "maxMs": 0.0,
+                    "rows": 0,
+                    "plan": None,
+                    "fullScan": False,
+                }
+                self._statements[key] = entry
+            entry["count"] += 1
+            entry["totalMs"] += elapsed_ms
+            entry["maxMs"] = max(entry["maxMs"], elapsed_ms)
+            entry["rows"] += rows
+            needs_plan = elapsed_ms >= self.slow_ms and entry["plan"] is None
+        if not needs_plan:
+            return
+        plan = explain_query_plan(conn, sql, params)
+        with self._lock:
+            entry["plan"] = plan
+            entry["fullScan"] = plan_is_full_scan(key, plan)
+            REQUEST_CONTEXT.sql_slow = getattr(REQUEST_CONTEXT, "sql_slow", 0) + 1
+        if self.log_slow:
+            scan = " FULL-SCAN" if entry["fullScan"] else ""
+            print(f"[SQL] ms={elapsed_ms:.1f} rows={rows}{scan} sql={key[:200]} plan={' | '.join(plan)}")
+
+    def snapshot(self, limit: int = 50, reset: bool = False) -> list[dict]:
+        with self._lock:
+            items = sorted(self._statements.values(), key=lambda item: item["totalMs"], reverse=True)[:limit]
+            result = [
+                {
+                    **item,
+                    "totalMs": round(item["totalMs"], 2),
+                    "maxMs": round(item["maxMs"], 2),
+                    "avgMs": round(item["totalMs"] / max(1, item["count"]), 3),
+                }
+                for item in items
+            ]
+            if reset:
+                self._statements.clear()
+        return result
+
+
+SQL_STATS = SqlStats()
+
+
+def plan_is_full_scan(sql: str, plan: list[str]) -> bool:
+    """
+    True for a table scan, or for a json_extract filter that no expression index
+    serves (on schema v1 that is a SEARCH on store=? that still visits every row
+    of the store).
+    """
+    if any(line.startswith("SCAN ") and "COVERING INDEX" not in line for line in plan):
+        return True
+    where = sql.upper().partition(" WHERE ")[2]
+    return "JSON_EXTRACT(" in where and not any("<expr>" in line for line in plan)
+
+
+def explain_query_plan(conn: sqlite3.Connection, sql: str, params) -> list[str]:
+    statement = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+    if statement not in ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE"):
+        return []
+    try:
+        rows = sqlite3.Connection.execute(conn, f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    except sqlite3.Error as err:
+        return [f"(plan unavailable: {err})"]
+    return [str(row[3]) for row in rows]
+
+
+class StatementCursor:
+    """
+    Cursor of an instrumented query. Rows stream from SQLite as the caller
+    fetches them; time spent in execute and fetches and the row count add up
+    until the cursor is exhausted, closed or dropped, and are then recorded.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, cursor: sqlite3.Cursor, sql: str, params, elapsed_ms: float) -> None:
+        self._conn = conn
+        self._cursor = cursor
+        self._sql = sql
+        self._params = params
+        self._elapsed_ms = elapsed_ms
+        self._rows = 0
+        self._recorded = False
+
+    def __getattr__(self, name: str):
+        return getattr(self._cursor, name)
+
+    def _fetch(self, fetch, *args):
+        t0 = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            self._elapsed_ms += (time.perf_counter() - t0) * 1000.0
+
+    def fetchone(self):
+        row = self._fetch(self._cursor.fetchone)
+        if row is None:
+            self._record()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size: int | None = None) -> list:
+        size = self._cursor.arraysize if size is None else size
+        rows = self._fetch(self._cursor.fetchmany, size)
+        self._rows += len(rows)
+        if len(rows) < size:
+            self._record()
+        return rows
+
+    def fetchall(self) -> list:
+        rows = self._fetch(self._cursor.fetchall)
+        self._rows += len(rows)
+        self._record()
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def close(self) -> None:
+        self._cursor.close()
+        self._record()
+
+    def __del__(self) -> None:
+        # Callers often take fetchone() and drop the cursor without exhausting it.
+        if not getattr(self, "_recorded", True):
+            self._record()
+
+    def _record(self) -> None:
+        if self._recorded:
+            return
+        self._recorded = True
+        SQL_STATS.record(self._conn, self._sql, self._params, self._elapsed_ms, self._rows)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def execute(self, sql: str, parameters=()):
+        t0 = time.perf_counter()
+        cursor = super().execute(sql, parameters)
+        elapsed_ms = (time.perf_counter() - t0) * 1000.0
+        if cursor.description is not None:
+            return StatementCursor(self, cursor, sql, parameters, elapsed_ms)
+        SQL_STATS.record(self, sql, parameters, elapsed_ms, max(cursor.rowcount, 0))
+        return cursor
+
+    def executemany(self, sql: str, seq_of_parameters):
+        t0 = time.perf_counter()
+        cursor = super().executemany(sql, seq_of_parameters)
+        SQL_STATS.record(self, sql, (), (time.perf_counter() - t0) * 1000.0, max(cursor.rowcount, 0))
+        return cursor
+
+
+# Per-connection PRAGMAs for --db-profile. "default" keeps SQLite's defaults.
+DB_PROFILES: dict[str, dict[str, int | str]] = {
+    "default": {},
+    "lan-small": {
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -8 * 1024,
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "wal_autocheckpoint": 1000,
+    },
+    "large-deck": {
+        "synchronous": "NORMAL",
+        "busy_timeout": 10000,
+        "cache_size": -64 * 1024,
+        "mmap_size": 1024 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "wal_autocheckpoint": 4000,
+    },
+    "low-memory": {
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -1024,
+        "mmap_size": 0,
+        "temp_store": "FILE",
+        "wal_autocheckpoint": 500,
+    },
+}
+DB_PROFILE = "default"
+
+
+def apply_db_profile(conn: sqlite3.Connection, profile: str | None = None, skip: tuple[str, ...] = ()) -> None:
+    # Base-class execute keeps these out of --sql-stats.
+    for name, value in DB_PROFILES[DB_PROFILE if profile is None else profile].items():
+        if name not in skip:
+            sqlite3.Connection.execute(conn, f"PRAGMA {name} = {value}")
+
+
+def current_db_path() -> Path:
+    """Database of the current request: its owner shard when sharding routed it, else DB_PATH."""
+    return getattr(REQUEST_CONTEXT, "db_path", None) or DB_PATH
+
+
+def connect_db(path: Path | str | None = None, **kwargs) -> sqlite3.Connection:
+    """
+    Open a connection to the app database (or the request's owner shard) with
+    the active --db-profile PRAGMAs applied (instrumented when --sql-stats is on).
+    """
+    if SQL_STATS.enabled:
+        kwargs.setdefault("factory", InstrumentedConnection)
+    conn = sqlite3.connect(current_db_path() if path is None else path, **kwargs)
+    # An explicit timeout= (long-running maintenance) wins over the profile's busy_timeout.
+    apply_db_profile(conn, skip=("busy_timeout",) if "timeout" in kwargs else ())
+    return conn
+
+
+def db_profile_report() -> dict:
+    """Effective settings of a fresh connection, for the startup report."""
+    with connect_db() as conn:
+        settings = {
+            name: sqlite3.Connection.execute(conn, f"PRAGMA {name}").fetchone()[0]
+            for name in ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size", "temp_store")
+        }
+        settings["wal_autocheckpoint"] = sqlite3.Connection.execute(conn, "PRAGMA wal_autocheckpoint").fetchone()[0]
+        page_size = sqlite3.Connection.execute(conn, "PRAGMA page_size").fetchone()[0]
+        page_count = sqlite3.Connection.execute(conn, "PRAGMA page_count").fetchone()[0]
+    db_bytes = int(page_size) * int(page_count)
+    settings["dbBytes"] = db_bytes
+    settings["walBytes"] = wal_bytes(current_db_path())
+    settings["mmapCoversDb"] = int(settings["mmap_size"]) >= db_bytes > 0
+    return {"profile": DB_PROFILE, **settings}
+
+
+def wal_bytes(path: Path) -> int:
+    try:
+        return Path(f"{path}-wal").stat().st_size
+    except OSError:
+        return 0
+
+
+def store_table(store: str) -> str:
+    if store not in KEY_FIELDS:
+        raise ValueError(f"Unknown store: {store}")
+    return f"{STORE_TABLE_PREFIX}{store}"
+
+
+def store_scope(store: str) -> tuple[str, str, tuple]:
+    """Return (table, WHERE condition selecting `store`, params) for the active layout."""
+    if SCHEMA_LAYOUT == SCHEMA_V2:
+        return store_table(store), "1 = 1", ()
+    return "records", "store = ?", (store,)
+
+
+def detect_schema_layout(conn: sqlite3.Connection) -> int:
+    version = int(conn.execute("PRAGMA user_version").fetchone()[0] or 0)
+    return SCHEMA_V2 if version >= SCHEMA_V2 else SCHEMA_V1
+
+
+def _create_store_tables(conn: sqlite3.Connection) -> None:
+    for store in KEY_FIELDS:
+        table = store_table(store)
         conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS records (
-                store TEXT NOT NULL,
-                record_key TEXT NOT NULL,
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                record_key TEXT NOT NULL PRIMARY KEY,
                 payload TEXT NOT NULL,
-                updated_at INTEGER NOT NULL,
-                PRIMARY KEY (store, record_key)
-            )
+                updated_at INTEGER NOT NULL
+            ) {STORE_TABLE_OPTIONS.get(store, "")}
             """
         )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_updated_at ON {table}(updated_at)")
+        for field in STORE_JSON_INDEXES.get(store, []):
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_{field} ON {table}(json_extract(payload, '$.{field}'))"
+            )
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {OTHER_STORES_TABLE} (
+            store TEXT NOT NULL,
+            record_key TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            updated_at INTEGER NOT NULL,
+            PRIMARY KEY (store, record_key)
+        )
+        """
+    )
+
+
+def _create_compat_view(conn: sqlite3.Connection) -> None:
+    """
+    Recreate `records` as a view over the per-store tables so scripts that read
+    and write `records` keep working. INSTEAD OF triggers route writes; use
+    INSERT OR REPLACE rather than ON CONFLICT upserts, which views do not support.
+    """
+    selects = [
+        f"SELECT '{store}' AS store, record_key, payload, updated_at FROM {store_table(store)}" for store in KEY_FIELDS
+    ]
+    selects.append(f"SELECT store, record_key, payload, updated_at FROM {OTHER_STORES_TABLE}")
+    conn.execute("DROP VIEW IF EXISTS records")
+    conn.execute("CREATE VIEW records AS " + " UNION ALL ".join(selects))
+
+    known = ", ".join(f"'{store}'" for store in KEY_FIELDS)
+    inserts = [
+        f"INSERT OR REPLACE INTO {store_table(store)} (record_key, payload, updated_at) "
+        f"SELECT NEW.record_key, NEW.payload, NEW.updated_at WHERE NEW.store = '{store}';"
+        for store in KEY_FIELDS
+    ]
+    inserts.append(
+        f"INSERT OR REPLACE INTO {OTHER_STORES_TABLE} (store, record_key, payload, updated_at) "
+        f"SELECT NEW.store, NEW.record_key, NEW.payload, NEW.updated_at WHERE NEW.store NOT IN ({known});"
+    )
+    updates = [
+        f"UPDATE {store_table(store)} SET record_key = NEW.record_key, payload = NEW.payload, "
+        f"updated_at = NEW.updated_at WHERE OLD.store = '{store}' AND record_key = OLD.record_key;"
+        for store in KEY_FIELDS
+    ]
+    updates.append(
+        f"UPDATE {OTHER_STORES_TABLE} SET record_key = NEW.record_key, payload = NEW.payload, "
+        f"updated_at = NEW.updated_at WHERE store = OLD.store AND record_key = OLD.record_key "
+        f"AND OLD.store NOT IN ({known});"
+    )
+    deletes = [
+        f"DELETE FROM {store_table(store)} WHERE OLD.store = '{store}' AND record_key = OLD.record_key;"
+        for store in KEY_FIELDS
+    ]
+    deletes.append(
+        f"DELETE FROM {OTHER_STORES_TABLE} WHERE store = OLD.store AND record_key = OLD.record_key "
+        f"AND OLD.store NOT IN ({known});"
+    )
+    for name, event, body in (
+        ("records_insert", "INSERT", inserts),
+        ("records_update", "UPDATE", updates),
+        ("records_delete", "DELETE", deletes),
+    ):
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"CREATE TRIGGER {name} INSTEAD OF {event} ON records BEGIN {' '.join(body)} END")
+
+
+# At-rest payload compression (opt-in via --payload-compression). Compressed rows
+# stay valid JSON: an envelope keeping the key and indexed filter fields in clear,
+# plus "<codec>:<base64 data>" under PAYLOAD_CODEC_KEY. Rows without the marker
+# are plain JSON, so both formats can coexist in one table.
+PAYLOAD_CODEC_KEY = "__z"
+PAYLOAD_CODECS = ("off", "zlib", "zdict")
+PAYLOAD_COMPRESS_STORES = ("cards", "cardbank", "knowledge")
+PAYLOAD_COMPRESS_MIN_BYTES = 512
+# Keep the compressed form only if it is at most this fraction of the plain size.
+PAYLOAD_COMPRESS_MAX_RATIO = 0.8
+PAYLOAD_COMPRESS_LEVEL = 6
+# Preset dictionary built from the card record shape written by the frontend.
+# Rows encoded with it are tagged "zd1"; never edit it in place, add a v2 instead.
+PAYLOAD_ZDICT_V1 = (
+    b'{"text":"","correct":false,"order":2},{"text":"","correct":true,"order":1}],'
+    b'"imagesQ":[],"imagesA":[],"imagesExplain":[],"imageDataQ":"","imageDataA":"",'
+    b'"imageData":"","data:image/png;base64,","data:image/jpeg;base64,",'
+    b'"optionsRequireOrder":false,"explanation":"","options":[],'
+    b'"meta":{"createdAt":"","updatedAt":""},"updatedAt":"","createdAt":"2025-",'
+    b'"createdAt":"2026-","T00:00:00.000Z","source":"","subjectId":"","cardId":"",'
+    b' the and of to in is for that are with as by on which be this from or an '
+    b'"type":"mcq","type":"qa","textAlign":"center","questionTextAlign":"center",'
+    b'"answerTextAlign":"center","optionsTextAlign":"center","textAlign":"left",'
+    b'{"id":"","topicId":"","type":"qa","textAlign":"center","questionTextAlign":"center",'
+    b'"answerTextAlign":"center","optionsTextAlign":"center","prompt":"","answer":"",'
+)
+PAYLOAD_COMPRESSION = "off"
+
+
+def payload_plain_fields(store: str) -> list[str]:
+    """Fields kept outside the compressed blob so SQL filters and indexes still see them."""
+    return [KEY_FIELDS[store], *STORE_JSON_INDEXES.get(store, [])]
+
+
+def _compress_bytes(raw: bytes, codec: str) -> tuple[str, bytes]:
+    if codec == "zdict":
+        compressor = zlib.compressobj(PAYLOAD_COMPRESS_LEVEL, zdict=PAYLOAD_ZDICT_V1)
+        return "zd1", compressor.compress(raw) + compressor.flush()
+    return "z", zlib.compress(raw, PAYLOAD_COMPRESS_LEVEL)
+
+
+def encode_payload(store: str, record: dict, payload: str, codec: str | None = None) -> str:
+    """Return the stored form of `payload`: compressed envelope when worthwhile, else unchanged."""
+    codec = PAYLOAD_COMPRESSION if codec is None else codec
+    if codec == "off" or store not in PAYLOAD_COMPRESS_STORES:
+        return payload
+    raw = payload.encode("utf-8")
+    if len(raw) < PAYLOAD_COMPRESS_MIN_BYTES:
+        return payload
+    marker, data = _compress_bytes(raw, codec)
+    envelope = {field: record[field] for field in payload_plain_fields(store) if field in record}
+    envelope[PAYLOAD_CODEC_KEY] = f"{marker}:{base64.b64encode(data).decode('ascii')}"
+    packed = json.dumps(envelope, separators=(",", ":"), ensure_ascii=False)
+    if len(packed.encode("utf-8")) > len(raw) * PAYLOAD_COMPRESS_MAX_RATIO:
+        return payload
+    return packed
+
+
+def decode_payload(payload: str | bytes) -> dict | None:
+    """Parse a stored payload (plain or compressed envelope) into a record dict."""
+    try:
+        parsed = json.loads(payload)
+    except (json.JSONDecodeError, TypeError, UnicodeDecodeError):
+        return None
+    if not isinstance(parsed, dict):
+        return None
+    packed = parsed.get(PAYLOAD_CODEC_KEY)
+    if not isinstance(packed, str):
+        return parsed
+    marker, _, data = packed.partition(":")
+    try:
+        raw = base64.b64decode(data)
+        if marker == "zd1":
+            decompressor = zlib.decompressobj(zdict=PAYLOAD_ZDICT_V1)
+            raw = decompressor.decompress(raw) + decompressor.flush()
+        elif marker == "z":
+            raw = zlib.decompress(raw)
+        else:
+            return None
+        parsed = json.loads(raw)
+    except (ValueError, zlib.error):
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+# Card content shared by `cards` and `cardbank` is stored once in PAYLOAD_BLOBS_TABLE,
+# keyed by a hash of the plain JSON. The store rows keep a small envelope with the
+# key/filter fields and the hash under PAYLOAD_REF_KEY.
+PAYLOAD_REF_KEY = "__ref"
+PAYLOAD_BLOBS_TABLE = "payload_blobs"
+PAYLOAD_DEDUPE_STORES = ("cards", "cardbank")
+PAYLOAD_DEDUPE_MIN_BYTES = 256
+
+
+def payload_hash(payload: str) -> str:
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def payload_source(store: str, table: str) -> tuple[str, str]:
+    """Return (payload expression, join clause) that resolves deduplicated content in SQL."""
+    if store not in PAYLOAD_DEDUPE_STORES:
+        return "payload", ""
+    return (
+        f"COALESCE({PAYLOAD_BLOBS_TABLE}.content, {table}.payload)",
+        f"LEFT JOIN {PAYLOAD_BLOBS_TABLE} ON {PAYLOAD_BLOBS_TABLE}.content_hash = "
+        f"json_extract({table}.payload, '$.{PAYLOAD_REF_KEY}')",
+    )
+
+
+def prepare_payload(store: str, record: dict) -> tuple[str, tuple[str, str] | None]:
+    """
+    Build the stored row payload for `record` and, for deduplicated stores, the
+    (hash, content) blob it references.
+    """
+    plain = json.dumps(record, separators=(",", ":"), ensure_ascii=False)
+    if store not in PAYLOAD_DEDUPE_STORES or len(plain) < PAYLOAD_DEDUPE_MIN_BYTES:
+        return encode_payload(store, record, plain), None
+    digest = payload_hash(plain)
+    envelope = {field: record[field] for field in payload_plain_fields(store) if field in record}
+    envelope[PAYLOAD_REF_KEY] = digest
+    stored = json.dumps(envelope, separators=(",", ":"), ensure_ascii=False)
+    return stored, (digest, encode_payload(store, record, plain))
+
+
+def resolve_payload(conn: sqlite3.Connection, payload: str | bytes) -> dict | None:
+    """decode_payload() that also follows blob references; for scripts reading `records` directly."""
+    parsed = decode_payload(payload)
+    ref = parsed.get(PAYLOAD_REF_KEY) if parsed is not None else None
+    if not isinstance(ref, str):
+        return parsed
+    row = conn.execute(f"SELECT content FROM {PAYLOAD_BLOBS_TABLE} WHERE content_hash = ?", (ref,)).fetchone()
+    return decode_payload(row[0]) if row else None
+
+
+def create_blobs_table(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {PAYLOAD_BLOBS_TABLE} (
+            content_hash TEXT NOT NULL PRIMARY KEY,
+            content TEXT NOT NULL
+        )
+        """
+    )
+
+
+# Knowledge retrieval: record text is split into ~KNOWLEDGE_CHUNK_TOKENS passages (tokens estimated as
+# chars / 4, like js/knowledge-base.js) stored in knowledge_chunks and indexed by an external-content
+# FTS5 table ranked with BM25. KNOWLEDGE_FTS is cleared when this SQLite build lacks FTS5.
+KNOWLEDGE_CHUNKS_TABLE = "knowledge_chunks"
+KNOWLEDGE_FTS_TABLE = "knowledge_fts"
+KNOWLEDGE_CHUNK_TOKENS = 200
+KNOWLEDGE_CHARS_PER_TOKEN = 4
+KNOWLEDGE_SEARCH_K_DEFAULT = 5
+KNOWLEDGE_SEARCH_K_MAX = 20
+KNOWLEDGE_QUERY_MAX_TERMS = 32
+KNOWLEDGE_FTS = True
+
+
+def knowledge_tokens(text: str) -> int:
+    return -(-len(text) // KNOWLEDGE_CHARS_PER_TOKEN)
+
+
+def chunk_knowledge_text(text: str, max_tokens: int = KNOWLEDGE_CHUNK_TOKENS) -> list[str]:
+    """
+    Split text into passages of at most `max_tokens`, packing whole paragraphs
+    and breaking longer ones at sentence, then word, boundaries.
+    """
+    limit = max(1, max_tokens) * KNOWLEDGE_CHARS_PER_TOKEN
+    chunks: list[str] = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = " ".join(paragraph.split())
+        pieces: list[str] = []
+        while len(paragraph) > limit:
+            cut = paragraph.rfind(". ", limit // 2, limit) + 1
+            if cut <= 0:
+                cut = paragraph.rfind(" ", limit // 2, limit)
+            if cut <= 0:
+                cut = limit
+            pieces.append(paragraph[:cut].strip())
+            paragraph = paragraph[cut:].strip()
+        if paragraph:
+            pieces.append(paragraph)
+        for piece in pieces:
+            if current and len(current) + 1 + len(piece) > limit:
+                chunks.append(current)
+                current = ""
+            current = f"{current}\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def index_knowledge_record(conn: sqlite3.Connection, key: str, record: dict | None) -> int:
+    """Replace the indexed passages of one knowledge record; None (or no inline text) just removes them."""
+    if not KNOWLEDGE_FTS:
+        return 0
+    conn.execute(f"DELETE FROM {KNOWLEDGE_CHUNKS_TABLE} WHERE record_key = ?", (key,))
+    text = record.get("text") if record is not None else None
+    if not isinstance(text, str) or not text.strip():
+        return 0
+    subject_id = str(record.get("subjectId") or "")
+    title = str(record.get("filename") or "")
+    rows = [
+        (key, subject_id, title, number, knowledge_tokens(chunk), chunk)
+        for number, chunk in enumerate(chunk_knowledge_text(text))
+    ]
+    conn.executemany(
+        f"INSERT INTO {KNOWLEDGE_CHUNKS_TABLE} (record_key, subject_id, title, chunk_no, tokens, text) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+    return len(rows)
+
+
+def create_knowledge_index(conn: sqlite3.Connection) -> None:
+    """Create the knowledge passage index; when it is new, fill it from existing knowledge records."""
+    global KNOWLEDGE_FTS
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (KNOWLEDGE_FTS_TABLE,)).fetchone():
+        return
+    try:
+        conn.execute(
+            f"CREATE VIRTUAL TABLE {KNOWLEDGE_FTS_TABLE} USING fts5("
+            f"text, content='{KNOWLEDGE_CHUNKS_TABLE}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+        )
+    except sqlite3.OperationalError:
+        KNOWLEDGE_FTS = False
+        return
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {KNOWLEDGE_CHUNKS_TABLE} (
+            id INTEGER PRIMARY KEY,
+            record_key TEXT NOT NULL,
+            subject_id TEXT NOT NULL,
+            title TEXT NOT NULL,
+            chunk_no INTEGER NOT NULL,
+            tokens INTEGER NOT NULL,
+            text TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_{KNOWLEDGE_CHUNKS_TABLE}_record ON {KNOWLEDGE_CHUNKS_TABLE} (record_key)"
+    )
+    conn.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {KNOWLEDGE_CHUNKS_TABLE}_ai AFTER INSERT ON {KNOWLEDGE_CHUNKS_TABLE} BEGIN "
+        f"INSERT INTO {KNOWLEDGE_FTS_TABLE} (rowid, text) VALUES (new.id, new.text); END"
+    )
+    conn.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {KNOWLEDGE_CHUNKS_TABLE}_ad AFTER DELETE ON {KNOWLEDGE_CHUNKS_TABLE} BEGIN "
+        f"INSERT INTO {KNOWLEDGE_FTS_TABLE} ({KNOWLEDGE_FTS_TABLE}, rowid, text) VALUES ('delete', old.id, old.text); END"
+    )
+    conn.execute(f"DELETE FROM {KNOWLEDGE_CHUNKS_TABLE}")
+    # `records` is a table (v1) or the compatibility view (v2), so this works before SCHEMA_LAYOUT is set.
+    for key, payload in conn.execute("SELECT record_key, payload FROM records WHERE store = 'knowledge'").fetchall():
+        index_knowledge_record(conn, key, decode_payload(payload))
+
+
+def knowledge_match_query(text: str) -> str:
+    """FTS5 MATCH expression OR-ing the quoted words of a free-text query (BM25 ranks the rest)."""
+    terms = list(dict.fromkeys(re.findall(r"\w+", text.lower())))[:KNOWLEDGE_QUERY_MAX_TERMS]
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+def search_knowledge(subject_id: str, query: str, k: int = KNOWLEDGE_SEARCH_K_DEFAULT) -> list[dict]:
+    match = knowledge_match_query(query)
+    if not match:
+        return []
+    with connect_db() as conn:
+        rows = conn.execute(
+            f"""
+            SELECT c.record_key, c.title, c.chunk_no, c.tokens, c.text, bm25({KNOWLEDGE_FTS_TABLE}) AS rank
+            FROM {KNOWLEDGE_FTS_TABLE}
+            JOIN {KNOWLEDGE_CHUNKS_TABLE} AS c ON c.id = {KNOWLEDGE_FTS_TABLE}.rowid
+            WHERE {KNOWLEDGE_FTS_TABLE} MATCH ? AND c.subject_id = ?
+            ORDER BY rank
+            LIMIT ?
+            """,
+            (match, subject_id, k),
+        ).fetchall()
+    return [
+        {
+            "knowledgeId": key,
+            "filename": title,
+            "chunk": chunk_no,
+            "tokens": tokens,
+            "score": round(-rank, 4),
+            "text": text,
+        }
+        for key, title, chunk_no, tokens, text, rank in rows
+    ]
+
+
+def _create_records_table(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS records (
+            store TEXT NOT NULL,
+            record_key TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            updated_at INTEGER NOT NULL,
+            PRIMARY KEY (store, record_key)
+        )
+        """
+    )
+
+
+def init_db() -> None:
+    global SCHEMA_LAYOUT
+    with connect_db() as conn:
+        # Only takes effect on a new, empty file; lets maintenance return free pages incrementally.
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        layout = detect_schema_layout(conn)
+        if layout == SCHEMA_V2:
+            _create_store_tables(conn)
+        else:
+            _create_records_table(conn)
+        create_blobs_table(conn)
+        create_knowledge_index(conn)
+        create_signatures_table(conn)
         conn.commit()
+    SCHEMA_LAYOUT = layout
+
+
+def ensure_shard_schema(path: Path) -> int:
+    """
+    Create or upgrade an owner shard so it uses the main database's layout.
+    New shards are created directly in that layout; existing v1 shards are
+    migrated. The caller serializes setup of the same shard.
+    """
+    with connect_db(path) as conn:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        conn.execute("PRAGMA journal_mode=WAL;")
+        layout = detect_schema_layout(conn)
+        has_records = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'records'").fetchone() is not None
+        if SCHEMA_LAYOUT == SCHEMA_V2 and layout == SCHEMA_V1 and not has_records:
+            _create_store_tables(conn)
+            _create_compat_view(conn)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_V2}")
+            layout = SCHEMA_V2
+        elif layout == SCHEMA_V2:
+            _create_store_tables(conn)
+        else:
+            _create_records_table(conn)
+        create_blobs_table(conn)
+        create_knowledge_index(conn)
+        create_signatures_table(conn)
+        conn.commit()
+    if layout == SCHEMA_LAYOUT:
+        return layout
+    if layout == SCHEMA_V2:
+        raise RuntimeError(f"Shard {path.name} uses schema v{SCHEMA_V2}; migrate the main database first")
+    migrate_to_v2(path=path)
+    return SCHEMA_V2
+
+
+def migrate_to_v2(batch_rows: int = MIGRATION_BATCH_ROWS, path: Path | None = None) -> dict:
+    """
+    Online migration from the single `records` table to one table per store.
+
+    Rows are copied in short rowid-ranged batches while the server keeps using
+    `records`; the final switch re-copies rows written during the copy, drops
+    rows deleted meanwhile and replaces `records` with the compatibility view,
+    all in one IMMEDIATE transaction.
+
+    With `path` (an owner shard) that file is migrated instead of the current
+    database; SCHEMA_LAYOUT is left alone and the caller serializes the call.
+    """
+    global SCHEMA_LAYOUT
+    t0 = time.perf_counter()
+    with _SCHEMA_LOCK if path is None else contextlib.nullcontext():
+        conn = connect_db(path, timeout=30, isolation_level=None)
+        try:
+            if detect_schema_layout(conn) == SCHEMA_V2:
+                if path is None:
+                    SCHEMA_LAYOUT = SCHEMA_V2
+                return {"migrated": False, "layout": SCHEMA_V2, "rows": 0, "ms": 0.0}
+            started_at = int(time.time() * 1000)
+            conn.execute("BEGIN")
+            _create_store_tables(conn)
+            conn.execute("COMMIT")
+
+            known = tuple(KEY_FIELDS)
+            placeholders = ",".join("?" for _ in known)
+
+            def copy_rows(condition: str, params: tuple) -> int:
+                copied = 0
+                for store in known:
+                    copied += conn.execute(
+                        f"""
+                        INSERT OR REPLACE INTO {store_table(store)} (record_key, payload, updated_at)
+                        SELECT record_key, payload, updated_at FROM records WHERE store = ? AND {condition}
+                        """,
+                        (store, *params),
+                    ).rowcount
+                copied += conn.execute(
+                    f"""
+                    INSERT OR REPLACE INTO {OTHER_STORES_TABLE} (store, record_key, payload, updated_at)
+                    SELECT store, record_key, payload, updated_at FROM records
+                    WHERE store NOT IN ({placeholders}) AND {condition}
+                    """,
+                    (*known, *params),
+                ).rowcount
+                return copied
+
+            max_rowid = int(conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM records").fetchone()[0])
+            copied = 0
+            for low in range(0, max_rowid + 1, max(1, batch_rows)):
+                conn.execute("BEGIN")
+                copied += copy_rows("rowid >= ? AND rowid < ?", (low, low + batch_rows))
+                conn.execute("COMMIT")
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                copy_rows("updated_at >= ?", (started_at,))
+                for store in known:
+                    conn.execute(
+                        f"""
+                        DELETE FROM {store_table(store)}
+                        WHERE record_key NOT IN (SELECT record_key FROM records WHERE store = ?)
+                        """,
+                        (store,),
+                    )
+                conn.execute(
+                    f"""
+                    DELETE FROM {OTHER_STORES_TABLE}
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM records r
+                        WHERE r.store = {OTHER_STORES_TABLE}.store AND r.record_key = {OTHER_STORES_TABLE}.record_key
+                    )
+                    """
+                )
+                conn.execute("DROP TABLE records")
+                _create_compat_view(conn)
+                conn.execute(f"PRAGMA user_version = {SCHEMA_V2}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            if path is None:
+                SCHEMA_LAYOUT = SCHEMA_V2
+            conn.execute("ANALYZE")
+        finally:
+            conn.close()
+    return {
+        "migrated": True,
+        "layout": SCHEMA_V2,
+        "rows": copied,
+        "ms": round((time.perf_counter() - t0) * 1000.0, 1),
+    }
+
+
+def rewrite_payloads(codec: str, batch_rows: int = MIGRATION_BATCH_ROWS) -> dict:
+    """
+    Re-encode stored payloads of the compressible stores and the shared content
+    blobs with `codec` ("off" decompresses everything). updated_at is left
+    alone: content is unchanged.
+    """
+    t0 = time.perf_counter()
+    stats = {"rows": 0, "rewritten": 0, "bytesBefore": 0, "bytesAfter": 0}
+    for store in PAYLOAD_COMPRESS_STORES:
+        table, scope, scope_params = store_scope(store)
+        with connect_db(timeout=30) as conn:
+            rows = conn.execute(f"SELECT record_key, payload FROM {table} WHERE {scope}", scope_params).fetchall()
+            for start in range(0, len(rows), max(1, batch_rows)):
+                updates: list[tuple] = []
+                for key, payload in rows[start : start + batch_rows]:
+                    record = decode_payload(payload)
+                    if record is None:
+                        continue
+                    stored = encode_payload(
+                        store, record, json.dumps(record, separators=(",", ":"), ensure_ascii=False), codec
+                    )
+                    stats["rows"] += 1
+                    stats["bytesBefore"] += len(str(payload).encode("utf-8"))
+                    stats["bytesAfter"] += len(stored.encode("utf-8"))
+                    if stored != payload:
+                        updates.append((stored, *scope_params, key))
+                conn.executemany(f"UPDATE {table} SET payload = ? WHERE {scope} AND record_key = ?", updates)
+                conn.commit()
+                stats["rewritten"] += len(updates)
+    with connect_db(timeout=30) as conn:
+        rows = conn.execute(f"SELECT content_hash, content FROM {PAYLOAD_BLOBS_TABLE}").fetchall()
+        updates = []
+        for digest, content in rows:
+            record = decode_payload(content)
+            if record is None:
+                continue
+            # Blob content is card-shaped, so encode it with the cards plain fields.
+            stored = encode_payload(
+                "cards", record, json.dumps(record, separators=(",", ":"), ensure_ascii=False), codec
+            )
+            stats["rows"] += 1
+            stats["bytesBefore"] += len(str(content).encode("utf-8"))
+            stats["bytesAfter"] += len(stored.encode("utf-8"))
+            if stored != content:
+                updates.append((stored, digest))
+        conn.executemany(f"UPDATE {PAYLOAD_BLOBS_TABLE} SET content = ? WHERE content_hash = ?", updates)
+        conn.commit()
+        stats["rewritten"] += len(updates)
+    stats["ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+    return stats
+
+
+def collect_payload_blobs(
+    conn: sqlite3.Connection, deadline: float = math.inf, batch_rows: int = MIGRATION_BATCH_ROWS
+) -> tuple[int, bool]:
+    """
+    Delete content blobs no longer referenced by any cards/cardbank row.
+
+    References are read in key-ordered chunks without holding the write lock,
+    then orphans are deleted `batch_rows` blobs per short IMMEDIATE transaction.
+    Work stops between chunks once `deadline` (a time.perf_counter() value)
+    passes, or when another connection committed since the scan began (a new
+    row may reference a blob found orphaned). Returns (removed, finished).
+    """
+    batch_rows = max(1, int(batch_rows))
+    start_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    referenced: set[str] = set()
+    for store in PAYLOAD_DEDUPE_STORES:
+        table, scope, scope_params = store_scope(store)
+        last_key = ""
+        while True:
+            if time.perf_counter() >= deadline:
+                return 0, False
+            rows = conn.execute(
+                f"SELECT record_key, json_extract(payload, '$.{PAYLOAD_REF_KEY}') FROM {table} "
+                f"WHERE {scope} AND record_key > ? ORDER BY record_key LIMIT ?",
+                (*scope_params, last_key, batch_rows),
+            ).fetchall()
+            referenced.update(ref for _, ref in rows if isinstance(ref, str))
+            if len(rows) < batch_rows:
+                break
+            last_key = rows[-1][0]
+    removed = 0
+    last_hash = ""
+    while True:
+        if time.perf_counter() >= deadline:
+            return removed, False
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("PRAGMA data_version").fetchone()[0] != start_version:
+                conn.execute("ROLLBACK")
+                return removed, False
+            hashes = [
+                row[0]
+                for row in conn.execute(
+                    f"SELECT content_hash FROM {PAYLOAD_BLOBS_TABLE} WHERE content_hash > ? "
+                    "ORDER BY content_hash LIMIT ?",
+                    (last_hash, batch_rows),
+                )
+            ]
+            orphans = [(digest,) for digest in hashes if digest not in referenced]
+            conn.executemany(f"DELETE FROM {PAYLOAD_BLOBS_TABLE} WHERE content_hash = ?", orphans)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        removed += len(orphans)
+        if len(hashes) < batch_rows:
+            return removed, True
+        last_hash = hashes[-1]
+
+
+def _blob_bytes() -> tuple[int, int]:
+    with connect_db() as conn:
+        count, size = conn.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(LENGTH(CAST(content AS BLOB))), 0) FROM {PAYLOAD_BLOBS_TABLE}"
+        ).fetchone()
+    return int(count), int(size)
+
+
+def dedupe_payloads(batch_rows: int = MIGRATION_BATCH_ROWS) -> dict:
+    """
+    Move inline cards/cardbank payloads into the shared content table, collapsing
+    identical card content, then drop orphaned blobs. Safe to re-run.
+    """
+    t0 = time.perf_counter()
+    stats = {"rows": 0, "converted": 0, "bytesBefore": _blob_bytes()[1], "bytesAfter": 0}
+    for store in PAYLOAD_DEDUPE_STORES:
+        table, scope, scope_params = store_scope(store)
+        with connect_db(timeout=30) as conn:
+            rows = conn.execute(f"SELECT record_key, payload FROM {table} WHERE {scope}", scope_params).fetchall()
+            for start in range(0, len(rows), max(1, batch_rows)):
+                blobs: list[tuple[str, str]] = []
+                updates: list[tuple] = []
+                for key, payload in rows[start : start + batch_rows]:
+                    stats["rows"] += 1
+                    stats["bytesBefore"] += len(str(payload).encode("utf-8"))
+                    record = decode_payload(payload)
+                    if record is None or PAYLOAD_REF_KEY in record:
+                        stats["bytesAfter"] += len(str(payload).encode("utf-8"))
+                        continue
+                    stored, blob = prepare_payload(store, record)
+                    stats["bytesAfter"] += len(stored.encode("utf-8"))
+                    if blob is None:
+                        continue
+                    blobs.append(blob)
+                    updates.append((stored, *scope_params, key))
+                conn.executemany(
+                    f"INSERT OR IGNORE INTO {PAYLOAD_BLOBS_TABLE} (content_hash, content) VALUES (?, ?)",
+                    blobs,
+                )
+                conn.executemany(f"UPDATE {table} SET payload = ? WHERE {scope} AND record_key = ?", updates)
+                conn.commit()
+                stats["converted"] += len(updates)
+    with connect_db(timeout=30, isolation_level=None) as conn:
+        stats["orphansRemoved"] = collect_payload_blobs(conn)[0]
+    stats["blobs"], size = _blob_bytes()
+    stats["bytesAfter"] += size
+    stats["ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+    return stats
 
 
 def api_parts(path: str) -> list[str] | None:
@@ -64,36 +1193,32 @@ def api_parts(path: str) -> list[str] | None:
 
 
 def list_records(store: str) -> list[dict]:
-    with sqlite3.connect(DB_PATH) as conn:
+    table, scope, scope_params = store_scope(store)
+    source, join = payload_source(store, table)
+    with connect_db() as conn:
         rows = conn.execute(
-            "SELECT payload FROM records WHERE store = ? ORDER BY updated_at ASC",
-            (store,),
+            f"SELECT {source} FROM {table} {join} WHERE {scope} ORDER BY updated_at ASC",
+            scope_params,
         ).fetchall()
     items: list[dict] = []
     for (payload,) in rows:
-        try:
-            parsed = json.loads(payload)
-        except json.JSONDecodeError:
-            continue
-        if isinstance(parsed, dict):
+        parsed = decode_payload(payload)
+        if parsed is not None:
             items.append(parsed)
     return items
 
 
 def get_record(store: str, key: str) -> dict | None:
-    with sqlite3.connect(DB_PATH) as conn:
+    table, scope, scope_params = store_scope(store)
+    source, join = payload_source(store, table)
+    with connect_db() as conn:
         row = conn.execute(
-            "SELECT payload FROM records WHERE store = ? AND record_key = ? LIMIT 1",
-            (store, key),
+            f"SELECT {source} FROM {table} {join} WHERE {scope} AND record_key = ? LIMIT 1",
+            (*scope_params, key),
         ).fetchone()
     if not row:
         return None
-    payload = row[0]
-    try:
-        parsed = json.loads(payload)
-    except json.JSONDecodeError:
-        return None
-    return parsed if isinstance(parsed, dict) else None
+    return decode_payload(row[0])
 
 
 def list_records_by_json_field(store: str, field: str, values: list[str]) -> list[dict]:
@@ -102,18 +1227,22 @@ def list_records_by_json_field(store: str, field: str, values: list[str]) -> lis
         return []
     unique_values = list(dict.fromkeys(cleaned_values))
     placeholders = ",".join("?" for _ in unique_values)
+    table, scope, scope_params = store_scope(store)
+    # The key field is stored as record_key, which is indexed; skip json_extract for it.
+    column = "record_key" if field == KEY_FIELDS.get(store) else f"json_extract({table}.payload, '$.{field}')"
+    source, join = payload_source(store, table)
 
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with connect_db() as conn:
             rows = conn.execute(
                 f"""
-                SELECT payload
-                FROM records
-                WHERE store = ?
-                  AND json_extract(payload, '$.{field}') IN ({placeholders})
+                SELECT {source}
+                FROM {table} {join}
+                WHERE {scope}
+                  AND {column} IN ({placeholders})
                 ORDER BY updated_at ASC
                 """,
-                (store, *unique_values),
+                (*scope_params, *unique_values),
             ).fetchall()
     except sqlite3.OperationalError:
         value_set = {str(v) for v in unique_values}
@@ -121,11 +1250,8 @@ def list_records_by_json_field(store: str, field: str, values: list[str]) -> lis
 
     items: list[dict] = []
     for (payload,) in rows:
-        try:
-            parsed = json.loads(payload)
-        except json.JSONDecodeError:
-            continue
-        if isinstance(parsed, dict):
+        parsed = decode_payload(payload)
+        if parsed is not None:
             items.append(parsed)
     return items
 
@@ -136,16 +1262,23 @@ def count_records_by_store(stores: list[str]) -> dict[str, int]:
         return {}
     placeholders = ",".join("?" for _ in wanted)
     counts = {store: 0 for store in wanted}
-    with sqlite3.connect(DB_PATH) as conn:
-        rows = conn.execute(
-            f"""
-            SELECT store, COUNT(*)
-            FROM records
-            WHERE store IN ({placeholders})
-            GROUP BY store
-            """,
-            tuple(wanted),
-        ).fetchall()
+    with connect_db() as conn:
+        if SCHEMA_LAYOUT == SCHEMA_V2:
+            rows = [
+                (store, conn.execute(f"SELECT COUNT(*) FROM {store_table(store)}").fetchone()[0])
+                for store in wanted
+                if store in KEY_FIELDS
+            ]
+        else:
+            rows = conn.execute(
+                f"""
+                SELECT store, COUNT(*)
+                FROM records
+                WHERE store IN ({placeholders})
+                GROUP BY store
+                """,
+                tuple(wanted),
+            ).fetchall()
     for store, count in rows:
         counts[str(store)] = int(count)
     return counts
@@ -157,17 +1290,18 @@ def count_cards_by_topic_ids(topic_ids: list[str]) -> dict[str, int]:
         return {}
     unique_topic_ids = list(dict.fromkeys(cleaned_topic_ids))
     placeholders = ",".join("?" for _ in unique_topic_ids)
+    table, scope, scope_params = store_scope("cards")
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with connect_db() as conn:
             rows = conn.execute(
                 f"""
                 SELECT json_extract(payload, '$.topicId') AS topic_id, COUNT(*)
-                FROM records
-                WHERE store = 'cards'
+                FROM {table}
+                WHERE {scope}
                   AND json_extract(payload, '$.topicId') IN ({placeholders})
                 GROUP BY topic_id
                 """,
-                tuple(unique_topic_ids),
+                (*scope_params, *unique_topic_ids),
             ).fetchall()
         counts = {str(topic_id): int(count) for topic_id, count in rows if topic_id is not None}
         for topic_id in unique_topic_ids:
@@ -183,68 +1317,2592 @@ def count_cards_by_topic_ids(topic_ids: list[str]) -> dict[str, int]:
         return counts
 
 
-def upsert_record(store: str, record: dict) -> dict:
-    key_field = KEY_FIELDS[store]
-    key = record.get(key_field)
-    if key is None or str(key).strip() == "":
-        raise ValueError(f'Missing key field "{key_field}" for store "{store}"')
-
-    payload = json.dumps(record, separators=(",", ":"), ensure_ascii=False)
-    updated_at = int(time.time() * 1000)
-
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute(
-            """
-            INSERT INTO records (store, record_key, payload, updated_at)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(store, record_key)
-            DO UPDATE SET payload = excluded.payload, updated_at = excluded.updated_at
-            """,
-            (store, str(key), payload, updated_at),
-        )
-        conn.commit()
+class ChangeBus:
+    """
+    In-process feed of record changes for the SSE endpoint.
 
-    return record
+    Keeps the most recent events in a ring buffer so clients can resume with
+    Last-Event-ID. Event ids start at the process start time in milliseconds,
+    so ids from a previous run always fall before the buffer and trigger a reset.
+    """
 
+    def __init__(self, size: int = CHANGE_BUFFER_SIZE) -> None:
+        self._events: deque[dict] = deque(maxlen=size)
+        self._cond = threading.Condition()
+        self._next_id = int(time.time() * 1000)
+        self._subscribers = 0
+        # record key -> subjectId hints for topics and cards, so cards/progress resolve without queries.
+        # Keys are prefixed with the request's shard owner so owners never share hints.
+        self._subject_by_topic: dict[str, str] = {}
+        self._topic_by_card: dict[str, str] = {}
 
-def delete_record(store: str, key: str) -> None:
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute(
-            "DELETE FROM records WHERE store = ? AND record_key = ?",
-            (store, key),
-        )
-        conn.commit()
+    @property
+    def subscribers(self) -> int:
+        return self._subscribers
 
+    def subscribe(self) -> None:
+        with self._cond:
+            self._subscribers += 1
 
-class FlashcardsHandler(SimpleHTTPRequestHandler):
-    server_version = "FlashcardsServer/1.0"
-    protocol_version = "HTTP/1.1"
+    def unsubscribe(self) -> None:
+        with self._cond:
+            self._subscribers = max(0, self._subscribers - 1)
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, directory=str(ROOT_DIR), **kwargs)
+    def last_id(self) -> int:
+        with self._cond:
+            return self._next_id - 1
 
-    def handle(self) -> None:
-        try:
-            super().handle()
-        except BENIGN_NETWORK_ERRORS:
-            # Clients (especially mobile Safari) may close keep-alive sockets abruptly.
-            # Treat this as a normal disconnect and avoid noisy tracebacks.
+    @staticmethod
+    def _remember(cache: dict[str, str], key: str, value: str) -> None:
+        if not key or not value:
             return
+        if len(cache) >= CHANGE_SUBJECT_CACHE_SIZE and key not in cache:
+            cache.pop(next(iter(cache)))
+        cache[key] = value
 
-    def _trace_enabled(self) -> bool:
-        return bool(getattr(self.server, "trace_requests", False))
+    def resolve_subject(self, store: str, record: dict | None) -> str | None:
+        """Best-effort subjectId for a record; None when it cannot be determined cheaply."""
+        if not isinstance(record, dict):
+            return None
+        owner = getattr(REQUEST_CONTEXT, "owner", "")
 
-    def _trace_ip_matches(self) -> bool:
-        filter_ip = str(getattr(self.server, "trace_ip", "") or "").strip()
-        if not filter_ip:
-            return True
-        client_ip = self.client_address[0] if self.client_address else ""
-        return client_ip == filter_ip
+        def scoped(key: str) -> str:
+            return f"{owner}/{key}" if owner and key else key
 
-    def _trace_slow_ms(self) -> float:
-        try:
-            return float(getattr(self.server, "trace_slow_ms", 0.0) or 0.0)
-        except (TypeError, ValueError):
+        if store == "subjects":
+            return str(record.get("id", "")).strip() or None
+        if store == "topics":
+            subject_id = str(record.get("subjectId", "")).strip()
+            self._remember(self._subject_by_topic, scoped(str(record.get("id", "")).strip()), subject_id)
+            return subject_id or None
+        if store in {"cards", "cardbank"}:
+            topic_id = str(record.get("topicId", "")).strip()
+            self._remember(self._topic_by_card, scoped(str(record.get("id", "")).strip()), topic_id)
+        elif store == "progress":
+            card_id = str(record.get("cardId", "")).strip()
+            topic_id = self._topic_by_card.get(scoped(card_id), "")
+            if not topic_id and card_id:
+                card = get_record("cards", card_id)
+                topic_id = str((card or {}).get("topicId", "")).strip()
+                self._remember(self._topic_by_card, scoped(card_id), topic_id)
+        else:
+            return None
+        if not topic_id:
+            return None
+        subject_id = self._subject_by_topic.get(scoped(topic_id), "")
+        if not subject_id:
+            topic = get_record("topics", topic_id)
+            subject_id = str((topic or {}).get("subjectId", "")).strip()
+            self._remember(self._subject_by_topic, scoped(topic_id), subject_id)
+        return subject_id or None
+
+    def publish(
+        self,
+        op: str,
+        store: str,
+        key: str,
+        updated_at: int,
+        record: dict | None = None,
+        subject_id: str | None = None,
+    ) -> None:
+        # Subject lookups may hit the database, so only pay for them while someone listens.
+        if subject_id is None and self._subscribers:
+            subject_id = self.resolve_subject(store, record)
+        payload_json = ""
+        if record is not None and self._subscribers:
+            payload_json = json.dumps(record, separators=(",", ":"), ensure_ascii=False)
+            if len(payload_json) > CHANGE_PAYLOAD_MAX_BYTES:
+                payload_json = ""
+        with self._cond:
+            event = {
+                "id": self._next_id,
+                "op": op,
+                "store": store,
+                "key": key,
+                "updatedAt": updated_at,
+                "subjectId": subject_id,
+                "payload": payload_json,
+                "owner": getattr(REQUEST_CONTEXT, "owner", ""),
+            }
+            self._next_id += 1
+            self._events.append(event)
+            self._cond.notify_all()
+
+    def wait_after(self, last_id: int, timeout: float) -> tuple[list[dict], bool]:
+        """
+        Return (events newer than last_id, gap). `gap` is True when events after
+        last_id were already dropped from the buffer and the client must resync.
+        """
+        with self._cond:
+            if not self._events or self._events[-1]["id"] <= last_id:
+                self._cond.wait(timeout)
+            if not self._events:
+                return [], False
+            first_id = self._events[0]["id"]
+            gap = last_id + 1 < first_id and last_id >= 0
+            return [event for event in self._events if event["id"] > last_id], gap
+
+
+CHANGE_BUS = ChangeBus()
+
+
+class WriteStats:
+    """
+    Per-store counters of applied writes, writes skipped because the stored
+    payload was already identical, deletes, and the payload/blob bytes each
+    kind wrote or avoided writing.
+    """
+
+    FIELDS = ("applied", "skipped", "deleted", "bytesWritten", "bytesSkipped")
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stores: dict[str, dict[str, int]] = {}
+
+    def record(self, store: str, kind: str, nbytes: int = 0, count: int = 1) -> None:
+        with self._lock:
+            counters = self._stores.get(store)
+            if counters is None:
+                counters = self._stores[store] = dict.fromkeys(self.FIELDS, 0)
+            counters[kind] += count
+            if kind == "applied":
+                counters["bytesWritten"] += nbytes
+            elif kind == "skipped":
+                counters["bytesSkipped"] += nbytes
+
+    def snapshot(self, reset: bool = False) -> dict:
+        with self._lock:
+            stores = {store: dict(counters) for store, counters in sorted(self._stores.items())}
+            if reset:
+                self._stores.clear()
+        totals = {field: sum(counters[field] for counters in stores.values()) for field in self.FIELDS}
+        for counters in [*stores.values(), totals]:
+            puts = counters["applied"] + counters["skipped"]
+            counters["skippedShare"] = round(counters["skipped"] / puts, 3) if puts else 0.0
+        return {"stores": stores, "totals": totals}
+
+
+WRITE_STATS = WriteStats()
+
+
+def upsert_record(store: str, record: dict) -> dict:
+    """
+    Insert or replace `record`. A record whose stored payload is already
+    identical is acknowledged without a write: no new updated_at, WAL frames,
+    change event or cache invalidation.
+    """
+    key_field = KEY_FIELDS[store]
+    key = record.get(key_field)
+    if key is None or str(key).strip() == "":
+        raise ValueError(f'Missing key field "{key_field}" for store "{store}"')
+
+    payload, blob = prepare_payload(store, record)
+    updated_at = int(time.time() * 1000)
+    table, scope, scope_params = store_scope(store)
+    payload_bytes = len(payload.encode("utf-8"))
+
+    with connect_db() as conn:
+        # Take the write lock before comparing so no other write lands between the check and ours.
+        conn.execute("BEGIN IMMEDIATE")
+        # Deduplicated card rows hold a content hash of the full card, so this compares content.
+        current = conn.execute(
+            f"SELECT payload FROM {table} WHERE {scope} AND record_key = ?", (*scope_params, str(key))
+        ).fetchone()
+        if current is not None and current[0] == payload:
+            conn.rollback()
+            WRITE_STATS.record(store, "skipped", payload_bytes)
+            REQUEST_CONTEXT.writes_skipped = getattr(REQUEST_CONTEXT, "writes_skipped", 0) + 1
+            return record
+        if blob is not None:
+            # Identical content written to the other store is already present; skip it.
+            inserted = conn.execute(
+                f"INSERT OR IGNORE INTO {PAYLOAD_BLOBS_TABLE} (content_hash, content) VALUES (?, ?)",
+                blob,
+            ).rowcount
+            if inserted > 0:
+                payload_bytes += len(blob[1].encode("utf-8"))
+        if SCHEMA_LAYOUT == SCHEMA_V2:
+            conn.execute(
+                f"""
+                INSERT INTO {store_table(store)} (record_key, payload, updated_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT(record_key)
+                DO UPDATE SET payload = excluded.payload, updated_at = excluded.updated_at
+                """,
+                (str(key), payload, updated_at),
+            )
+        else:
+            # INSERT OR REPLACE also works through the v2 compatibility view, so a
+            # write racing an online migration still lands in the right table.
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO records (store, record_key, payload, updated_at)
+                VALUES (?, ?, ?, ?)
+                """,
+                (store, str(key), payload, updated_at),
+            )
+        if store == "knowledge":
+            index_knowledge_record(conn, str(key), record)
+        signature = None
+        if store in DUPLICATE_STORES:
+            signature = store_card_signature(conn, store, str(key), record, updated_at)
+        conn.commit()
+    WRITE_STATS.record(store, "applied", payload_bytes)
+
+    CHANGE_BUS.publish("put", store, str(key), updated_at, record)
+    if store in FORECAST_SOURCE_STORES:
+        REVIEW_FORECAST.invalidate()
+    if store in DUPLICATE_STORES:
+        CARD_DUPLICATES.update(store, str(key), str(record.get("topicId") or ""), signature)
+    return record
+
+
+def delete_record(store: str, key: str) -> bool:
+    """Delete one record; False when it did not exist (nothing is counted, published or invalidated)."""
+    previous = get_record(store, key) if CHANGE_BUS.subscribers else None
+    table, scope, scope_params = store_scope(store)
+    with connect_db() as conn:
+        deleted = conn.execute(
+            f"DELETE FROM {table} WHERE {scope} AND record_key = ?",
+            (*scope_params, key),
+        ).rowcount
+        if deleted <= 0:
+            conn.rollback()
+            return False
+        if store == "knowledge":
+            index_knowledge_record(conn, key, None)
+        if store in DUPLICATE_STORES:
+            store_card_signature(conn, store, key, None)
+        conn.commit()
+    WRITE_STATS.record(store, "deleted")
+    subject_id = CHANGE_BUS.resolve_subject(store, previous) if previous else None
+    CHANGE_BUS.publish("delete", store, key, int(time.time() * 1000), subject_id=subject_id)
+    if store in FORECAST_SOURCE_STORES:
+        REVIEW_FORECAST.invalidate()
+    if store in DUPLICATE_STORES:
+        CARD_DUPLICATES.update(store, key, "", None)
+    return True
+
+
+# Stores whose writes change forecast input: progress itself, and card/topic membership of a subject.
+FORECAST_SOURCE_STORES = ("progress", "cards", "topics")
+
+
+def _timestamp_ms_sql(expr: str) -> str:
+    """SQL turning an ISO timestamp (or epoch-ms number) into epoch milliseconds."""
+    return (
+        f"CASE WHEN typeof({expr}) IN ('integer', 'real') THEN {expr} "
+        f"ELSE (julianday({expr}) - 2440587.5) * {DAY_MS}.0 END"
+    )
+
+
+def load_progress_arrays(subject_id: str = "") -> dict:
+    """
+    Load scheduling state of progress records into parallel float arrays:
+    due time and last review (epoch ms) and FSRS stability (days), NaN when
+    missing. Timestamps are parsed by SQLite so rows never become dicts.
+    """
+    card_ids: set[str] | None = None
+    if subject_id:
+        topics = list_records_by_json_field("topics", "subjectId", [subject_id])
+        topic_ids = [str(topic.get("id", "")).strip() for topic in topics if str(topic.get("id", "")).strip()]
+        card_ids = set()
+        if topic_ids:
+            table, scope, scope_params = store_scope("cards")
+            placeholders = ",".join("?" for _ in topic_ids)
+            with connect_db() as conn:
+                card_ids = {
+                    str(key)
+                    for (key,) in conn.execute(
+                        f"SELECT record_key FROM {table} WHERE {scope} "
+                        f"AND json_extract(payload, '$.topicId') IN ({placeholders})",
+                        (*scope_params, *topic_ids),
+                    )
+                }
+    table, scope, scope_params = store_scope("progress")
+    sql = f"""
+        SELECT record_key, {_timestamp_ms_sql("due")}, stability, {_timestamp_ms_sql("last")}
+        FROM (
+            SELECT
+                record_key,
+                COALESCE(
+                    json_extract(payload, '$.fsrs.dueAt'),
+                    json_extract(payload, '$.fsrs.card.due'),
+                    json_extract(payload, '$.dueAt')
+                ) AS due,
+                json_extract(payload, '$.fsrs.card.stability') AS stability,
+                COALESCE(
+                    json_extract(payload, '$.fsrs.lastReviewedAt'),
+                    json_extract(payload, '$.fsrs.card.last_review'),
+                    json_extract(payload, '$.lastAnsweredAt')
+                ) AS last
+            FROM {table}
+            WHERE {scope}
+        )
+    """
+    nan = float("nan")
+    due, stability, last = array("d"), array("d"), array("d")
+    with connect_db() as conn:
+        for key, due_ms, stability_days, last_ms in conn.execute(sql, scope_params):
+            if card_ids is not None and key not in card_ids:
+                continue
+            due.append(nan if due_ms is None else float(due_ms))
+            stability.append(nan if not isinstance(stability_days, (int, float)) else float(stability_days))
+            last.append(nan if last_ms is None else float(last_ms))
+    if numpy is not None:
+        return {
+            "due": numpy.frombuffer(due, dtype=numpy.float64),
+            "stability": numpy.frombuffer(stability, dtype=numpy.float64),
+            "last": numpy.frombuffer(last, dtype=numpy.float64),
+        }
+    return {"due": due, "stability": stability, "last": last}
+
+
+def _forecast_numpy(arrays: dict, now_ms: float, day_start_ms: float, days: int) -> dict:
+    due, stability, last = arrays["due"], arrays["stability"], arrays["last"]
+    scheduled = ~numpy.isnan(due)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        day_index = numpy.floor((due[scheduled] - day_start_ms) / DAY_MS)
+        overdue = day_index < 0
+        in_horizon = (day_index >= 0) & (day_index < days)
+        rated = (stability > 0) & ~numpy.isnan(last)
+        s, t_last = stability[rated], last[rated]
+        retention_now = (1 + FSRS_FACTOR * numpy.maximum(now_ms - t_last, 0) / DAY_MS / s) ** FSRS_DECAY
+        horizon_ms = day_start_ms + days * DAY_MS
+        retention_horizon = (1 + FSRS_FACTOR * numpy.maximum(horizon_ms - t_last, 0) / DAY_MS / s) ** FSRS_DECAY
+        # Chance of forgetting each card by the time it comes due, summed per day.
+        due_rated = due[rated]
+        lapse_at_due = 1 - (1 + FSRS_FACTOR * numpy.maximum(due_rated - t_last, 0) / DAY_MS / s) ** FSRS_DECAY
+        lapse_day = numpy.floor((due_rated - day_start_ms) / DAY_MS)
+    lapse_mask = (lapse_day >= 0) & (lapse_day < days)
+    due_counts = numpy.bincount(day_index[in_horizon].astype(numpy.int64), minlength=days)
+    lapse_sums = numpy.bincount(
+        lapse_day[lapse_mask].astype(numpy.int64), weights=lapse_at_due[lapse_mask], minlength=days
+    )
+    overdue_due = due[scheduled][overdue]
+    overdue_rated = (due_rated < day_start_ms) & ~numpy.isnan(due_rated)
+    return {
+        "cards": int(due.size),
+        "scheduled": int(scheduled.sum()),
+        "dueCounts": [int(v) for v in due_counts[:days]],
+        "expectedLapses": [float(v) for v in lapse_sums[:days]],
+        "overdue": int(overdue.sum()),
+        "oldestOverdueMs": float(overdue_due.min()) if overdue_due.size else None,
+        "overdueRetention": float(retention_now[overdue_rated].mean()) if overdue_rated.any() else None,
+        "beyondHorizon": int((day_index >= days).sum()),
+        "retentionNow": float(retention_now.mean()) if retention_now.size else None,
+        "retentionHorizon": float(retention_horizon.mean()) if retention_horizon.size else None,
+    }
+
+
+def _forecast_python(arrays: dict, now_ms: float, day_start_ms: float, days: int) -> dict:
+    due_counts = [0] * days
+    lapse_sums = [0.0] * days
+    scheduled = overdue = beyond = 0
+    oldest: float | None = None
+    retention_now: list[float] = []
+    retention_horizon: list[float] = []
+    overdue_retention: list[float] = []
+    horizon_ms = day_start_ms + days * DAY_MS
+    for due, stability, last in zip(arrays["due"], arrays["stability"], arrays["last"]):
+        index = None
+        if due == due:  # not NaN
+            scheduled += 1
+            index = int((due - day_start_ms) // DAY_MS)
+            if index < 0:
+                overdue += 1
+                oldest = due if oldest is None else min(oldest, due)
+            elif index < days:
+                due_counts[index] += 1
+            else:
+                beyond += 1
+        if not (stability > 0) or last != last:
+            continue
+        now_r = (1 + FSRS_FACTOR * max(now_ms - last, 0) / DAY_MS / stability) ** FSRS_DECAY
+        retention_now.append(now_r)
+        retention_horizon.append((1 + FSRS_FACTOR * max(horizon_ms - last, 0) / DAY_MS / stability) ** FSRS_DECAY)
+        if index is not None and index < 0:
+            overdue_retention.append(now_r)
+        elif index is not None and index < days:
+            lapse_sums[index] += 1 - (1 + FSRS_FACTOR * max(due - last, 0) / DAY_MS / stability) ** FSRS_DECAY
+    return {
+        "cards": len(arrays["due"]),
+        "scheduled": scheduled,
+        "dueCounts": due_counts,
+        "expectedLapses": lapse_sums,
+        "overdue": overdue,
+        "oldestOverdueMs": oldest,
+        "overdueRetention": sum(overdue_retention) / len(overdue_retention) if overdue_retention else None,
+        "beyondHorizon": beyond,
+        "retentionNow": sum(retention_now) / len(retention_now) if retention_now else None,
+        "retentionHorizon": sum(retention_horizon) / len(retention_horizon) if retention_horizon else None,
+    }
+
+
+def forecast_review_load(arrays: dict, days: int, now_ms: float | None = None, tz_offset_min: int = 0) -> dict:
+    """
+    Due counts per local day, expected lapses, overdue backlog and mean
+    recall probability for the arrays from load_progress_arrays().
+    `tz_offset_min` follows Date.getTimezoneOffset() (UTC minus local time).
+    """
+    now_ms = time.time() * 1000.0 if now_ms is None else float(now_ms)
+    offset_ms = tz_offset_min * 60_000
+    day_start_ms = (now_ms - offset_ms) // DAY_MS * DAY_MS + offset_ms
+    compute = _forecast_numpy if numpy is not None else _forecast_python
+    raw = compute(arrays, now_ms, day_start_ms, days)
+
+    def rounded(value: float | None) -> float | None:
+        return None if value is None else round(value, 4)
+
+    oldest = raw["oldestOverdueMs"]
+    return {
+        "generatedAt": int(now_ms),
+        "days": days,
+        "engine": "numpy" if numpy is not None else "array",
+        "cards": raw["cards"],
+        "scheduled": raw["scheduled"],
+        "daily": [
+            {
+                "date": time.strftime("%Y-%m-%d", time.gmtime((day_start_ms - offset_ms + i * DAY_MS) / 1000.0)),
+                "due": raw["dueCounts"][i],
+                "expectedLapses": round(raw["expectedLapses"][i], 2),
+            }
+            for i in range(days)
+        ],
+        "overdue": {
+            "count": raw["overdue"],
+            "oldestDays": None if oldest is None else int((day_start_ms - oldest) // DAY_MS) + 1,
+            "retention": rounded(raw["overdueRetention"]),
+        },
+        "beyondHorizon": raw["beyondHorizon"],
+        "retention": {"now": rounded(raw["retentionNow"]), "horizon": rounded(raw["retentionHorizon"])},
+    }
+
+
+class ReviewForecastCache:
+    """
+    Progress arrays per (database, subject) for /api/review/forecast, kept
+    until a progress/card/topic write or a restore invalidates them.
+    """
+
+    def __init__(self, size: int = FORECAST_CACHE_SIZE) -> None:
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple[str, str], dict] = OrderedDict()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def arrays(self, subject_id: str = "") -> tuple[dict, bool]:
+        key = (str(current_db_path()), subject_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry, True
+            generation = self._generation
+            self.misses += 1
+        entry = load_progress_arrays(subject_id)
+        with self._lock:
+            # A write during the load makes this snapshot stale; serve it once but do not keep it.
+            if generation == self._generation:
+                self._entries[key] = entry
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        return entry, False
+
+
+REVIEW_FORECAST = ReviewForecastCache()
+
+
+_MINHASH_RNG = random.Random(MINHASH_SEED)
+# Multiply-shift hashing mod 2**64 (odd multipliers); the top 32 bits are the permuted value.
+MINHASH_PERMS = [
+    (_MINHASH_RNG.getrandbits(64) | 1, _MINHASH_RNG.getrandbits(64)) for _ in range(MINHASH_PERMUTATIONS)
+]
+_MASK64 = (1 << 64) - 1
+CARD_SIGNATURES_TABLE = "card_signatures"
+
+
+def loose_text(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace for near-duplicate comparison."""
+    return " ".join(LOOSE_STRIP_RE.sub(" ", text.lower()).split())
+
+
+def minhash_signature(text: str) -> array:
+    """MINHASH_PERMUTATIONS 32-bit MinHash values over character shingles of loose_text(text)."""
+    loose = loose_text(text)
+    if len(loose) <= MINHASH_SHINGLE_CHARS:
+        shingles = {loose}
+    else:
+        shingles = {loose[i : i + MINHASH_SHINGLE_CHARS] for i in range(len(loose) - MINHASH_SHINGLE_CHARS + 1)}
+    hashed = [
+        int.from_bytes(hashlib.blake2b(item.encode("utf-8"), digest_size=8).digest(), "little") for item in shingles
+    ]
+    if numpy is not None:
+        values = numpy.array(hashed, dtype=numpy.uint64)
+        mult = numpy.array([a for a, _ in MINHASH_PERMS], dtype=numpy.uint64)
+        add = numpy.array([b for _, b in MINHASH_PERMS], dtype=numpy.uint64)
+        permuted = (numpy.outer(values, mult) + add) >> numpy.uint64(32)
+        return array("I", permuted.min(axis=0).astype(numpy.uint32).tobytes())
+    return array("I", [min(((a * h + b) & _MASK64) >> 32 for h in hashed) for a, b in MINHASH_PERMS])
+
+
+class MinHashIndex:
+    """
+    MinHash/LSH index for near-duplicate detection.
+
+    Signatures are split into bands so only entries sharing a band bucket are
+    compared, which keeps lookups independent of the number of entries.
+    Entries are keyed, so a changed or deleted card can be replaced or removed;
+    they are held as one int each so a comparison is a single XOR.
+    """
+
+    def __init__(self, threshold: float = NEAR_DUPE_THRESHOLD, bands: int = MINHASH_BANDS) -> None:
+        if MINHASH_PERMUTATIONS % bands:
+            raise ValueError("MINHASH_PERMUTATIONS must be divisible by bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.band_bytes = MINHASH_PERMUTATIONS // bands * 4
+        self._buckets: list[dict[bytes, set]] = [{} for _ in range(bands)]
+        self._signatures: dict = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    @staticmethod
+    def signature(text: str) -> array:
+        return minhash_signature(text)
+
+    def _band_keys(self, packed: int):
+        raw = packed.to_bytes(MINHASH_PERMUTATIONS * 4, "little")
+        for band in range(self.bands):
+            yield band, raw[band * self.band_bytes : (band + 1) * self.band_bytes]
+
+    @staticmethod
+    def _pack(signature: array) -> int:
+        return int.from_bytes(signature.tobytes(), "little")
+
+    @staticmethod
+    def _score(a: int, b: int) -> float:
+        same = array("I", (a ^ b).to_bytes(MINHASH_PERMUTATIONS * 4, "little")).count(0)
+        return same / MINHASH_PERMUTATIONS
+
+    def score(self, key, other) -> float:
+        """Estimated Jaccard similarity of two indexed entries."""
+        return self._score(self._signatures[key], self._signatures[other])
+
+    def candidates(self, key) -> set:
+        """Keys sharing at least one band bucket with the indexed entry `key`."""
+        found: set = set()
+        for band, chunk in self._band_keys(self._signatures[key]):
+            found |= self._buckets[band].get(chunk, set())
+        found.discard(key)
+        return found
+
+    def similar(self, signature: array, threshold: float | None = None, exclude=None) -> list[tuple[object, float]]:
+        """Return (key, estimated Jaccard) of indexed entries at or above the threshold, best first."""
+        limit = self.threshold if threshold is None else threshold
+        packed = self._pack(signature)
+        checked = {exclude}
+        found: list[tuple[object, float]] = []
+        for band, chunk in self._band_keys(packed):
+            for candidate in self._buckets[band].get(chunk, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                score = self._score(packed, self._signatures[candidate])
+                if score >= limit:
+                    found.append((candidate, score))
+        found.sort(key=lambda item: -item[1])
+        return found
+
+    def find(self, signature: array):
+        """Return the key of an indexed signature whose estimated Jaccard meets the threshold."""
+        found = self.similar(signature)
+        return found[0][0] if found else None
+
+    def add(self, signature: array, key=None):
+        if key is None:
+            key = len(self._signatures)
+        self.remove(key)
+        packed = self._signatures[key] = self._pack(signature)
+        for band, chunk in self._band_keys(packed):
+            self._buckets[band].setdefault(chunk, set()).add(key)
+        return key
+
+    def remove(self, key) -> None:
+        packed = self._signatures.pop(key, None)
+        if packed is None:
+            return
+        for band, chunk in self._band_keys(packed):
+            bucket = self._buckets[band].get(chunk)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band][chunk]
+
+    def add_if_new(self, signature: array) -> bool:
+        """Index `signature` unless a near-duplicate is already present; return True if added."""
+        if self.find(signature) is not None:
+            return False
+        self.add(signature)
+        return True
+
+
+def card_signature_text(card: dict) -> str:
+    return str(card.get("prompt") or card.get("question") or "")
+
+
+def create_signatures_table(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {CARD_SIGNATURES_TABLE} (
+            store TEXT NOT NULL,
+            record_key TEXT NOT NULL,
+            topic_id TEXT NOT NULL,
+            updated_at INTEGER NOT NULL,
+            signature BLOB NOT NULL,
+            PRIMARY KEY (store, record_key)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def store_card_signature(
+    conn: sqlite3.Connection, store: str, key: str, record: dict | None, updated_at: int = 0
+) -> array | None:
+    """Persist the prompt signature of a card row (None or an empty prompt removes it)."""
+    text = card_signature_text(record) if record is not None else ""
+    if not loose_text(text):
+        conn.execute(f"DELETE FROM {CARD_SIGNATURES_TABLE} WHERE store = ? AND record_key = ?", (store, key))
+        return None
+    signature = minhash_signature(text)
+    conn.execute(
+        f"INSERT OR REPLACE INTO {CARD_SIGNATURES_TABLE} (store, record_key, topic_id, updated_at, signature) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (store, key, str(record.get("topicId") or ""), updated_at, signature.tobytes()),
+    )
+    return signature
+
+
+def sync_card_signatures(conn: sqlite3.Connection, store: str) -> int:
+    """
+    Bring card_signatures in line with the store: sign rows that are missing or
+    were rewritten outside upsert_record() (bulk import, scripts, restore) and
+    drop rows of deleted cards. Returns the number of rows signed.
+    """
+    table, scope, scope_params = store_scope(store)
+    source, join = payload_source(store, table)
+    qualified = f"{table}.{scope}" if scope_params else scope
+    stale = conn.execute(
+        f"""
+        SELECT {table}.record_key, {table}.updated_at, {source} FROM {table} {join}
+        LEFT JOIN {CARD_SIGNATURES_TABLE} AS s ON s.store = ? AND s.record_key = {table}.record_key
+        WHERE {qualified} AND (s.record_key IS NULL OR s.updated_at != {table}.updated_at)
+        """,
+        (store, *scope_params),
+    ).fetchall()
+    for key, updated_at, payload in stale:
+        store_card_signature(conn, store, key, decode_payload(payload), updated_at)
+    conn.execute(
+        f"DELETE FROM {CARD_SIGNATURES_TABLE} WHERE store = ? AND record_key NOT IN "
+        f"(SELECT record_key FROM {table} WHERE {scope})",
+        (store, *scope_params),
+    )
+    conn.commit()
+    return len(stale)
+
+
+class CardDuplicateIndex:
+    """
+    MinHash/LSH indexes of card prompts per (database, store), loaded from
+    card_signatures on first use and then updated in place by upsert_record()
+    and delete_record(). Bulk imports and restores invalidate them.
+    """
+
+    def __init__(self, size: int = DUPLICATE_CACHE_SIZE) -> None:
+        self.size = size
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple[str, str], dict] = OrderedDict()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def update(self, store: str, key: str, topic_id: str, signature: array | None) -> None:
+        with self._lock:
+            self._generation += 1
+            entry = self._entries.get((str(current_db_path()), store))
+            if entry is None:
+                return
+            if signature is None:
+                entry["index"].remove(key)
+                entry["topics"].pop(key, None)
+            else:
+                entry["index"].add(signature, key)
+                entry["topics"][key] = topic_id
+
+    def _load(self, store: str) -> dict:
+        index = MinHashIndex()
+        topics: dict[str, str] = {}
+        with connect_db() as conn:
+            signed = sync_card_signatures(conn, store)
+            for key, topic_id, blob in conn.execute(
+                f"SELECT record_key, topic_id, signature FROM {CARD_SIGNATURES_TABLE} WHERE store = ?", (store,)
+            ):
+                signature = array("I")
+                signature.frombytes(blob)
+                index.add(signature, key)
+                topics[key] = topic_id
+        return {"index": index, "topics": topics, "signed": signed}
+
+    def entry(self, store: str) -> tuple[dict, bool]:
+        cache_key = (str(current_db_path()), store)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                self._entries.move_to_end(cache_key)
+                return entry, True
+            generation = self._generation
+        entry = self._load(store)
+        with self._lock:
+            # A write during the load may be missing from this snapshot; use it once but do not keep it.
+            if generation == self._generation:
+                self._entries[cache_key] = entry
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        return entry, False
+
+    def groups(self, store: str, topic_ids: set[str] | None, threshold: float) -> tuple[list[list[tuple]], dict]:
+        """
+        Cluster near-duplicate cards (optionally only within `topic_ids`) and
+        return the groups as [(key, similarity to the first key)] lists.
+        """
+        entry, cached = self.entry(store)
+        index, topics = entry["index"], entry["topics"]
+        with self._lock:
+            keys = [key for key, topic in topics.items() if topic_ids is None or topic in topic_ids]
+            parent: dict[str, str] = {}
+
+            def root(key: str) -> str:
+                while parent[key] != key:
+                    parent[key] = parent[parent[key]]
+                    key = parent[key]
+                return key
+
+            for key in keys:
+                for other in index.candidates(key):
+                    # Each pair once, and none whose cards are already in one group.
+                    if other <= key or (topic_ids is not None and topics.get(other) not in topic_ids):
+                        continue
+                    a, b = root(parent.setdefault(key, key)), root(parent.setdefault(other, other))
+                    if a != b and index.score(key, other) >= threshold:
+                        parent[max(a, b)] = min(a, b)
+            members: dict[str, list[str]] = {}
+            for key in parent:
+                members.setdefault(root(key), []).append(key)
+            groups = []
+            for head, group in members.items():
+                if len(group) < 2:
+                    continue
+                scored = [(head, 1.0)] + [(key, index.score(head, key)) for key in sorted(group) if key != head]
+                groups.append(scored)
+        groups.sort(key=lambda group: (-len(group), group[0][0]))
+        return groups, {"cards": len(keys), "cached": cached, "signed": entry["signed"]}
+
+    def matches(self, store: str, text: str, topic_ids: set[str], exclude: str, threshold: float) -> list[tuple]:
+        entry, _ = self.entry(store)
+        signature = minhash_signature(text)
+        with self._lock:
+            found = entry["index"].similar(signature, threshold, exclude=exclude)
+            return [(key, score) for key, score in found if entry["topics"].get(key) in topic_ids]
+
+
+CARD_DUPLICATES = CardDuplicateIndex()
+
+
+def subject_topic_ids(subject_id: str) -> set[str]:
+    return {str(topic.get("id", "")) for topic in list_records_by_json_field("topics", "subjectId", [subject_id])}
+
+
+def duplicate_card_payload(store: str, scored: list[tuple]) -> list[dict]:
+    records = records_by_key(store, [key for key, _ in scored])
+    return [
+        {
+            "id": key,
+            "topicId": records.get(key, {}).get("topicId"),
+            "prompt": card_signature_text(records.get(key, {})),
+            "similarity": round(score, 3),
+        }
+        for key, score in scored
+        if key in records
+    ]
+
+
+def duplicate_threshold(query: dict[str, list[str]]) -> float:
+    raw = "".join(query.get("threshold", [""])).strip()
+    threshold = float(raw) if raw else NEAR_DUPE_THRESHOLD
+    return max(NEAR_DUPE_THRESHOLD_MIN, min(1.0, threshold))
+
+
+def find_card_duplicates(store: str, record: dict, threshold: float = NEAR_DUPE_THRESHOLD) -> list[dict]:
+    """Near-duplicates of `record` among other cards of its subject (its topic if that is unknown)."""
+    text = card_signature_text(record)
+    if not loose_text(text):
+        return []
+    topic_id = str(record.get("topicId") or "")
+    topic = get_record("topics", topic_id) if topic_id else None
+    subject_id = str((topic or {}).get("subjectId") or "")
+    topic_ids = subject_topic_ids(subject_id) if subject_id else {topic_id}
+    key = str(record.get(KEY_FIELDS[store], ""))
+    return duplicate_card_payload(store, CARD_DUPLICATES.matches(store, text, topic_ids, key, threshold))
+
+
+def _counter(value) -> int:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return 0
+    return max(0, int(number)) if number == number and abs(number) != float("inf") else 0
+
+
+def _progress_day(raw) -> dict:
+    """Server-side normalizeDayProgress() from js/review-panel.js."""
+    src = raw if isinstance(raw, dict) else {}
+    last_grade = src.get("lastGrade") if isinstance(src.get("lastGrade"), str) else ""
+    legacy_mastered = _counter(src.get("correct")) >= 3 and last_grade == "correct"
+    streak = _counter(src.get("correctStreak"))
+    if streak <= 0:
+        streak = 3 if legacy_mastered else 1 if last_grade == "correct" else 0
+    return {
+        "attempts": _counter(src.get("correct")) + _counter(src.get("wrong")) + _counter(src.get("partial")),
+        "streak": streak,
+        "mastered": (src.get("mastered") is True and last_grade == "correct") or streak >= 3 or legacy_mastered,
+        "lastGrade": last_grade,
+        "lastAnsweredAt": src.get("lastAnsweredAt") if isinstance(src.get("lastAnsweredAt"), str) else "",
+    }
+
+
+def _iso_ms(value: str) -> float | None:
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() * 1000.0
+    except (ValueError, AttributeError):
+        return None
+
+
+def progress_state_key(record: dict | None) -> str:
+    """
+    Learning state of a progress record, mirroring getCurrentProgressState():
+    not-answered, in-progress, partial, wrong, correct or mastered.
+    """
+    record = record if isinstance(record, dict) else {}
+    by_day = record.get("byDay") if isinstance(record.get("byDay"), dict) else {}
+    days = {day_key: _progress_day(raw) for day_key, raw in by_day.items()}
+    totals = record.get("totals") if isinstance(record.get("totals"), dict) else {}
+    attempts = max(
+        sum(_counter(totals.get(field)) for field in ("correct", "wrong", "partial")),
+        sum(day["attempts"] for day in days.values()),
+    )
+    if attempts <= 0:
+        return "not-answered"
+    latest: dict | None = None
+    latest_rank: tuple = ()
+    for day_key, day in days.items():
+        if day["attempts"] <= 0:
+            continue
+        ts = _iso_ms(day["lastAnsweredAt"]) or _iso_ms(f"{day_key}T23:59:59") or 0.0
+        if latest is None or (ts, day_key) > latest_rank:
+            latest, latest_rank = day, (ts, day_key)
+    day = latest or _progress_day(None)
+    last_grade = (day["lastGrade"] or str(record.get("lastGrade") or "")).strip()
+    if last_grade == "correct" and (day["mastered"] or day["streak"] >= 3):
+        return "mastered"
+    if last_grade in ("correct", "partial", "wrong"):
+        return last_grade
+    return "in-progress"
+
+
+def normalize_session_filters(raw) -> dict[str, bool]:
+    """Filter flags as in normalizeSessionFilters(); no flags at all means every card."""
+    src = raw if isinstance(raw, dict) else {}
+    filters = {name: bool(src.get(name)) for name in SESSION_FILTERS}
+    if filters["all"] or not any(filters.values()):
+        filters = {name: name == "all" for name in SESSION_FILTERS}
+    return filters
+
+
+def progress_matches_filters(record: dict | None, filters: dict[str, bool], day_key: str) -> bool:
+    """Server-side cardMatchesSessionFilter() for one progress record."""
+    if filters["all"]:
+        return True
+    record = record if isinstance(record, dict) else {}
+    key = progress_state_key(record)
+    by_day = record.get("byDay") if isinstance(record.get("byDay"), dict) else {}
+    answered_today = _progress_day(by_day.get(day_key))["attempts"] > 0
+    return (
+        (filters["notMastered"] and key != "mastered")
+        or (filters["correct"] and key == "correct")
+        or (filters["wrong"] and key == "wrong")
+        or (filters["partial"] and key in ("partial", "in-progress"))
+        or (filters["notAnswered"] and not answered_today)
+        or (filters["notAnsweredYet"] and key == "not-answered")
+    )
+
+
+def progress_due_ms(record: dict | None) -> float | None:
+    fsrs = (record or {}).get("fsrs") if isinstance(record, dict) else None
+    if isinstance(fsrs, dict):
+        card = fsrs.get("card") if isinstance(fsrs.get("card"), dict) else {}
+        for value in (fsrs.get("dueAt"), card.get("due")):
+            if isinstance(value, str) and value:
+                due = _iso_ms(value)
+                if due is not None:
+                    return due
+    value = (record or {}).get("dueAt")
+    if isinstance(value, (int, float)):
+        return float(value)
+    return _iso_ms(value) if isinstance(value, str) else None
+
+
+def _chunked(values: list[str], size: int = SQL_IN_CHUNK):
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+def card_topic_refs(topic_ids: list[str] = (), card_ids: list[str] = ()) -> dict[str, str]:
+    """card id -> topicId for cards in `topic_ids` or with ids in `card_ids`, without decoding payloads."""
+    table, scope, scope_params = store_scope("cards")
+    refs: dict[str, str] = {}
+    lookups = [("json_extract(payload, '$.topicId')", list(topic_ids)), ("record_key", list(card_ids))]
+    with connect_db() as conn:
+        for column, values in lookups:
+            for chunk in _chunked(values):
+                placeholders = ",".join("?" for _ in chunk)
+                rows = conn.execute(
+                    f"SELECT record_key, json_extract(payload, '$.topicId') FROM {table} "
+                    f"WHERE {scope} AND {column} IN ({placeholders})",
+                    (*scope_params, *chunk),
+                )
+                refs.update((str(key), str(topic_id or "")) for key, topic_id in rows)
+    return refs
+
+
+def records_by_key(store: str, keys: list[str]) -> dict[str, dict]:
+    key_field = KEY_FIELDS[store]
+    found: dict[str, dict] = {}
+    for chunk in _chunked(keys):
+        for record in list_records_by_json_field(store, key_field, chunk):
+            found[str(record.get(key_field, ""))] = record
+    return found
+
+
+def interleave_by_topic(card_ids: list[str], topic_by_card: dict[str, str], rng: random.Random) -> list[str]:
+    """interleaveCardsByTopic(): shuffle, then avoid same-topic streaks by weighted topic picks."""
+    buckets: dict[str, list[str]] = {}
+    for card_id in card_ids:
+        buckets.setdefault(topic_by_card.get(card_id) or "__unknown__", []).append(card_id)
+    for bucket in buckets.values():
+        rng.shuffle(bucket)
+    if len(buckets) <= 1 or len(card_ids) <= 2:
+        return [card_id for bucket in buckets.values() for card_id in bucket]
+    topics = list(buckets)
+    rng.shuffle(topics)
+    mixed: list[str] = []
+    previous = ""
+    while len(mixed) < len(card_ids):
+        available = [topic for topic in topics if buckets[topic]]
+        pool = [topic for topic in available if topic != previous] or available
+        roll = rng.random() * sum(len(buckets[topic]) for topic in pool)
+        for topic in pool:
+            roll -= len(buckets[topic])
+            if roll < 0:
+                break
+        mixed.append(buckets[topic].pop(0))
+        previous = topic
+    return mixed
+
+
+def build_session_queue(spec: dict, rng: random.Random | None = None) -> dict:
+    """
+    Ordered card ids for a study session, built like startSession() in
+    js/study-session.js: cards of the selected topics (or an explicit card
+    list, whose order is kept), narrowed by learning-state filters and
+    optionally to FSRS-due cards, graded cards first, interleaved by topic.
+    """
+    rng = rng or random.Random()
+
+    def id_list(name: str) -> list[str]:
+        raw = spec.get(name) or []
+        if not isinstance(raw, list):
+            raise ValueError(f'"{name}" must be a list')
+        return list(dict.fromkeys(str(value).strip() for value in raw if str(value).strip()))
+
+    topic_ids = id_list("topicIds")
+    explicit_ids = id_list("cardIds")
+    subject_id = str(spec.get("subjectId") or "").strip()
+    if not topic_ids and not explicit_ids and subject_id:
+        topics = list_records_by_json_field("topics", "subjectId", [subject_id])
+        topic_ids = [str(topic.get("id", "")).strip() for topic in topics if str(topic.get("id", "")).strip()]
+    if not topic_ids and not explicit_ids:
+        raise ValueError('Select at least one topic ("topicIds", "subjectId") or card ("cardIds")')
+    filters = normalize_session_filters(spec.get("filters"))
+    due_only = bool(spec.get("due"))
+    day_key = str(spec.get("today") or time.strftime("%Y-%m-%d"))
+    size = max(1, min(SESSION_SIZE_MAX, int(spec.get("size") or SESSION_SIZE_MAX)))
+
+    if explicit_ids:
+        refs = card_topic_refs(card_ids=explicit_ids)
+        candidates = [card_id for card_id in explicit_ids if card_id in refs]
+    else:
+        refs = card_topic_refs(topic_ids=topic_ids)
+        candidates = list(refs)
+    progress = records_by_key("progress", candidates)
+    now_ms = time.time() * 1000.0
+    due_at: dict[str, float] = {}
+    eligible: list[str] = []
+    for card_id in candidates:
+        record = progress.get(card_id)
+        if due_only:
+            due = progress_due_ms(record)
+            if due is None or due > now_ms:
+                continue
+            due_at[card_id] = due
+        if progress_matches_filters(record, filters, day_key):
+            eligible.append(card_id)
+
+    if explicit_ids:
+        ordered = eligible[:size]
+    elif due_only:
+        ordered = interleave_by_topic(sorted(eligible, key=due_at.__getitem__)[:size], refs, rng)
+    else:
+        answered = [card_id for card_id in eligible if progress_state_key(progress.get(card_id)) != "not-answered"]
+        answered_set = set(answered)
+        fresh = [card_id for card_id in eligible if card_id not in answered_set]
+        rng.shuffle(answered)
+        rng.shuffle(fresh)
+        ordered = interleave_by_topic((answered + fresh)[:size], refs, rng)
+    return {
+        "queue": ordered,
+        "eligible": len(eligible),
+        "topicIds": topic_ids or sorted({refs[card_id] for card_id in ordered if refs.get(card_id)}),
+        "mode": "review" if explicit_ids else "due" if due_only else "default",
+        "filters": filters,
+    }
+
+
+def card_image_sources(card: dict) -> list[str]:
+    """Every image source of a card (current and legacy fields), deduplicated in display order."""
+    sources: list[str] = []
+    for field in SESSION_IMAGE_FIELDS:
+        value = card.get(field)
+        for src in value if isinstance(value, list) else [value]:
+            if isinstance(src, str) and src.strip() and src.strip() not in sources:
+                sources.append(src.strip())
+    return sources
+
+
+class StudySessionStore:
+    """
+    Study-session queues built by POST /api/sessions. Holds at most
+    `max_sessions` (least recently used are dropped first); a session expires
+    `ttl_s` after its last use. Sessions belong to the owner that built them
+    and are invisible to other owners.
+    """
+
+    def __init__(self, max_sessions: int = SESSION_MAX, ttl_s: float = SESSION_TTL_S) -> None:
+        self.max_sessions = max_sessions
+        self.ttl_s = ttl_s
+        self.created = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        self._sessions: OrderedDict[str, dict] = OrderedDict()
+
+    def _prune(self, now: float) -> None:
+        stale = [session_id for session_id, entry in self._sessions.items() if entry["expiresAt"] <= now]
+        for session_id in stale:
+            del self._sessions[session_id]
+        self.expired += len(stale)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.expired += 1
+
+    def create(self, built: dict) -> dict:
+        now = time.time()
+        entry = {
+            **built,
+            "id": secrets.token_urlsafe(12),
+            "owner": getattr(REQUEST_CONTEXT, "owner", ""),
+            "cursor": 0,
+            "createdAt": now,
+            "expiresAt": now + self.ttl_s,
+        }
+        with self._lock:
+            self._sessions[entry["id"]] = entry
+            self.created += 1
+            self._prune(now)
+        return entry
+
+    def get(self, session_id: str) -> dict | None:
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            entry = self._sessions.get(session_id)
+            if entry is None or entry["owner"] != getattr(REQUEST_CONTEXT, "owner", ""):
+                return None
+            entry["expiresAt"] = now + self.ttl_s
+            self._sessions.move_to_end(session_id)
+            return entry
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry["owner"] != getattr(REQUEST_CONTEXT, "owner", ""):
+                return False
+            del self._sessions[session_id]
+            return True
+
+    def take(self, entry: dict, n: int, cursor: int | None = None) -> dict:
+        """
+        Next `n` cards of a session with their progress and image sources.
+        Passing the `cursor` of an earlier response re-reads that window, so a
+        client can retry a lost response without skipping cards.
+        """
+        with self._lock:
+            start = entry["cursor"] if cursor is None else max(0, min(int(cursor), len(entry["queue"])))
+        queue = entry["queue"]
+        items: list[dict] = []
+        position = start
+        while len(items) < n and position < len(queue):
+            chunk = queue[position : position + (n - len(items))]
+            cards = records_by_key("cards", chunk)
+            progress = records_by_key("progress", chunk)
+            for card_id in chunk:
+                position += 1
+                card = cards.get(card_id)
+                # Cards deleted or excluded after the queue was built are skipped, as the client does.
+                if card is None or card.get("excludeFromSession") is True:
+                    continue
+                items.append({"card": card, "progress": progress.get(card_id), "images": card_image_sources(card)})
+        with self._lock:
+            entry["cursor"] = max(entry["cursor"], position)
+        return {
+            "sessionId": entry["id"],
+            "cursor": start,
+            "nextCursor": position,
+            "total": len(queue),
+            "remaining": len(queue) - position,
+            "done": position >= len(queue),
+            "cards": items,
+            "prefetch": queue[position : position + n],
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._prune(time.time())
+            return {"active": len(self._sessions), "created": self.created, "expired": self.expired}
+
+
+STUDY_SESSIONS = StudySessionStore()
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def import_lookup_name(value: str) -> str:
+    """Case-insensitive name key, matching the browser import's normalizeImportLookupName."""
+    return re.sub(r"\s+", " ", str(value or "").strip()).lower()
+
+
+def split_image_markers(text: str) -> tuple[str, list[str]]:
+    """Lift `[image] <src>` markers out of extractor text into an image list."""
+    images: list[str] = []
+
+    def take(match: re.Match[str]) -> str:
+        src = match.group(1)
+        if src not in images:
+            images.append(src)
+        return " "
+
+    stripped = IMPORT_IMAGE_MARKER_RE.sub(take, str(text or ""))
+    lines = [re.sub(r"\s+", " ", line).strip() for line in stripped.split("\n")]
+    return "\n".join(line for line in lines if line), images
+
+
+class CardImporter:
+    """
+    Writes extractor rows (`{"subject", "topic", "question", "answer", "type",
+    "options"}`) into the `records` table of an open connection.
+
+    Subjects and topics are resolved by name (created when missing), every card
+    is written to both `cards` and `cardbank` (sharing one content blob), and
+    rows are sent in batches of `batch_size` with executemany. Cards whose
+    prompt and answer already exist in the target topic are skipped, so
+    re-running an import does not duplicate cards. With `live=True` every
+    batch is committed on its own and announced on the change feed, so a long
+    import never holds the write lock for more than one batch.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, batch_size: int = IMPORT_BATCH, live: bool = False) -> None:
+        self.conn = conn
+        self.batch_size = max(1, int(batch_size))
+        self.live = live
+        self.now = now_iso()
+        self.updated_at = int(time.time() * 1000)
+        self.subject_by_name: dict[str, dict] = {}
+        self.topic_by_lookup: dict[tuple[str, str], dict] = {}
+        self.existing_cards_by_topic: dict[str, set[tuple[str, str]]] = {}
+        self.pending: list[tuple[str, str, str, int]] = []
+        self.pending_blobs: list[tuple[str, str]] = []
+        self.pending_records: list[tuple[str, dict]] = []
+        self.batches = 0
+        self.stats = {"subjects_created": 0, "topics_created": 0, "cards_inserted": 0, "cards_skipped": 0}
+        self._load_directory()
+
+    def _load_directory(self) -> None:
+        for (payload,) in self.conn.execute("SELECT payload FROM records WHERE store = 'subjects'"):
+            subject = json.loads(payload)
+            if isinstance(subject, dict) and str(subject.get("id", "")).strip():
+                self.subject_by_name.setdefault(import_lookup_name(subject.get("name", "")), subject)
+        for (payload,) in self.conn.execute("SELECT payload FROM records WHERE store = 'topics'"):
+            topic = json.loads(payload)
+            if isinstance(topic, dict) and str(topic.get("id", "")).strip():
+                key = (str(topic.get("subjectId", "")).strip(), import_lookup_name(topic.get("name", "")))
+                self.topic_by_lookup.setdefault(key, topic)
+
+    def _queue(self, store: str, record: dict) -> None:
+        # cards and cardbank get the same content; prepare_payload stores it once by hash.
+        payload, blob = prepare_payload(store, record)
+        if blob is not None:
+            self.pending_blobs.append(blob)
+        self.pending.append((store, str(record["id"]), payload, self.updated_at))
+        if self.live:
+            self.pending_records.append((store, record))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def _subject(self, name: str) -> dict:
+        key = import_lookup_name(name)
+        subject = self.subject_by_name.get(key)
+        if subject is None:
+            subject = {
+                "id": str(uuid.uuid4()),
+                "name": name,
+                "accent": IMPORT_SUBJECT_ACCENT,
+                "createdAt": self.now,
+                "updatedAt": self.now,
+                "meta": {"createdAt": self.now, "updatedAt": self.now},
+            }
+            self.subject_by_name[key] = subject
+            self._queue("subjects", subject)
+            self.stats["subjects_created"] += 1
+        return subject
+
+    def _topic(self, subject_id: str, name: str) -> dict:
+        key = (subject_id, import_lookup_name(name))
+        topic = self.topic_by_lookup.get(key)
+        if topic is None:
+            topic = {"id": str(uuid.uuid4()), "subjectId": subject_id, "name": name}
+            self.topic_by_lookup[key] = topic
+            self.existing_cards_by_topic[topic["id"]] = set()
+            self._queue("topics", topic)
+            self.stats["topics_created"] += 1
+        return topic
+
+    def _existing_cards(self, topic_id: str) -> set[tuple[str, str]]:
+        existing = self.existing_cards_by_topic.get(topic_id)
+        if existing is None:
+            existing = set()
+            rows = self.conn.execute(
+                "SELECT payload FROM records WHERE store = 'cards' AND json_extract(payload, '$.topicId') = ?",
+                (topic_id,),
+            )
+            for (payload,) in rows:
+                card = resolve_payload(self.conn, payload) or {}
+                existing.add((str(card.get("prompt") or ""), str(card.get("answer") or "")))
+            self.existing_cards_by_topic[topic_id] = existing
+        return existing
+
+    def add(self, row: dict, subject: str = "", topic: str = "") -> bool:
+        """
+        Queue one extractor row; return False if it already exists in its topic.
+        `subject`/`topic` are used when the row does not name its own.
+        """
+        subject_record = self._subject(str(row.get("subject", "")).strip() or subject or "Imported")
+        topic_name = str(row.get("topic", "")).strip() or topic or "Imported Topic"
+        topic_record = self._topic(str(subject_record["id"]), topic_name)
+        prompt, images_q = split_image_markers(str(row.get("question", row.get("prompt", ""))))
+        answer, images_a = split_image_markers(str(row.get("answer", "")))
+        existing = self._existing_cards(str(topic_record["id"]))
+        if (prompt, answer) in existing:
+            self.stats["cards_skipped"] += 1
+            return False
+        existing.add((prompt, answer))
+
+        options = row.get("options") if row.get("type") == "mcq" else None
+        card = {
+            "id": str(uuid.uuid4()),
+            "topicId": topic_record["id"],
+            "type": "mcq" if options else "qa",
+            "prompt": prompt,
+            "answer": answer,
+            "options": options or [],
+            "textAlign": "center",
+            "questionTextAlign": "center",
+            "answerTextAlign": "center",
+            "optionsTextAlign": "center",
+            "imagesQ": images_q,
+            "imagesA": images_a,
+            "imageDataQ": "",
+            "imageDataA": "",
+            "createdAt": self.now,
+            "meta": {"createdAt": self.now, "updatedAt": self.now},
+        }
+        self._queue("cards", card)
+        self._queue("cardbank", card)
+        self.stats["cards_inserted"] += 1
+        return True
+
+    def flush(self) -> None:
+        """Send queued rows with executemany; committed right away when live, else in commit()."""
+        if not self.pending:
+            return
+        self.conn.executemany(
+            f"INSERT OR IGNORE INTO {PAYLOAD_BLOBS_TABLE} (content_hash, content) VALUES (?, ?)",
+            self.pending_blobs,
+        )
+        written: dict[str, list[int]] = {}
+        for store, _, payload, _ in self.pending:
+            counts = written.setdefault(store, [0, 0])
+            counts[0] += 1
+            counts[1] += len(payload.encode("utf-8"))
+        if self.pending_blobs:
+            # Content shared by a card and its cardbank copy is stored once; count it with the cards.
+            blob_bytes = {digest: len(content.encode("utf-8")) for digest, content in self.pending_blobs}
+            written.setdefault("cards", [0, 0])[1] += sum(blob_bytes.values())
+        for store, (rows, nbytes) in written.items():
+            WRITE_STATS.record(store, "applied", nbytes, count=rows)
+        # INSERT OR REPLACE (not ON CONFLICT) also works on the schema-v2 `records` view.
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO records (store, record_key, payload, updated_at) VALUES (?, ?, ?, ?)",
+            self.pending,
+        )
+        self.pending = []
+        self.pending_blobs = []
+        self.batches += 1
+        if self.live:
+            self.conn.commit()
+            for store, record in self.pending_records:
+                CHANGE_BUS.publish("put", store, str(record["id"]), self.updated_at, record)
+            self.pending_records = []
+
+    def commit(self) -> None:
+        self.flush()
+        self.conn.commit()
+        if self.live and self.batches:
+            REVIEW_FORECAST.invalidate()
+            # Imported cards are signed when the duplicate index next loads.
+            CARD_DUPLICATES.invalidate()
+
+
+def iter_subject_export(conn: sqlite3.Connection, subject_id: str):
+    """
+    Yield (store, record) for a subject, its topics, their cards and cardbank
+    entries and the cards' progress, reading straight from SQLite cursors.
+    Only topic ids are held in memory; run it inside one read transaction
+    for a consistent snapshot.
+    """
+    table, scope, scope_params = store_scope("subjects")
+    row = conn.execute(
+        f"SELECT payload FROM {table} WHERE {scope} AND record_key = ?", (*scope_params, subject_id)
+    ).fetchone()
+    subject = decode_payload(row[0]) if row else None
+    if subject is None:
+        return
+    yield "subjects", subject
+    topic_ids: list[str] = []
+    table, scope, scope_params = store_scope("topics")
+    for (payload,) in conn.execute(
+        f"SELECT payload FROM {table} WHERE {scope} AND json_extract(payload, '$.subjectId') = ?",
+        (*scope_params, subject_id),
+    ):
+        topic = decode_payload(payload)
+        if topic is not None:
+            topic_ids.append(str(topic.get("id", "")))
+            yield "topics", topic
+    for store in ("cards", "cardbank"):
+        table, scope, scope_params = store_scope(store)
+        source, join = payload_source(store, table)
+        for chunk in _chunked(topic_ids):
+            placeholders = ",".join("?" for _ in chunk)
+            for (payload,) in conn.execute(
+                f"SELECT {source} FROM {table} {join} WHERE {scope} "
+                f"AND json_extract({table}.payload, '$.topicId') IN ({placeholders})",
+                (*scope_params, *chunk),
+            ):
+                record = decode_payload(payload)
+                if record is not None:
+                    yield store, record
+    # Progress joins on card keys in SQL, so card ids never have to be collected.
+    progress_table, _, progress_params = store_scope("progress")
+    cards_table, _, cards_params = store_scope("cards")
+    progress_scope = "p.store = ?" if progress_params else "1 = 1"
+    cards_scope = "c.store = ?" if cards_params else "1 = 1"
+    for chunk in _chunked(topic_ids):
+        placeholders = ",".join("?" for _ in chunk)
+        for (payload,) in conn.execute(
+            f"SELECT p.payload FROM {progress_table} AS p JOIN {cards_table} AS c ON c.record_key = p.record_key "
+            f"WHERE {progress_scope} AND {cards_scope} AND json_extract(c.payload, '$.topicId') IN ({placeholders})",
+            (*progress_params, *cards_params, *chunk),
+        ):
+            record = decode_payload(payload)
+            if record is not None:
+                yield "progress", record
+
+
+class ExportImageIndex:
+    """
+    Images referenced by exported cards: inline data URLs by content hash and
+    size, remote sources (sb://, https) by URL, each with the cards using it.
+    """
+
+    def __init__(self) -> None:
+        self._images: dict[str, dict] = {}
+
+    def add(self, card: dict) -> None:
+        card_id = str(card.get("id", ""))
+        for src in card_image_sources(card):
+            if src.startswith("data:"):
+                key = hashlib.blake2b(src.encode("utf-8"), digest_size=16).hexdigest()
+                entry = self._images.get(key)
+                if entry is None:
+                    content_type = src[5:].split(";", 1)[0].split(",", 1)[0]
+                    entry = {"hash": key, "kind": "inline", "contentType": content_type, "bytes": len(src) * 3 // 4}
+            else:
+                key = src
+                entry = self._images.get(key) or {"kind": "remote", "src": src}
+            entry.setdefault("cardIds", [])
+            if card_id not in entry["cardIds"]:
+                entry["cardIds"].append(card_id)
+            self._images[key] = entry
+
+    def entries(self) -> list[dict]:
+        return list(self._images.values())
+
+
+def write_subject_export(out, conn: sqlite3.Connection, subject_id: str, fmt: str) -> Counter:
+    """
+    Stream a subject export to the file-like `out` and return record counts.
+
+    ndjson: a header line, then `{"store", "record"}` lines, `{"image": ...}`
+    index lines and a `{"summary": ...}` trailer. zip: `<store>.ndjson`
+    entries, `images.ndjson` and `manifest.json`, written with data
+    descriptors so the archive never needs a seekable output.
+    """
+    counts: Counter = Counter()
+    images = ExportImageIndex()
+    header = {"version": EXPORT_FORMAT_VERSION, "subjectId": subject_id, "createdAt": now_iso()}
+
+    def dump(value) -> bytes:
+        return (json.dumps(value, separators=(",", ":"), ensure_ascii=False) + "\n").encode("utf-8")
+
+    if fmt == "ndjson":
+        out.write(dump({"export": header}))
+        for store, record in iter_subject_export(conn, subject_id):
+            counts[store] += 1
+            if store in ("cards", "cardbank"):
+                images.add(record)
+            out.write(dump({"store": store, "record": record}))
+        for entry in images.entries():
+            out.write(dump({"image": entry}))
+        out.write(dump({"summary": {**counts, "images": len(images.entries())}}))
+        return counts
+
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=5) as archive:
+        entry = None
+        current = ""
+        for store, record in iter_subject_export(conn, subject_id):
+            if store != current:
+                if entry is not None:
+                    entry.close()
+                entry = archive.open(f"{store}.ndjson", "w", force_zip64=True)
+                current = store
+            counts[store] += 1
+            if store in ("cards", "cardbank"):
+                images.add(record)
+            entry.write(dump(record))
+        if entry is not None:
+            entry.close()
+        with archive.open("images.ndjson", "w", force_zip64=True) as image_entry:
+            for image in images.entries():
+                image_entry.write(dump(image))
+        manifest = {**header, "counts": {**counts, "images": len(images.entries())}}
+        archive.writestr("manifest.json", json.dumps(manifest, indent=2, ensure_ascii=False))
+    return counts
+
+
+def iter_import_rows(chunks, ndjson: bool = False):
+    """
+    Yield rows from a streamed import body without buffering all of it.
+
+    `chunks` yields bytes. The body is either NDJSON (one row object per line)
+    or the extractor's `{"cards": [...]}` document (a bare `[...]` list also
+    works); array elements are decoded one at a time as their bytes arrive.
+    Raises ValueError on malformed input or rows over IMPORT_MAX_ROW_BYTES.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    json_decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+    source = iter(chunks)
+
+    def fill() -> bool:
+        nonlocal buffer, pos, eof
+        if eof:
+            return False
+        chunk = next(source, None)
+        if chunk is None:
+            eof = True
+            buffer = buffer[pos:] + decoder.decode(b"", final=True)
+        else:
+            buffer = buffer[pos:] + decoder.decode(chunk)
+        pos = 0
+        if len(buffer) > IMPORT_MAX_ROW_BYTES:
+            raise ValueError(f"Import row larger than {IMPORT_MAX_ROW_BYTES} bytes")
+        return True
+
+    if ndjson:
+        while True:
+            newline = buffer.find("\n", pos)
+            if newline < 0:
+                if fill():
+                    continue
+                newline = len(buffer)
+                if pos >= newline:
+                    return
+            line = buffer[pos:newline].strip()
+            pos = newline + 1
+            if line:
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError as exc:
+                    raise ValueError(f"Invalid NDJSON line: {exc}") from exc
+                if isinstance(row, dict) and isinstance(row.get("cards"), list):
+                    yield from row["cards"]
+                else:
+                    yield row
+
+    # Find the start of the rows array: `"cards": [` or a top-level `[`.
+    while True:
+        stripped = buffer.lstrip()
+        if stripped.startswith("["):
+            pos = len(buffer) - len(stripped) + 1
+            break
+        match = IMPORT_CARDS_ARRAY_RE.search(buffer)
+        if match:
+            pos = match.end()
+            break
+        if not fill():
+            raise ValueError('Expected a {"cards": [...]} document, a JSON list or NDJSON')
+    while True:
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) or not fill():
+                break
+        if pos >= len(buffer):
+            raise ValueError("Unexpected end of import body")
+        if buffer[pos] == "]":
+            return
+        try:
+            row, end = json_decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as exc:
+            if fill():
+                continue
+            raise ValueError(f"Invalid JSON in import body: {exc}") from exc
+        pos = end
+        yield row
+
+
+def _backup_files(backup_dir: Path) -> list[Path]:
+    if not backup_dir.is_dir():
+        return []
+    files = [
+        path
+        for path in backup_dir.iterdir()
+        if path.is_file() and path.name.startswith(BACKUP_PREFIX) and path.name.endswith((".sqlite3", ".sqlite3.gz"))
+    ]
+    return sorted(files, key=lambda path: path.name, reverse=True)
+
+
+def list_backups(backup_dir: Path = BACKUP_DIR) -> list[dict]:
+    items: list[dict] = []
+    for path in _backup_files(backup_dir):
+        stat = path.stat()
+        items.append(
+            {
+                "name": path.name,
+                "bytes": int(stat.st_size),
+                "compressed": path.suffix == ".gz",
+                "createdAt": int(stat.st_mtime * 1000),
+            }
+        )
+    return items
+
+
+def rotate_backups(backup_dir: Path, keep: int) -> list[str]:
+    if keep <= 0:
+        return []
+    removed: list[str] = []
+    for path in _backup_files(backup_dir)[keep:]:
+        path.unlink(missing_ok=True)
+        removed.append(path.name)
+    return removed
+
+
+def _stepped_backup(source: sqlite3.Connection, target: sqlite3.Connection, pages_per_step: int) -> int:
+    """Copy `source` into `target` a few pages at a time, yielding between steps so writers are not blocked."""
+    copied = {"pages": 0}
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        copied["pages"] = total
+        if remaining > 0 and BACKUP_STEP_SLEEP_S > 0:
+            time.sleep(BACKUP_STEP_SLEEP_S)
+
+    source.backup(target, pages=max(1, pages_per_step), progress=progress)
+    return copied["pages"]
+
+
+def create_backup(
+    backup_dir: Path = BACKUP_DIR,
+    *,
+    compress: bool = False,
+    keep: int = 0,
+    pages_per_step: int = BACKUP_PAGES_PER_STEP,
+) -> dict:
+    """Snapshot the live database with the SQLite online backup API (WAL-safe)."""
+    t0 = time.perf_counter()
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    target_path = backup_dir / f"{BACKUP_PREFIX}{stamp}.sqlite3"
+    partial_path = target_path.with_name(target_path.name + ".partial")
+
+    with connect_db() as source:
+        target = sqlite3.connect(partial_path)
+        try:
+            pages = _stepped_backup(source, target, pages_per_step)
+        finally:
+            target.close()
+
+    if compress:
+        gz_path = target_path.with_name(target_path.name + ".gz")
+        with partial_path.open("rb") as raw, gzip.open(gz_path, "wb", compresslevel=6) as packed:
+            shutil.copyfileobj(raw, packed, length=1024 * 1024)
+        partial_path.unlink()
+        target_path = gz_path
+    else:
+        partial_path.replace(target_path)
+
+    removed = rotate_backups(backup_dir, keep)
+    return {
+        "name": target_path.name,
+        "path": str(target_path),
+        "bytes": int(target_path.stat().st_size),
+        "pages": pages,
+        "compressed": compress,
+        "ms": round((time.perf_counter() - t0) * 1000.0, 1),
+        "rotated": removed,
+    }
+
+
+def resolve_backup_path(name_or_path: str, backup_dir: Path = BACKUP_DIR, allow_paths: bool = True) -> Path:
+    candidate = Path(name_or_path)
+    if allow_paths and candidate.is_file():
+        return candidate
+    # Only bare file names are looked up in the backup directory (no path traversal).
+    if candidate.name != name_or_path:
+        raise ValueError(f"Backup not found: {name_or_path}")
+    for path in _backup_files(backup_dir):
+        if path.name == name_or_path:
+            return path
+    raise ValueError(f"Backup not found: {name_or_path}")
+
+
+def restore_backup(path: Path, pages_per_step: int = BACKUP_PAGES_PER_STEP) -> dict:
+    """
+    Copy a backup file back into the live database through the backup API.
+    A snapshot in an older storage layout is migrated (as a temporary copy)
+    first: owner shards and running requests keep using the live layout.
+    """
+    t0 = time.perf_counter()
+    source_path = path
+    temp_path: Path | None = None
+    migrated = False
+    if path.suffix == ".gz":
+        temp_path = DB_PATH.with_name(f"{DB_PATH.name}.restore-{int(time.time() * 1000)}")
+        with gzip.open(path, "rb") as packed, temp_path.open("wb") as raw:
+            shutil.copyfileobj(packed, raw, length=1024 * 1024)
+        source_path = temp_path
+    try:
+        source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+        try:
+            check = source.execute("PRAGMA quick_check").fetchone()
+            if not check or check[0] != "ok":
+                raise ValueError(f"Backup failed integrity check: {path.name}")
+            layout = detect_schema_layout(source)
+        finally:
+            source.close()
+        if layout < SCHEMA_LAYOUT:
+            if temp_path is None:
+                temp_path = DB_PATH.with_name(f"{DB_PATH.name}.restore-{int(time.time() * 1000)}")
+                shutil.copyfile(path, temp_path)
+                source_path = temp_path
+            migrate_to_v2(path=temp_path)
+            migrated = True
+        source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+        try:
+            with connect_db() as target:
+                pages = _stepped_backup(source, target, pages_per_step)
+        finally:
+            source.close()
+    finally:
+        if temp_path is not None:
+            for suffix in ("", "-wal", "-shm"):
+                Path(f"{temp_path}{suffix}").unlink(missing_ok=True)
+    # The snapshot may still be newer than the database it replaced.
+    init_db()
+    REVIEW_FORECAST.invalidate()
+    CARD_DUPLICATES.invalidate()
+    return {
+        "name": path.name,
+        "pages": pages,
+        "migrated": migrated,
+        "ms": round((time.perf_counter() - t0) * 1000.0, 1),
+    }
+
+
+def maintain_database(path: Path, tasks: list[str], deadline: float) -> dict:
+    """
+    Run maintenance `tasks` (in the given order) on one database file, each
+    started only before `deadline` (a time.perf_counter() value). Returns
+    per-task results; tasks left out by the deadline are reported as skipped.
+    """
+    results: dict[str, dict] = {}
+    conn = connect_db(path, isolation_level=None)
+    try:
+        conn.execute(f"PRAGMA busy_timeout = {MAINTENANCE_BUSY_MS}")
+        conn.execute(f"PRAGMA analysis_limit = {MAINTENANCE_ANALYSIS_LIMIT}")
+        for task in tasks:
+            if time.perf_counter() >= deadline:
+                results[task] = {"skipped": "budget"}
+                continue
+            t0 = time.perf_counter()
+            try:
+                if task == "analyze":
+                    conn.execute("ANALYZE")
+                    result: dict = {}
+                elif task == "optimize":
+                    conn.execute("PRAGMA optimize")
+                    result = {}
+                elif task == "blobs":
+                    removed, finished = collect_payload_blobs(conn, deadline)
+                    result = {"removed": removed}
+                    if not finished:
+                        # Out of budget, or a writer showed up mid-pass: the task stays due.
+                        result["skipped"] = "budget" if time.perf_counter() >= deadline else "concurrent write"
+                elif task == "vacuum":
+                    mode = int(conn.execute("PRAGMA auto_vacuum").fetchone()[0])
+                    free = int(conn.execute("PRAGMA freelist_count").fetchone()[0])
+                    freed = 0
+                    # Only databases created with auto_vacuum=INCREMENTAL can give pages back without a VACUUM.
+                    while mode == 2 and free > 0 and time.perf_counter() < deadline:
+                        conn.execute(f"PRAGMA incremental_vacuum({MAINTENANCE_VACUUM_STEP_PAGES})").fetchall()
+                        remaining = int(conn.execute("PRAGMA freelist_count").fetchone()[0])
+                        freed += free - remaining
+                        free = remaining
+                    result = {"freedPages": freed, "freelistPages": free, "autoVacuum": mode == 2}
+                elif task == "checkpoint":
+                    busy, log_pages, done = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+                    result = {"busy": bool(busy), "walPages": log_pages, "checkpointed": done}
+                else:
+                    raise ValueError(f"Unknown maintenance task: {task}")
+            except sqlite3.OperationalError as err:
+                # Usually SQLITE_BUSY from a writer that showed up; the task stays due.
+                result = {"error": str(err)}
+            result["ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+            results[task] = result
+    finally:
+        conn.close()
+    return results
+
+
+class MaintenanceScheduler:
+    """
+    Background database maintenance during idle periods.
+
+    Requests feed an exponentially decaying request-rate estimate; every
+    `interval_s` the thread checks that the server has been quiet for
+    `quiet_s` and the rate is below MAINTENANCE_IDLE_RPS, then runs the due
+    tasks on the main database and every open owner shard within `budget_ms`,
+    stopping early when a request arrives. `run()` forces one pass.
+    """
+
+    def __init__(
+        self,
+        interval_s: float = MAINTENANCE_INTERVAL_S,
+        quiet_s: float = MAINTENANCE_QUIET_S,
+        budget_ms: float = MAINTENANCE_BUDGET_MS,
+    ) -> None:
+        self.interval_s = interval_s
+        self.quiet_s = quiet_s
+        self.budget_ms = budget_ms
+        self.shards: ShardRegistry | None = None
+        self.runs = 0
+        self.deferred = 0
+        self.interrupted = 0
+        self.last_run: dict = {}
+        self._rate = 0.0
+        self._last_request = 0.0
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._done: dict[tuple[str, str], float] = {}
+
+    def hit(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            decay = math.exp(-(now - self._last_request) / MAINTENANCE_RATE_WINDOW_S)
+            self._rate = self._rate * decay + 1.0 / MAINTENANCE_RATE_WINDOW_S
+            self._last_request = now
+
+    def request_rate(self) -> float:
+        with self._lock:
+            return self._rate * math.exp(-(time.monotonic() - self._last_request) / MAINTENANCE_RATE_WINDOW_S)
+
+    def idle(self) -> bool:
+        return time.monotonic() - self._last_request >= self.quiet_s and self.request_rate() < MAINTENANCE_IDLE_RPS
+
+    def _due(self, path: Path, now: float, force: bool) -> list[str]:
+        key = str(path)
+        due = ["optimize", "vacuum"]
+        if force or now - self._done.get((key, "analyze"), -math.inf) >= MAINTENANCE_ANALYZE_S:
+            due.insert(0, "analyze")
+        if force or now - self._done.get((key, "blobs"), -math.inf) >= MAINTENANCE_BLOBS_S:
+            due.insert(-1, "blobs")
+        if force or wal_bytes(path) >= MAINTENANCE_WAL_BYTES:
+            due.append("checkpoint")
+        return due
+
+    def run(self, force: bool = False) -> dict:
+        """One maintenance pass over the main database and open shards; returns results per database."""
+        with self._run_lock:
+            t_start = time.perf_counter()
+            deadline = math.inf if force else t_start + self.budget_ms / 1000.0
+            started = time.monotonic()
+            paths = [DB_PATH] + (self.shards.open_paths() if self.shards is not None else [])
+            results: dict[str, dict] = {}
+            for path in paths:
+                if not force and self._last_request > started:
+                    self.interrupted += 1
+                    break
+                if time.perf_counter() >= deadline:
+                    break
+                tasks = self._due(path, time.monotonic(), force)
+                outcome = maintain_database(path, tasks, deadline)
+                for task, result in outcome.items():
+                    if "skipped" not in result and "error" not in result:
+                        self._done[(str(path), task)] = time.monotonic()
+                outcome["walBytes"] = wal_bytes(path)
+                results[path.name] = outcome
+            self.runs += 1
+            self.last_run = {
+                "at": now_iso(),
+                "forced": force,
+                "ms": round((time.perf_counter() - t_start) * 1000.0, 1),
+                "databases": results,
+            }
+            return self.last_run
+
+    def start(self) -> threading.Thread | None:
+        if self.interval_s <= 0:
+            return None
+
+        def run() -> None:
+            while True:
+                time.sleep(self.interval_s)
+                if not self.idle():
+                    self.deferred += 1
+                    continue
+                try:
+                    self.run()
+                except (OSError, sqlite3.Error) as err:
+                    print(f"[MAINTENANCE] failed: {err}", file=sys.stderr)
+
+        thread = threading.Thread(target=run, name="db-maintenance", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.interval_s > 0,
+            "intervalS": self.interval_s,
+            "quietS": self.quiet_s,
+            "budgetMs": self.budget_ms,
+            "requestRate": round(self.request_rate(), 3),
+            "idle": self.idle(),
+            "runs": self.runs,
+            "deferred": self.deferred,
+            "interrupted": self.interrupted,
+            "walBytes": wal_bytes(DB_PATH),
+            "lastRun": self.last_run,
+        }
+
+
+MAINTENANCE = MaintenanceScheduler()
+
+
+def start_backup_scheduler(interval_min: float, backup_dir: Path, compress: bool, keep: int) -> threading.Thread:
+    def run() -> None:
+        while True:
+            time.sleep(interval_min * 60.0)
+            try:
+                result = create_backup(backup_dir, compress=compress, keep=keep)
+                print(f"[BACKUP] {result['name']} bytes={result['bytes']} ms={result['ms']}")
+            except (OSError, sqlite3.Error) as err:
+                print(f"[BACKUP] failed: {err}", file=sys.stderr)
+
+    thread = threading.Thread(target=run, name="backup-scheduler", daemon=True)
+    thread.start()
+    return thread
+
+
+class ShardRegistry:
+    """
+    Routes owners to their own SQLite file under `root` (`<owner>.sqlite3`).
+
+    Each open shard keeps one anchor connection so its WAL index stays mapped
+    between requests; the registry holds at most `max_open` of them (LRU) and
+    a janitor thread closes shards idle for longer than `idle_s`. Shards are
+    created in, or lazily migrated to, the main database's schema layout.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        max_open: int = SHARD_MAX_OPEN,
+        idle_s: float = SHARD_IDLE_S,
+        tokens: dict[str, str] | None = None,
+        require_owner: bool = False,
+    ) -> None:
+        self.root = Path(root)
+        self.max_open = max(1, int(max_open))
+        self.idle_s = max(0.0, float(idle_s))
+        self.tokens = dict(tokens or {})
+        self.require_owner = bool(require_owner)
+        self.opened = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._open: OrderedDict[str, dict] = OrderedDict()
+        self._setup_locks: dict[str, threading.Lock] = {}
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def owner_for(self, headers) -> str:
+        """
+        Owner of a request: X-Owner-Token mapped through --shard-tokens when
+        tokens are configured, else X-Owner-Id. Raises PermissionError for
+        unknown tokens or malformed ids; returns "" when no owner was sent.
+        """
+        if self.tokens:
+            token = str(headers.get("X-Owner-Token", "") or "").strip()
+            if not token:
+                return ""
+            owner = self.tokens.get(token)
+            if owner is None:
+                raise PermissionError("Unknown owner token")
+        else:
+            owner = str(headers.get("X-Owner-Id", "") or "").strip()
+            if not owner:
+                return ""
+        if not SHARD_OWNER_PATTERN.match(owner):
+            raise PermissionError("Invalid owner id")
+        return owner
+
+    def path_for(self, owner: str) -> Path:
+        return self.root / f"{owner}.sqlite3"
+
+    def acquire(self, owner: str) -> Path:
+        """Shard path for `owner`, opening (and creating or migrating) it on first use."""
+        path = self._lookup(owner)
+        if path is not None:
+            return path
+        with self._lock:
+            setup_lock = self._setup_locks.setdefault(owner, threading.Lock())
+        # Creating or migrating a shard can take a while: only requests of the same owner wait for it.
+        with setup_lock:
+            path = self._lookup(owner)
+            if path is not None:
+                return path
+            path = self.path_for(owner)
+            layout = ensure_shard_schema(path)
+            conn: sqlite3.Connection | None = connect_db(path, check_same_thread=False)
+            stale: list[dict] = []
+            with self._lock:
+                entry = self._open.get(owner)
+                if entry is None:
+                    entry = {"path": path, "conn": conn, "openedAt": time.time()}
+                    self._open[owner] = entry
+                    self.opened += 1
+                    conn = None
+                else:
+                    self._open.move_to_end(owner)
+                entry["layout"] = layout
+                entry["lastUsed"] = time.time()
+                while len(self._open) > self.max_open:
+                    stale.append(self._open.popitem(last=False)[1])
+            if conn is not None:
+                conn.close()
+            for item in stale:
+                self._close(item)
+            return path
+
+    def _lookup(self, owner: str) -> Path | None:
+        with self._lock:
+            entry = self._open.get(owner)
+            if entry is None or entry["layout"] != SCHEMA_LAYOUT:
+                return None
+            self._open.move_to_end(owner)
+            entry["lastUsed"] = time.time()
+            return entry["path"]
+
+    @staticmethod
+    def _close(entry: dict) -> None:
+        try:
+            entry["conn"].execute("PRAGMA wal_checkpoint(PASSIVE)")
+            entry["conn"].close()
+        except sqlite3.Error:
+            pass
+
+    def evict_idle(self, now: float | None = None) -> int:
+        now = time.time() if now is None else now
+        with self._lock:
+            stale = [owner for owner, entry in self._open.items() if now - entry["lastUsed"] >= self.idle_s]
+            for owner in stale:
+                self._close(self._open.pop(owner))
+            self.evicted += len(stale)
+        return len(stale)
+
+    def close_all(self) -> None:
+        with self._lock:
+            while self._open:
+                self._close(self._open.popitem(last=False)[1])
+
+    def start_janitor(self) -> threading.Thread | None:
+        if self.idle_s <= 0:
+            return None
+
+        def run() -> None:
+            while True:
+                time.sleep(max(1.0, self.idle_s / 4.0))
+                self.evict_idle()
+
+        thread = threading.Thread(target=run, name="shard-janitor", daemon=True)
+        thread.start()
+        return thread
+
+    def open_paths(self) -> list[Path]:
+        with self._lock:
+            return [entry["path"] for entry in self._open.values()]
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            open_shards = [
+                {"owner": owner, "idleS": round(now - entry["lastUsed"], 1), "layout": entry["layout"]}
+                for owner, entry in reversed(self._open.items())
+            ]
+        files = sorted(self.root.glob("*.sqlite3"))
+        return {
+            "root": str(self.root),
+            "maxOpen": self.max_open,
+            "idleS": self.idle_s,
+            "requireOwner": self.require_owner,
+            "tokenAuth": bool(self.tokens),
+            "opened": self.opened,
+            "evicted": self.evicted,
+            "shards": len(files),
+            "bytes": sum(path.stat().st_size for path in files),
+            "open": open_shards,
+        }
+
+
+def load_shard_tokens(path: str) -> dict[str, str]:
+    """Read a JSON object mapping owner tokens to owner ids for --shard-tokens."""
+    data = json.loads(Path(path).expanduser().read_text(encoding="utf-8"))
+    if not isinstance(data, dict):
+        raise ValueError("--shard-tokens must contain a JSON object of token -> owner id")
+    return {str(token): str(owner) for token, owner in data.items()}
+
+
+def available_response_codecs() -> list[str]:
+    """Content codings this process can produce, in server preference order."""
+    codecs = []
+    if zstandard is not None:
+        codecs.append("zstd")
+    if brotli is not None:
+        codecs.append("br")
+    codecs.extend(["gzip", "deflate"])
+    return codecs
+
+
+RESPONSE_CODECS = available_response_codecs()
+
+
+def negotiate_encoding(accept_encoding: str) -> str | None:
+    """Pick the best available coding from an Accept-Encoding header (q-values honoured)."""
+    weights: dict[str, float] = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+    wildcard = weights.get("*", 0.0)
+    best: str | None = None
+    best_q = 0.0
+    for codec in RESPONSE_CODECS:
+        q = weights.get(codec, wildcard)
+        if q > best_q:
+            best, best_q = codec, q
+    return best
+
+
+_ACTIVE_COMPRESSIONS = 0
+_ACTIVE_COMPRESSIONS_LOCK = threading.Lock()
+
+
+def _cpu_load() -> float:
+    """Rough CPU pressure: max of 1-minute load and in-flight compressions, per CPU."""
+    cpus = os.cpu_count() or 1
+    try:
+        load = os.getloadavg()[0]
+    except (AttributeError, OSError):
+        load = 0.0
+    return max(load, float(_ACTIVE_COMPRESSIONS)) / cpus
+
+
+def compression_level(codec: str, size: int) -> int:
+    small, medium, large = RESPONSE_CODEC_LEVELS[codec]
+    if size >= RESPONSE_LARGE_BYTES or _cpu_load() >= RESPONSE_BUSY_LOAD:
+        return large
+    if size >= RESPONSE_MEDIUM_BYTES:
+        return medium
+    return small
+
+
+def compress_body(body: bytes, codec: str, level: int) -> bytes:
+    global _ACTIVE_COMPRESSIONS
+    with _ACTIVE_COMPRESSIONS_LOCK:
+        _ACTIVE_COMPRESSIONS += 1
+    try:
+        if codec == "zstd":
+            return zstandard.ZstdCompressor(level=level).compress(body)
+        if codec == "br":
+            return brotli.compress(body, quality=level)
+        if codec == "deflate":
+            return zlib.compress(body, level)
+        return gzip.compress(body, compresslevel=level, mtime=0)
+    finally:
+        with _ACTIVE_COMPRESSIONS_LOCK:
+            _ACTIVE_COMPRESSIONS -= 1
+
+
+class StreamCompressor:
+    """Incremental compressor for one response body in any of RESPONSE_CODECS."""
+
+    def __init__(self, codec: str, level: int) -> None:
+        self.codec = codec
+        if codec == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+        elif codec == "br":
+            self._obj = brotli.Compressor(quality=level)
+        else:
+            self._obj = zlib.compressobj(level, zlib.DEFLATED, 31 if codec == "gzip" else 15)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.process(data) if self.codec == "br" else self._obj.compress(data)
+
+    def flush(self) -> bytes:
+        return self._obj.finish() if self.codec == "br" else self._obj.flush()
+
+
+class ChunkedBodyWriter:
+    """
+    File-like sink that sends what is written as HTTP/1.1 chunked transfer
+    encoding (optionally through a StreamCompressor), `flush_bytes` at a time.
+    """
+
+    def __init__(self, wfile, compressor: StreamCompressor | None = None, flush_bytes: int = EXPORT_FLUSH_BYTES) -> None:
+        self.wfile = wfile
+        self.compressor = compressor
+        self.flush_bytes = flush_bytes
+        self.raw_bytes = 0
+        self.out_bytes = 0
+        self._pending: list[bytes] = []
+        self._pending_bytes = 0
+
+    def write(self, data: bytes) -> int:
+        self.raw_bytes += len(data)
+        out = self.compressor.compress(data) if self.compressor is not None else bytes(data)
+        if out:
+            self._pending.append(out)
+            self._pending_bytes += len(out)
+            if self._pending_bytes >= self.flush_bytes:
+                self._send()
+        return len(data)
+
+    def _send(self) -> None:
+        if not self._pending_bytes:
+            return
+        body = b"".join(self._pending)
+        self._pending, self._pending_bytes = [], 0
+        self.wfile.write(f"{len(body):x}\r\n".encode("ascii") + body + b"\r\n")
+        self.out_bytes += len(body)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        if self.compressor is not None:
+            tail = self.compressor.flush()
+            if tail:
+                self._pending.append(tail)
+                self._pending_bytes += len(tail)
+        self._send()
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class CompressedBodyCache:
+    """
+    Bounded LRU of compressed response bodies keyed by (content hash, codec),
+    so identical large responses (full card lists, cardbank) are compressed once.
+    """
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self._items: OrderedDict[tuple[bytes, str], bytes] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple[bytes, str]) -> bytes | None:
+        with self._lock:
+            body = self._items.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key: tuple[bytes, str], body: bytes) -> None:
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._items[key] = body
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes and self._items:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._items), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+RESPONSE_CACHE = CompressedBodyCache()
+
+
+def folded_stack(frame) -> str:
+    """Render a frame chain root-first in the folded format used by flamegraph.pl/speedscope."""
+    names = []
+    while frame is not None:
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class RequestProfiler:
+    """
+    Opt-in profiling of selected handler invocations.
+
+    A request is selected by route prefix and/or sample rate. Each selected
+    request is stack-sampled from a background thread, and one at a time also
+    runs under cProfile (Python 3.12+ allows a single active profiler per
+    process). When it took at least `slow_ms`, its stack samples are merged
+    into the aggregated folded dump and, if it was profiled, its .prof file is
+    written to `out_dir`.
+    """
+
+    def __init__(self, out_dir: Path = PROFILE_DIR) -> None:
+        self.out_dir = out_dir
+        self.routes: tuple[str, ...] = ()
+        self.sample_rate = 0.0
+        self.slow_ms = 0.0
+        self.enabled = False
+        self.keep = PROFILE_KEEP
+        self.stacks: Counter[str] = Counter()
+        self.saved = 0
+        self._active: dict[int, Counter[str]] = {}
+        self._lock = threading.Lock()
+        self._cprofile_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._sampler: threading.Thread | None = None
+
+    def configure(self, *, enabled: bool, routes: list[str], sample_rate: float, slow_ms: float) -> None:
+        self.routes = tuple(route.strip() for route in routes if route.strip())
+        self.sample_rate = min(1.0, max(0.0, float(sample_rate)))
+        self.slow_ms = max(0.0, float(slow_ms))
+        self.enabled = bool(enabled)
+        if self.enabled and self._sampler is None:
+            self._sampler = threading.Thread(target=self._sample_loop, name="profile-sampler", daemon=True)
+            self._sampler.start()
+
+    def config(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "routes": list(self.routes),
+            "sampleRate": self.sample_rate,
+            "slowMs": self.slow_ms,
+            "dir": str(self.out_dir),
+        }
+
+    def selects(self, path: str) -> bool:
+        if not self.enabled or path.startswith(PROFILE_EXCLUDED_PREFIXES):
+            return False
+        if self.routes and not any(path.startswith(route) for route in self.routes):
+            return False
+        return self.sample_rate <= 0 or random.random() < self.sample_rate
+
+    def run(self, method: str, path: str, call: Callable[[], None]) -> None:
+        tid = threading.get_ident()
+        samples: Counter[str] = Counter()
+        with self._lock:
+            self._active[tid] = samples
+        self._wake.set()
+        profile: cProfile.Profile | None = None
+        if self._cprofile_lock.acquire(blocking=False):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiling tool (debugger, coverage) owns the hook; keep stack samples only.
+                profile = None
+                self._cprofile_lock.release()
+        t0 = time.perf_counter()
+        try:
+            try:
+                call()
+            finally:
+                if profile is not None:
+                    profile.disable()
+                    self._cprofile_lock.release()
+        finally:
+            with self._lock:
+                self._active.pop(tid, None)
+            elapsed_ms = (time.perf_counter() - t0) * 1000.0
+            if elapsed_ms >= self.slow_ms:
+                self._save(profile, samples, method, path, elapsed_ms)
+
+    def _save(
+        self, profile: cProfile.Profile | None, samples: Counter[str], method: str, path: str, elapsed_ms: float
+    ) -> None:
+        with self._lock:
+            self.stacks.update(samples)
+        if profile is None:
+            return
+        slug = "-".join(part for part in path.split("/") if part)[:60] or "root"
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        try:
+            self.out_dir.mkdir(parents=True, exist_ok=True)
+            profile.dump_stats(str(self.out_dir / f"{stamp}-{method}-{slug}-{elapsed_ms:.0f}ms.prof"))
+            for old in self.list()[self.keep :]:
+                (self.out_dir / old["name"]).unlink(missing_ok=True)
+        except OSError as err:
+            print(f"[PROFILE] could not save profile: {err}", file=sys.stderr)
+            return
+        with self._lock:
+            self.saved += 1
+
+    def _sample_loop(self) -> None:
+        while True:
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            frames = sys._current_frames()
+            for tid, samples in active.items():
+                frame = frames.get(tid)
+                if frame is not None:
+                    samples[folded_stack(frame)] += 1
+            del frames
+            time.sleep(PROFILE_STACK_INTERVAL_S)
+
+    def list(self) -> list[dict]:
+        if not self.out_dir.is_dir():
+            return []
+        items = []
+        for path in sorted(self.out_dir.glob("*.prof"), key=lambda item: item.name, reverse=True):
+            stat = path.stat()
+            items.append({"name": path.name, "bytes": int(stat.st_size), "createdAt": int(stat.st_mtime * 1000)})
+        return items
+
+    def resolve(self, name: str) -> Path:
+        path = self.out_dir / name
+        if Path(name).name != name or path.suffix != ".prof" or not path.is_file():
+            raise FileNotFoundError(name)
+        return path
+
+    def report(self, name: str, sort: str = "cumulative", limit: int = 40) -> str:
+        out = io.StringIO()
+        stats = pstats.Stats(str(self.resolve(name)), stream=out)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def folded(self, reset: bool = False) -> str:
+        with self._lock:
+            lines = [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+            if reset:
+                self.stacks.clear()
+        return "\n".join(lines) + ("\n" if lines else "")
+
+
+PROFILER = RequestProfiler()
+
+
+def profiled(handler_method: Callable[["FlashcardsHandler"], None]) -> Callable[["FlashcardsHandler"], None]:
+    """Run a do_* method under PROFILER when profiling selects the request."""
+
+    @functools.wraps(handler_method)
+    def wrapper(self: "FlashcardsHandler") -> None:
+        if not PROFILER.enabled:
+            return handler_method(self)
+        path = urlparse(self.path).path
+        if not PROFILER.selects(path):
+            return handler_method(self)
+        return PROFILER.run(self.command, path, lambda: handler_method(self))
+
+    return wrapper
+
+
+class FlashcardsHandler(SimpleHTTPRequestHandler):
+    server_version = "FlashcardsServer/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=str(ROOT_DIR), **kwargs)
+
+    def setup(self) -> None:
+        # Pool mode closes idle keep-alive connections so they do not pin a worker.
+        self.timeout = getattr(self.server, "keepalive_timeout_s", None)
+        self.queue_ms = float(getattr(REQUEST_CONTEXT, "queue_ms", 0.0) or 0.0)
+        REQUEST_CONTEXT.queue_ms = 0.0
+        super().setup()
+
+    def parse_request(self) -> bool:
+        REQUEST_CONTEXT.sql_count = 0
+        REQUEST_CONTEXT.sql_ms = 0.0
+        REQUEST_CONTEXT.sql_slow = 0
+        REQUEST_CONTEXT.writes_skipped = 0
+        REQUEST_CONTEXT.db_path = None
+        REQUEST_CONTEXT.owner = ""
+        if not super().parse_request():
+            return False
+        path = urlparse(self.path).path
+        # Health probes and admin polling must not keep maintenance from seeing an idle server.
+        if path != "/api/health" and not path.startswith("/api/admin/"):
+            MAINTENANCE.hit()
+        return self._route_shard()
+
+    def _route_shard(self) -> bool:
+        """Point this request's connections at its owner's shard (--shard-dir); False when rejected."""
+        shards = getattr(self.server, "shards", None)
+        path = urlparse(self.path).path
+        # Admin endpoints (backups, migrations, stats) always act on the main database.
+        if shards is None or self.command == "OPTIONS" or not path.startswith("/api/"):
+            return True
+        if path == "/api/health" or path.startswith("/api/admin/"):
+            return True
+        try:
+            owner = shards.owner_for(self.headers)
+            if not owner and shards.require_owner:
+                raise PermissionError("Owner required")
+        except PermissionError as err:
+            # The body is never read: close so it cannot be parsed as the next request.
+            self.close_connection = True
+            self._send_json(401, {"error": str(err)})
+            return False
+        if not owner:
+            return True
+        try:
+            REQUEST_CONTEXT.db_path = shards.acquire(owner)
+        except (OSError, RuntimeError, sqlite3.Error) as err:
+            REQUEST_CONTEXT.db_path = None
+            self.close_connection = True
+            self._send_json(503, {"error": f"Shard unavailable: {err}"})
+            return False
+        REQUEST_CONTEXT.owner = owner
+        return True
+
+    def log_error(self, format: str, *args) -> None:
+        if format.startswith("Request timed out"):
+            return
+        super().log_error(format, *args)
+
+    def handle(self) -> None:
+        try:
+            super().handle()
+        except BENIGN_NETWORK_ERRORS:
+            # Clients (especially mobile Safari) may close keep-alive sockets abruptly.
+            # Treat this as a normal disconnect and avoid noisy tracebacks.
+            return
+
+    def _trace_enabled(self) -> bool:
+        return bool(getattr(self.server, "trace_requests", False))
+
+    def _trace_ip_matches(self) -> bool:
+        filter_ip = str(getattr(self.server, "trace_ip", "") or "").strip()
+        if not filter_ip:
+            return True
+        client_ip = self.client_address[0] if self.client_address else ""
+        return client_ip == filter_ip
+
+    def _trace_slow_ms(self) -> float:
+        try:
+            return float(getattr(self.server, "trace_slow_ms", 0.0) or 0.0)
+        except (TypeError, ValueError):
             return 0.0
 
     def _trace_log(
@@ -260,6 +3918,8 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
         raw_bytes: int = 0,
         out_bytes: int = 0,
         gzipped: bool = False,
+        encoding: str = "",
+        zcache: str = "",
         extra: str = "",
     ) -> None:
         if not self._trace_enabled() or not self._trace_ip_matches():
@@ -271,9 +3931,13 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
         display_path = urlparse(path).path or path
         ua = self.headers.get("User-Agent", "")
         client_ip = self.client_address[0] if self.client_address else "-"
+        # Queue wait only applies to the first request of a pooled connection.
+        queue_ms, self.queue_ms = getattr(self, "queue_ms", 0.0), 0.0
         hint = ""
         if raw_bytes >= 1_000_000:
             hint = "large-payload"
+        elif queue_ms > 0 and queue_ms >= total_ms:
+            hint = "queue-bound"
         elif db_ms > 0 and db_ms >= total_ms * 0.6:
             hint = "db-bound"
         elif gzip_ms > 0 and gzip_ms >= total_ms * 0.3:
@@ -284,6 +3948,11 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
         extra_parts = []
         if hint:
             extra_parts.append(f"hint={hint}")
+        if SQL_STATS.enabled:
+            sql_ms = float(getattr(REQUEST_CONTEXT, "sql_ms", 0.0))
+            extra_parts.append(f"sql={getattr(REQUEST_CONTEXT, 'sql_count', 0)}/{sql_ms:.1f}ms")
+            if getattr(REQUEST_CONTEXT, "sql_slow", 0):
+                extra_parts.append(f"sql_slow={REQUEST_CONTEXT.sql_slow}")
         if extra:
             extra_parts.append(extra)
         extra_text = f" {' '.join(extra_parts)}" if extra_parts else ""
@@ -295,91 +3964,674 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
             f"path={display_path} "
             f"status={status} "
             f"total_ms={total_ms:.1f} "
+            f"queue_ms={queue_ms:.1f} "
             f"db_ms={db_ms:.1f} "
             f"json_ms={json_ms:.1f} "
             f"gzip_ms={gzip_ms:.1f} "
             f"raw_kb={raw_bytes / 1024:.1f} "
             f"out_kb={out_bytes / 1024:.1f} "
             f"gzip={1 if gzipped else 0} "
+            f"enc={encoding or '-'} "
+            f"zcache={zcache or '-'} "
             f'ua="{ua}"'
             f"{extra_text}"
         )
 
-    def _maybe_gzip(self, body: bytes) -> tuple[bytes, bool, float]:
-        accept_encoding = self.headers.get("Accept-Encoding", "").lower()
-        t0 = time.perf_counter()
-        if "gzip" not in accept_encoding:
-            return body, False, 0.0
-        if len(body) < 1024:
-            return body, False, 0.0
-        compressed = gzip.compress(body, compresslevel=5)
-        return compressed, True, (time.perf_counter() - t0) * 1000.0
+    def _maybe_compress(self, body: bytes) -> tuple[bytes, str, float, str]:
+        """Return (body, content coding or "", ms spent, cache state "hit"/"miss"/"")."""
+        if len(body) < RESPONSE_MIN_COMPRESS_BYTES:
+            return body, "", 0.0, ""
+        codec = negotiate_encoding(self.headers.get("Accept-Encoding", ""))
+        if codec is None:
+            return body, "", 0.0, ""
+        t0 = time.perf_counter()
+        cache_key = None
+        if len(body) >= RESPONSE_CACHE_MIN_BYTES and RESPONSE_CACHE.max_bytes > 0:
+            cache_key = (hashlib.blake2b(body, digest_size=16).digest(), codec)
+            cached = RESPONSE_CACHE.get(cache_key)
+            if cached is not None:
+                return cached, codec, (time.perf_counter() - t0) * 1000.0, "hit"
+        compressed = compress_body(body, codec, compression_level(codec, len(body)))
+        if cache_key is not None:
+            RESPONSE_CACHE.put(cache_key, compressed)
+        return compressed, codec, (time.perf_counter() - t0) * 1000.0, "miss" if cache_key else ""
+
+    def _send_json(self, status: int, payload: dict | list) -> dict:
+        t_json_start = time.perf_counter()
+        raw = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        json_ms = (time.perf_counter() - t_json_start) * 1000.0
+        body, encoding, gzip_ms, cache_state = self._maybe_compress(raw)
+        gzipped = bool(encoding)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, PUT, DELETE, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type, X-Admin-Token, X-Owner-Id, X-Owner-Token")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except BENIGN_NETWORK_ERRORS:
+            return {
+                "raw_bytes": len(raw),
+                "out_bytes": len(body),
+                "gzipped": gzipped,
+                "encoding": encoding,
+                "zcache": cache_state,
+                "json_ms": json_ms,
+                "gzip_ms": gzip_ms,
+            }
+        return {
+            "raw_bytes": len(raw),
+            "out_bytes": len(body),
+            "gzipped": gzipped,
+            "encoding": encoding,
+            "zcache": cache_state,
+            "json_ms": json_ms,
+            "gzip_ms": gzip_ms,
+        }
+
+    def _send_no_content(self) -> None:
+        self.send_response(204)
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, PUT, DELETE, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type, X-Admin-Token, X-Owner-Id, X-Owner-Token")
+        self.send_header("Content-Length", "0")
+        try:
+            self.end_headers()
+        except BENIGN_NETWORK_ERRORS:
+            return
+
+    def _read_json_body(self) -> dict:
+        raw_len = self.headers.get("Content-Length", "0")
+        try:
+            length = int(raw_len)
+        except ValueError as exc:
+            raise ValueError("Invalid Content-Length header") from exc
+
+        raw = self.rfile.read(length) if length > 0 else b"{}"
+        if not raw:
+            return {}
+
+        try:
+            body = json.loads(raw.decode("utf-8"))
+        except json.JSONDecodeError as exc:
+            raise ValueError("Body must be valid JSON") from exc
+
+        if not isinstance(body, dict):
+            raise ValueError("JSON body must be an object")
+        return body
+
+    def _respond_json(
+        self,
+        method: str,
+        status: int,
+        payload: dict | list,
+        t_total_start: float,
+        *,
+        db_ms: float = 0.0,
+        extra: str = "",
+    ) -> None:
+        metrics = self._send_json(status, payload)
+        total_ms = (time.perf_counter() - t_total_start) * 1000.0
+        self._trace_log(
+            method=method,
+            path=self.path,
+            status=status,
+            total_ms=total_ms,
+            db_ms=db_ms,
+            json_ms=float(metrics.get("json_ms", 0.0)),
+            gzip_ms=float(metrics.get("gzip_ms", 0.0)),
+            raw_bytes=int(metrics.get("raw_bytes", 0)),
+            out_bytes=int(metrics.get("out_bytes", 0)),
+            gzipped=bool(metrics.get("gzipped", False)),
+            encoding=str(metrics.get("encoding", "")),
+            zcache=str(metrics.get("zcache", "")),
+            extra=extra,
+        )
+
+    def _admin_allowed(self) -> bool:
+        token = str(getattr(self.server, "admin_token", "") or "")
+        if token:
+            return self.headers.get("X-Admin-Token", "") == token
+        # Without a configured token, admin endpoints are only reachable from this machine.
+        client_ip = self.client_address[0] if self.client_address else ""
+        return client_ip in LOOPBACK_ADDRESSES
+
+    def _send_text(self, status: int, text: str | bytes, content_type: str = "text/plain; charset=utf-8") -> None:
+        body = text.encode("utf-8") if isinstance(text, str) else text
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except BENIGN_NETWORK_ERRORS:
+            return
+
+    def _handle_admin_get(self, parts: list[str], t_total_start: float) -> None:
+        if parts == ["admin", "backups"]:
+            backup_dir = Path(getattr(self.server, "backup_dir", BACKUP_DIR))
+            self._respond_json("GET", 200, {"backups": list_backups(backup_dir)}, t_total_start, extra="admin=backups")
+            return
+        if parts == ["admin", "profiles"]:
+            payload = {**PROFILER.config(), "saved": PROFILER.saved, "profiles": PROFILER.list()}
+            self._respond_json("GET", 200, payload, t_total_start, extra="admin=profiles")
+            return
+        if parts == ["admin", "db"]:
+            self._respond_json("GET", 200, db_profile_report(), t_total_start, extra="admin=db")
+            return
+        if parts == ["admin", "sessions"]:
+            payload = {**STUDY_SESSIONS.stats(), "max": STUDY_SESSIONS.max_sessions, "ttlS": STUDY_SESSIONS.ttl_s}
+            self._respond_json("GET", 200, payload, t_total_start, extra="admin=sessions")
+            return
+        if parts == ["admin", "maintenance"]:
+            self._respond_json("GET", 200, MAINTENANCE.stats(), t_total_start, extra="admin=maintenance")
+            return
+        if parts == ["admin", "writes"]:
+            query = parse_qs(urlparse(self.path).query)
+            reset = "".join(query.get("reset", [""])).strip() in ("1", "true")
+            payload = {**WRITE_STATS.snapshot(reset=reset), "walBytes": wal_bytes(DB_PATH)}
+            self._respond_json("GET", 200, payload, t_total_start, extra="admin=writes")
+            return
+        if parts == ["admin", "shards"]:
+            shards = getattr(self.server, "shards", None)
+            payload = shards.stats() if shards is not None else {"enabled": False}
+            self._respond_json("GET", 200, payload, t_total_start, extra="admin=shards")
+            return
+        if parts == ["admin", "sql"]:
+            query = parse_qs(urlparse(self.path).query)
+            reset = "".join(query.get("reset", [""])).strip() in ("1", "true")
+            try:
+                limit = max(1, int("".join(query.get("limit", ["50"])).strip() or 50))
+            except ValueError:
+                self._respond_json("GET", 400, {"error": "limit must be an integer"}, t_total_start)
+                return
+            payload = {
+                "enabled": SQL_STATS.enabled,
+                "slowMs": SQL_STATS.slow_ms,
+                "statements": SQL_STATS.snapshot(limit=limit, reset=reset),
+            }
+            self._respond_json("GET", 200, payload, t_total_start, extra="admin=sql")
+            return
+        if parts == ["admin", "profiles", "stacks"]:
+            query = parse_qs(urlparse(self.path).query)
+            reset = "".join(query.get("reset", [""])).strip() in ("1", "true")
+            self._send_text(200, PROFILER.folded(reset=reset))
+            return
+        if len(parts) == 3 and parts[:2] == ["admin", "profiles"]:
+            query = parse_qs(urlparse(self.path).query)
+            name = unquote(parts[2])
+            try:
+                if "".join(query.get("raw", [""])).strip() in ("1", "true"):
+                    self._send_text(200, PROFILER.resolve(name).read_bytes(), "application/octet-stream")
+                    return
+                sort = "".join(query.get("sort", ["cumulative"])).strip() or "cumulative"
+                limit = int("".join(query.get("limit", ["40"])).strip() or 40)
+                self._send_text(200, PROFILER.report(name, sort=sort, limit=limit))
+            except FileNotFoundError:
+                self._respond_json("GET", 404, {"error": "Not found"}, t_total_start)
+            except (KeyError, ValueError) as err:
+                self._respond_json("GET", 400, {"error": str(err)}, t_total_start)
+            return
+        self._respond_json("GET", 404, {"error": "Not found"}, t_total_start)
+
+    @profiled
+    def do_POST(self) -> None:
+        t_total_start = time.perf_counter()
+        parts = api_parts(self.path)
+        if parts == ["sessions"]:
+            self._create_session(t_total_start)
+            return
+        if parts == ["import"]:
+            self._import_cards(t_total_start)
+            return
+        if parts is None or not parts or parts[0] != "admin":
+            self._respond_json("POST", 404, {"error": "Not found"}, t_total_start)
+            return
+        if not self._admin_allowed():
+            self._respond_json("POST", 403, {"error": "Forbidden"}, t_total_start)
+            return
+
+        try:
+            body = self._read_json_body()
+        except ValueError as err:
+            self._respond_json("POST", 400, {"error": str(err)}, t_total_start)
+            return
+
+        backup_dir = Path(getattr(self.server, "backup_dir", BACKUP_DIR))
+        try:
+            if parts == ["admin", "backups"]:
+                t_db_start = time.perf_counter()
+                result = create_backup(
+                    backup_dir,
+                    compress=bool(body.get("compress", getattr(self.server, "backup_compress", False))),
+                    keep=int(body.get("keep", getattr(self.server, "backup_keep", 0)) or 0),
+                )
+                db_ms = (time.perf_counter() - t_db_start) * 1000.0
+                self._respond_json("POST", 200, result, t_total_start, db_ms=db_ms, extra="admin=backup")
+                return
+            if parts == ["admin", "schema", "migrate"]:
+                if int(body.get("version", SCHEMA_V2)) != SCHEMA_V2:
+                    raise ValueError(f"Only migration to schema v{SCHEMA_V2} is supported")
+                t_db_start = time.perf_counter()
+                result = migrate_to_v2()
+                db_ms = (time.perf_counter() - t_db_start) * 1000.0
+                self._respond_json("POST", 200, result, t_total_start, db_ms=db_ms, extra="admin=migrate")
+                return
+            if parts == ["admin", "profiles"]:
+                routes = body.get("routes", list(PROFILER.routes))
+                if isinstance(routes, str):
+                    routes = routes.split(",")
+                PROFILER.configure(
+                    enabled=bool(body.get("enabled", True)),
+                    routes=[str(route) for route in routes],
+                    sample_rate=float(body.get("sampleRate", PROFILER.sample_rate)),
+                    slow_ms=float(body.get("slowMs", PROFILER.slow_ms)),
+                )
+                self._respond_json("POST", 200, PROFILER.config(), t_total_start, extra="admin=profiles")
+                return
+            if parts == ["admin", "maintenance"]:
+                t_db_start = time.perf_counter()
+                result = MAINTENANCE.run(force=True)
+                db_ms = (time.perf_counter() - t_db_start) * 1000.0
+                self._respond_json("POST", 200, result, t_total_start, db_ms=db_ms, extra="admin=maintenance")
+                return
+            if parts == ["admin", "payloads", "dedupe"]:
+                t_db_start = time.perf_counter()
+                result = dedupe_payloads()
+                db_ms = (time.perf_counter() - t_db_start) * 1000.0
+                self._respond_json("POST", 200, result, t_total_start, db_ms=db_ms, extra="admin=dedupe")
+                return
+            if parts == ["admin", "backups", "restore"]:
+                name = str(body.get("name", "")).strip()
+                if not name:
+                    raise ValueError('Missing backup "name"')
+                t_db_start = time.perf_counter()
+                result = restore_backup(resolve_backup_path(name, backup_dir, allow_paths=False))
+                db_ms = (time.perf_counter() - t_db_start) * 1000.0
+                self._respond_json("POST", 200, result, t_total_start, db_ms=db_ms, extra="admin=restore")
+                return
+        except (ValueError, TypeError) as err:
+            self._respond_json("POST", 400, {"error": str(err)}, t_total_start)
+            return
+        except (OSError, sqlite3.Error) as err:
+            self._respond_json("POST", 500, {"error": str(err)}, t_total_start)
+            return
+
+        self._respond_json("POST", 404, {"error": "Not found"}, t_total_start)
+
+    def _iter_body(self):
+        """Yield the request body in chunks, for Content-Length and chunked transfer encoding."""
+        if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+            while True:
+                try:
+                    size = int(self.rfile.readline(1024).split(b";", 1)[0].strip() or b"0", 16)
+                except ValueError as exc:
+                    raise ValueError("Invalid chunked request body") from exc
+                if size == 0:
+                    while self.rfile.readline(1024) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return
+                while size > 0:
+                    data = self.rfile.read(min(size, IMPORT_READ_CHUNK))
+                    if not data:
+                        raise ValueError("Request body ended early")
+                    size -= len(data)
+                    yield data
+                self.rfile.readline(1024)
+        try:
+            remaining = int(self.headers.get("Content-Length", "0"))
+        except ValueError as exc:
+            raise ValueError("Invalid Content-Length header") from exc
+        while remaining > 0:
+            data = self.rfile.read(min(remaining, IMPORT_READ_CHUNK))
+            if not data:
+                raise ValueError("Request body ended early")
+            remaining -= len(data)
+            yield data
+
+    def _import_cards(self, t_total_start: float) -> None:
+        query = parse_qs(urlparse(self.path).query)
+        fmt = "".join(query.get("format", [""])).strip().lower()
+        ndjson = fmt == "ndjson" or (not fmt and "ndjson" in self.headers.get("Content-Type", "").lower())
+        subject = "".join(query.get("subject", [""])).strip()
+        topic = "".join(query.get("topic", [""])).strip()
+        rows = invalid = 0
+        db_ms = 0.0
+        error = ""
+        importer: CardImporter | None = None
+        try:
+            with connect_db() as conn:
+                importer = CardImporter(conn, live=True)
+                for row in iter_import_rows(self._iter_body(), ndjson=ndjson):
+                    rows += 1
+                    question = row.get("question", row.get("prompt", "")) if isinstance(row, dict) else ""
+                    if not str(question or "").strip() or not str(row.get("answer") or "").strip():
+                        invalid += 1
+                        continue
+                    t_db_start = time.perf_counter()
+                    importer.add(row, subject=subject, topic=topic)
+                    db_ms += (time.perf_counter() - t_db_start) * 1000.0
+                t_db_start = time.perf_counter()
+                importer.commit()
+                db_ms += (time.perf_counter() - t_db_start) * 1000.0
+        except (ValueError, TypeError, sqlite3.Error) as err:
+            # Batches already committed stay imported; the unread rest of the body is dropped.
+            error = str(err)
+            self.close_connection = True
+        stats = importer.stats if importer is not None else {}
+        payload = {
+            "format": "ndjson" if ndjson else "json",
+            "rows": rows,
+            "invalid": invalid,
+            "cardsInserted": int(stats.get("cards_inserted", 0)),
+            "cardsSkipped": int(stats.get("cards_skipped", 0)),
+            "subjectsCreated": int(stats.get("subjects_created", 0)),
+            "topicsCreated": int(stats.get("topics_created", 0)),
+            "batches": importer.batches if importer is not None else 0,
+            "dbMs": round(db_ms, 1),
+            "ms": round((time.perf_counter() - t_total_start) * 1000.0, 1),
+        }
+        if error:
+            payload["error"] = error
+        extra = f"import rows={rows} inserted={payload['cardsInserted']} batches={payload['batches']}"
+        self._respond_json("POST", 400 if error else 200, payload, t_total_start, db_ms=db_ms, extra=extra)
+
+    def _create_session(self, t_total_start: float) -> None:
+        try:
+            body = self._read_json_body()
+            window = max(0, min(SESSION_WINDOW_MAX, int(body.get("window", SESSION_WINDOW_DEFAULT))))
+            t_db_start = time.perf_counter()
+            entry = STUDY_SESSIONS.create(build_session_queue(body))
+            first = STUDY_SESSIONS.take(entry, window)
+            db_ms = (time.perf_counter() - t_db_start) * 1000.0
+        except (ValueError, TypeError) as err:
+            self._respond_json("POST", 400, {"error": str(err)}, t_total_start)
+            return
+        except sqlite3.Error as err:
+            self._respond_json("POST", 500, {"error": str(err)}, t_total_start)
+            return
+        payload = {
+            **first,
+            "eligible": entry["eligible"],
+            "topicIds": entry["topicIds"],
+            "mode": entry["mode"],
+            "filters": entry["filters"],
+            "expiresAt": int(entry["expiresAt"] * 1000),
+        }
+        extra = f"session={entry['id']} mode={entry['mode']} queued={len(entry['queue'])}"
+        self._respond_json("POST", 200, payload, t_total_start, db_ms=db_ms, extra=extra)
+
+    def _session_next(self, session_id: str, query: dict[str, list[str]], t_total_start: float) -> None:
+        entry = STUDY_SESSIONS.get(session_id)
+        if entry is None:
+            self._respond_json("GET", 404, {"error": "Unknown or expired session"}, t_total_start)
+            return
+        try:
+            n = int("".join(query.get("n", [str(SESSION_WINDOW_DEFAULT)])).strip() or SESSION_WINDOW_DEFAULT)
+            raw_cursor = "".join(query.get("cursor", [""])).strip()
+            cursor = int(raw_cursor) if raw_cursor else None
+        except ValueError:
+            self._respond_json("GET", 400, {"error": "n and cursor must be integers"}, t_total_start)
+            return
+        t_db_start = time.perf_counter()
+        payload = STUDY_SESSIONS.take(entry, max(1, min(SESSION_WINDOW_MAX, n)), cursor)
+        db_ms = (time.perf_counter() - t_db_start) * 1000.0
+        payload["expiresAt"] = int(entry["expiresAt"] * 1000)
+        extra = f"session={session_id} cards={len(payload['cards'])} remaining={payload['remaining']}"
+        self._respond_json("GET", 200, payload, t_total_start, db_ms=db_ms, extra=extra)
+
+    def _review_forecast(self, query: dict[str, list[str]], t_total_start: float) -> None:
+        subject_id = "".join(query.get("subjectId", [""])).strip()
+        try:
+            days = int("".join(query.get("days", [str(FORECAST_DAYS_DEFAULT)])).strip() or FORECAST_DAYS_DEFAULT)
+            tz_offset_min = int("".join(query.get("tzOffsetMin", ["0"])).strip() or 0)
+        except ValueError:
+            self._respond_json("GET", 400, {"error": "days and tzOffsetMin must be integers"}, t_total_start)
+            return
+        days = max(1, min(FORECAST_DAYS_MAX, days))
+        tz_offset_min = max(-14 * 60, min(14 * 60, tz_offset_min))
+        t_db_start = time.perf_counter()
+        arrays, cached = REVIEW_FORECAST.arrays(subject_id)
+        db_ms = (time.perf_counter() - t_db_start) * 1000.0
+        payload = forecast_review_load(arrays, days, tz_offset_min=tz_offset_min)
+        payload["subjectId"] = subject_id or None
+        payload["cached"] = cached
+        extra = f"store=forecast days={days} cached={int(cached)}"
+        if subject_id:
+            extra += f" subjectId={subject_id}"
+        self._respond_json("GET", 200, payload, t_total_start, db_ms=db_ms, extra=extra)
+
+    def _card_duplicates(self, store: str, query: dict[str, list[str]], t_total_start: float) -> None:
+        subject_id = "".join(query.get("subjectId", [""])).strip()
+        try:
+            threshold = duplicate_threshold(query)
+        except ValueError:
+            self._respond_json("GET", 400, {"error": "threshold must be a number"}, t_total_start)
+            return
+        t_db_start = time.perf_counter()
+        topic_ids = subject_topic_ids(subject_id) if subject_id else None
+        groups, stats = CARD_DUPLICATES.groups(store, topic_ids, threshold)
+        payload = {
+            "subjectId": subject_id or None,
+            "store": store,
+            "threshold": threshold,
+            "cards": stats["cards"],
+            "groups": [duplicate_card_payload(store, group) for group in groups],
+        }
+        db_ms = (time.perf_counter() - t_db_start) * 1000.0
+        extra = (
+            f"store={store}-duplicates groups={len(groups)} cards={stats['cards']} "
+            f"cached={int(stats['cached'])} signed={stats['signed']}"
+        )
+        if subject_id:
+            extra += f" subjectId={subject_id}"
+        self._respond_json("GET", 200, payload, t_total_start, db_ms=db_ms, extra=extra)
+
+    def _search_knowledge(self, query: dict[str, list[str]], t_total_start: float) -> None:
+        subject_id = "".join(query.get("subjectId", [""])).strip()
+        text = " ".join(query.get("q", [])).strip()
+        try:
+            k = int("".join(query.get("k", [str(KNOWLEDGE_SEARCH_K_DEFAULT)])).strip() or KNOWLEDGE_SEARCH_K_DEFAULT)
+        except ValueError:
+            self._respond_json("GET", 400, {"error": "k must be an integer"}, t_total_start)
+            return
+        if not subject_id or not text:
+            self._respond_json("GET", 400, {"error": "subjectId and q are required"}, t_total_start)
+            return
+        if not KNOWLEDGE_FTS:
+            self._respond_json("GET", 503, {"error": "Knowledge search needs SQLite with FTS5"}, t_total_start)
+            return
+        k = max(1, min(KNOWLEDGE_SEARCH_K_MAX, k))
+        t_db_start = time.perf_counter()
+        results = search_knowledge(subject_id, text, k)
+        db_ms = (time.perf_counter() - t_db_start) * 1000.0
+        payload = {
+            "subjectId": subject_id,
+            "q": text,
+            "results": results,
+            "tokens": sum(result["tokens"] for result in results),
+        }
+        extra = f"store=knowledge-search subjectId={subject_id} k={k} hits={len(results)}"
+        self._respond_json("GET", 200, payload, t_total_start, db_ms=db_ms, extra=extra)
 
-    def _send_json(self, status: int, payload: dict | list) -> dict:
-        t_json_start = time.perf_counter()
-        raw = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
-        json_ms = (time.perf_counter() - t_json_start) * 1000.0
-        body, gzipped, gzip_ms = self._maybe_gzip(raw)
-        self.send_response(status)
-        self.send_header("Content-Type", "application/json; charset=utf-8")
+    def _export_subject(self, query: dict[str, list[str]], t_total_start: float) -> None:
+        subject_id = "".join(query.get("subjectId", [""])).strip()
+        fmt = "".join(query.get("format", ["ndjson"])).strip().lower() or "ndjson"
+        if not subject_id or fmt not in ("ndjson", "zip"):
+            self._respond_json("GET", 400, {"error": "subjectId and format=ndjson|zip are required"}, t_total_start)
+            return
+        subject = get_record("subjects", subject_id)
+        if subject is None:
+            self._respond_json("GET", 404, {"error": "Subject not found"}, t_total_start)
+            return
+        filename = re.sub(r"[^A-Za-z0-9._-]+", "-", str(subject.get("name") or subject_id)).strip("-") or "subject"
+        # ZIP entries are already deflated; only the NDJSON stream is compressed on the wire.
+        codec = negotiate_encoding(self.headers.get("Accept-Encoding", "")) if fmt == "ndjson" else None
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8" if fmt == "ndjson" else "application/zip")
+        self.send_header("Content-Disposition", f'attachment; filename="{filename}.{fmt}"')
+        self.send_header("Transfer-Encoding", "chunked")
         self.send_header("Cache-Control", "no-store")
-        self.send_header("Vary", "Accept-Encoding")
         self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "GET, PUT, DELETE, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
-        if gzipped:
-            self.send_header("Content-Encoding", "gzip")
-        self.send_header("Content-Length", str(len(body)))
+        if fmt == "ndjson":
+            self.send_header("Vary", "Accept-Encoding")
+        if codec:
+            self.send_header("Content-Encoding", codec)
         self.end_headers()
+
+        compressor = StreamCompressor(codec, compression_level(codec, RESPONSE_LARGE_BYTES)) if codec else None
+        out = ChunkedBodyWriter(self.wfile, compressor)
+        counts: Counter = Counter()
+        error = ""
         try:
-            self.wfile.write(body)
+            with connect_db() as conn:
+                # One read transaction: the export is a consistent snapshot even while writes continue.
+                conn.execute("BEGIN")
+                try:
+                    counts = write_subject_export(out, conn, subject_id, fmt)
+                finally:
+                    conn.rollback()
+            out.close()
         except BENIGN_NETWORK_ERRORS:
-            return {
-                "raw_bytes": len(raw),
-                "out_bytes": len(body),
-                "gzipped": gzipped,
-                "json_ms": json_ms,
-                "gzip_ms": gzip_ms,
-            }
-        return {
-            "raw_bytes": len(raw),
-            "out_bytes": len(body),
-            "gzipped": gzipped,
-            "json_ms": json_ms,
-            "gzip_ms": gzip_ms,
-        }
+            error = "client disconnected"
+            self.close_connection = True
+        except (sqlite3.Error, ValueError) as exc:
+            # Headers are gone; dropping the connection leaves the chunked body visibly truncated.
+            error = str(exc)
+            self.close_connection = True
+        total_ms = (time.perf_counter() - t_total_start) * 1000.0
+        extra = f"store=export format={fmt} subjectId={subject_id} " + " ".join(
+            f"{store}={counts.get(store, 0)}" for store in EXPORT_STORES
+        )
+        if error:
+            extra += f" error={error}"
+        self._trace_log(
+            method="GET",
+            path=self.path,
+            status=200,
+            total_ms=total_ms,
+            raw_bytes=out.raw_bytes,
+            out_bytes=out.out_bytes,
+            gzipped=bool(codec),
+            encoding=codec or "",
+            extra=extra,
+        )
 
-    def _send_no_content(self) -> None:
-        self.send_response(204)
-        self.send_header("Cache-Control", "no-store")
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "GET, PUT, DELETE, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
-        self.send_header("Content-Length", "0")
+    def _stream_changes(self, query: dict[str, list[str]], t_total_start: float) -> None:
+        stores = {
+            token.strip()
+            for raw in query.get("store", [])
+            for token in str(raw).split(",")
+            if token.strip() in KEY_FIELDS
+        }
+        subject_ids = {value.strip() for value in query.get("subjectId", []) if value.strip()}
+        include_payload = "".join(query.get("includePayload", [""])).strip().lower() in {"1", "true", "yes", "on"}
+        owner = getattr(REQUEST_CONTEXT, "owner", "")
+        raw_last_id = self.headers.get("Last-Event-ID") or "".join(query.get("lastEventId", [""]))
+        current_id = CHANGE_BUS.last_id()
         try:
+            last_id = int(str(raw_last_id).strip())
+        except ValueError:
+            last_id = current_id
+        # An id from the future (e.g. after a clock change) cannot be resumed.
+        needs_reset = last_id > current_id
+        if needs_reset:
+            last_id = current_id
+
+        # Only the first request on a connection is routed to a stream thread; a stream sent on a
+        # reused keep-alive connection lands on a pool worker, which must not stay pinned by it.
+        if getattr(REQUEST_CONTEXT, "pool_worker", False) and not self.server.detach_stream_worker():
+            body = b'{"error":"Too many change streams"}'
+            self.send_response(503)
+            self.send_header("Retry-After", str(self.server.retry_after_s))
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Connection", "close")
             self.end_headers()
-        except BENIGN_NETWORK_ERRORS:
+            self.close_connection = True
+            try:
+                self.wfile.write(body)
+            except BENIGN_NETWORK_ERRORS:
+                pass
+            self._trace_log(
+                method="GET",
+                path=self.path,
+                status=503,
+                total_ms=(time.perf_counter() - t_total_start) * 1000.0,
+                extra="store=changes error=no stream slot",
+            )
             return
 
-    def _read_json_body(self) -> dict:
-        raw_len = self.headers.get("Content-Length", "0")
-        try:
-            length = int(raw_len)
-        except ValueError as exc:
-            raise ValueError("Invalid Content-Length header") from exc
-
-        raw = self.rfile.read(length) if length > 0 else b"{}"
-        if not raw:
-            return {}
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Connection", "close")
+        self.send_header("X-Accel-Buffering", "no")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.close_connection = True
 
+        sent = 0
+        CHANGE_BUS.subscribe()
         try:
-            body = json.loads(raw.decode("utf-8"))
-        except json.JSONDecodeError as exc:
-            raise ValueError("Body must be valid JSON") from exc
-
-        if not isinstance(body, dict):
-            raise ValueError("JSON body must be an object")
-        return body
+            hello = f"retry: {SSE_RETRY_MS}\nevent: ready\ndata: {{\"lastEventId\":{last_id}}}\n\n"
+            if needs_reset:
+                hello += f"id: {last_id}\nevent: reset\ndata: {{}}\n\n"
+            self.wfile.write(hello.encode("utf-8"))
+            self.wfile.flush()
+            while True:
+                events, gap = CHANGE_BUS.wait_after(last_id, SSE_HEARTBEAT_S)
+                chunks: list[str] = []
+                if gap:
+                    chunks.append(f"id: {events[0]['id'] - 1}\nevent: reset\ndata: {{}}\n\n")
+                for event in events:
+                    last_id = int(event["id"])
+                    if event["owner"] != owner:
+                        continue
+                    if stores and event["store"] not in stores:
+                        continue
+                    if subject_ids and event["subjectId"] is not None and event["subjectId"] not in subject_ids:
+                        continue
+                    data = {
+                        "op": event["op"],
+                        "store": event["store"],
+                        "key": event["key"],
+                        "updatedAt": event["updatedAt"],
+                    }
+                    if event["subjectId"] is not None:
+                        data["subjectId"] = event["subjectId"]
+                    body = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+                    if include_payload and event["payload"]:
+                        body = f'{body[:-1]},"payload":{event["payload"]}}}'
+                    chunks.append(f"id: {last_id}\nevent: change\ndata: {body}\n\n")
+                    sent += 1
+                if not chunks:
+                    chunks.append(": ping\n\n")
+                self.wfile.write("".join(chunks).encode("utf-8"))
+                self.wfile.flush()
+        except BENIGN_NETWORK_ERRORS + (ValueError,):
+            pass
+        finally:
+            CHANGE_BUS.unsubscribe()
+            total_ms = (time.perf_counter() - t_total_start) * 1000.0
+            self._trace_log(
+                method="GET",
+                path=self.path,
+                status=200,
+                total_ms=total_ms,
+                extra=f"store=changes events={sent}",
+            )
 
     def do_OPTIONS(self) -> None:
         parts = api_parts(self.path)
@@ -389,6 +4641,7 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
             return
         self._send_no_content()
 
+    @profiled
     def do_GET(self) -> None:
         t_total_start = time.perf_counter()
         parsed_url = urlparse(self.path)
@@ -415,9 +4668,26 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
                 raw_bytes=int(metrics.get("raw_bytes", 0)),
                 out_bytes=int(metrics.get("out_bytes", 0)),
                 gzipped=bool(metrics.get("gzipped", False)),
+                encoding=str(metrics.get("encoding", "")),
+                zcache=str(metrics.get("zcache", "")),
             )
             return
 
+        if parts and parts[0] == "admin":
+            if not self._admin_allowed():
+                self._respond_json("GET", 403, {"error": "Forbidden"}, t_total_start)
+                return
+            self._handle_admin_get(parts, t_total_start)
+            return
+
+        if parts == ["changes", "stream"]:
+            self._stream_changes(query, t_total_start)
+            return
+
+        if parts == ["export"]:
+            self._export_subject(query, t_total_start)
+            return
+
         if parts == ["stats"]:
             t_db_start = time.perf_counter()
             counts = count_records_by_store(["subjects", "topics", "cards"])
@@ -440,10 +4710,28 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
                 raw_bytes=int(metrics.get("raw_bytes", 0)),
                 out_bytes=int(metrics.get("out_bytes", 0)),
                 gzipped=bool(metrics.get("gzipped", False)),
+                encoding=str(metrics.get("encoding", "")),
+                zcache=str(metrics.get("zcache", "")),
                 extra=f"store=stats{' payload=' + payload_label if payload_label else ''}",
             )
             return
 
+        if parts == ["review", "forecast"]:
+            self._review_forecast(query, t_total_start)
+            return
+
+        if parts == ["knowledge", "search"]:
+            self._search_knowledge(query, t_total_start)
+            return
+
+        if len(parts) == 2 and parts[0] in DUPLICATE_STORES and parts[1] == "duplicates":
+            self._card_duplicates(parts[0], query, t_total_start)
+            return
+
+        if len(parts) == 3 and parts[0] == "sessions" and parts[2] == "next":
+            self._session_next(unquote(parts[1]), query, t_total_start)
+            return
+
         if len(parts) == 2:
             store = parts[0]
             if store not in KEY_FIELDS:
@@ -459,6 +4747,8 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
                     raw_bytes=int(metrics.get("raw_bytes", 0)),
                     out_bytes=int(metrics.get("out_bytes", 0)),
                     gzipped=bool(metrics.get("gzipped", False)),
+                    encoding=str(metrics.get("encoding", "")),
+                    zcache=str(metrics.get("zcache", "")),
                 )
                 return
 
@@ -488,6 +4778,8 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
                 raw_bytes=int(metrics.get("raw_bytes", 0)),
                 out_bytes=int(metrics.get("out_bytes", 0)),
                 gzipped=bool(metrics.get("gzipped", False)),
+                encoding=str(metrics.get("encoding", "")),
+                zcache=str(metrics.get("zcache", "")),
                 extra=extra,
             )
             return
@@ -505,6 +4797,8 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
                 raw_bytes=int(metrics.get("raw_bytes", 0)),
                 out_bytes=int(metrics.get("out_bytes", 0)),
                 gzipped=bool(metrics.get("gzipped", False)),
+                encoding=str(metrics.get("encoding", "")),
+                zcache=str(metrics.get("zcache", "")),
             )
             return
 
@@ -522,6 +4816,8 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
                 raw_bytes=int(metrics.get("raw_bytes", 0)),
                 out_bytes=int(metrics.get("out_bytes", 0)),
                 gzipped=bool(metrics.get("gzipped", False)),
+                encoding=str(metrics.get("encoding", "")),
+                zcache=str(metrics.get("zcache", "")),
             )
             return
 
@@ -607,10 +4903,13 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
             raw_bytes=int(metrics.get("raw_bytes", 0)),
             out_bytes=int(metrics.get("out_bytes", 0)),
             gzipped=bool(metrics.get("gzipped", False)),
+            encoding=str(metrics.get("encoding", "")),
+            zcache=str(metrics.get("zcache", "")),
             extra=f"{trace_extra} rows={len(rows)}",
         )
         return
 
+    @profiled
     def do_PUT(self) -> None:
         t_total_start = time.perf_counter()
         parts = api_parts(self.path)
@@ -627,6 +4926,8 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
                 raw_bytes=int(metrics.get("raw_bytes", 0)),
                 out_bytes=int(metrics.get("out_bytes", 0)),
                 gzipped=bool(metrics.get("gzipped", False)),
+                encoding=str(metrics.get("encoding", "")),
+                zcache=str(metrics.get("zcache", "")),
             )
             return
 
@@ -643,6 +4944,8 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
                 raw_bytes=int(metrics.get("raw_bytes", 0)),
                 out_bytes=int(metrics.get("out_bytes", 0)),
                 gzipped=bool(metrics.get("gzipped", False)),
+                encoding=str(metrics.get("encoding", "")),
+                zcache=str(metrics.get("zcache", "")),
             )
             return
 
@@ -660,6 +4963,8 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
                 raw_bytes=int(metrics.get("raw_bytes", 0)),
                 out_bytes=int(metrics.get("out_bytes", 0)),
                 gzipped=bool(metrics.get("gzipped", False)),
+                encoding=str(metrics.get("encoding", "")),
+                zcache=str(metrics.get("zcache", "")),
             )
             return
 
@@ -668,6 +4973,15 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
             body = self._read_json_body()
             read_ms = (time.perf_counter() - t_read_start) * 1000.0
             t_db_start = time.perf_counter()
+            query = parse_qs(urlparse(self.path).query)
+            check_duplicates = "".join(query.get("checkDuplicates", [""])).lower() in {"1", "true", "yes"}
+            if store in DUPLICATE_STORES and check_duplicates:
+                duplicates = find_card_duplicates(store, body, duplicate_threshold(query))
+                if duplicates:
+                    error = {"error": "Near-duplicate cards exist", "duplicates": duplicates}
+                    extra = f"store={store} duplicates={len(duplicates)}"
+                    self._respond_json("PUT", 409, error, t_total_start, extra=extra)
+                    return
             record = upsert_record(store, body)
             db_ms = (time.perf_counter() - t_db_start) * 1000.0
         except ValueError as err:
@@ -683,6 +4997,8 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
                 raw_bytes=int(metrics.get("raw_bytes", 0)),
                 out_bytes=int(metrics.get("out_bytes", 0)),
                 gzipped=bool(metrics.get("gzipped", False)),
+                encoding=str(metrics.get("encoding", "")),
+                zcache=str(metrics.get("zcache", "")),
             )
             return
 
@@ -699,10 +5015,13 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
             raw_bytes=int(metrics.get("raw_bytes", 0)),
             out_bytes=int(metrics.get("out_bytes", 0)),
             gzipped=bool(metrics.get("gzipped", False)),
-            extra=f"store={store} read_ms={read_ms:.1f}",
+            encoding=str(metrics.get("encoding", "")),
+            zcache=str(metrics.get("zcache", "")),
+            extra=f"store={store} read_ms={read_ms:.1f} skipped={getattr(REQUEST_CONTEXT, 'writes_skipped', 0)}",
         )
         return
 
+    @profiled
     def do_DELETE(self) -> None:
         t_total_start = time.perf_counter()
         parts = api_parts(self.path)
@@ -719,9 +5038,25 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
                 raw_bytes=int(metrics.get("raw_bytes", 0)),
                 out_bytes=int(metrics.get("out_bytes", 0)),
                 gzipped=bool(metrics.get("gzipped", False)),
+                encoding=str(metrics.get("encoding", "")),
+                zcache=str(metrics.get("zcache", "")),
             )
             return
 
+        if len(parts) == 2 and parts[0] == "sessions":
+            if STUDY_SESSIONS.delete(unquote(parts[1])):
+                self._send_no_content()
+                self._trace_log(
+                    method="DELETE",
+                    path=self.path,
+                    status=204,
+                    total_ms=(time.perf_counter() - t_total_start) * 1000.0,
+                    extra="session=ended",
+                )
+            else:
+                self._respond_json("DELETE", 404, {"error": "Unknown or expired session"}, t_total_start)
+            return
+
         if len(parts) != 2:
             metrics = self._send_json(404, {"error": "Not found"})
             total_ms = (time.perf_counter() - t_total_start) * 1000.0
@@ -735,6 +5070,8 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
                 raw_bytes=int(metrics.get("raw_bytes", 0)),
                 out_bytes=int(metrics.get("out_bytes", 0)),
                 gzipped=bool(metrics.get("gzipped", False)),
+                encoding=str(metrics.get("encoding", "")),
+                zcache=str(metrics.get("zcache", "")),
             )
             return
 
@@ -752,12 +5089,14 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
                 raw_bytes=int(metrics.get("raw_bytes", 0)),
                 out_bytes=int(metrics.get("out_bytes", 0)),
                 gzipped=bool(metrics.get("gzipped", False)),
+                encoding=str(metrics.get("encoding", "")),
+                zcache=str(metrics.get("zcache", "")),
             )
             return
 
         key = unquote(parts[1])
         t_db_start = time.perf_counter()
-        delete_record(store, key)
+        deleted = delete_record(store, key)
         db_ms = (time.perf_counter() - t_db_start) * 1000.0
         self._send_no_content()
         total_ms = (time.perf_counter() - t_total_start) * 1000.0
@@ -767,7 +5106,7 @@ class FlashcardsHandler(SimpleHTTPRequestHandler):
             status=204,
             total_ms=total_ms,
             db_ms=db_ms,
-            extra=f"store={store}",
+            extra=f"store={store} deleted={int(deleted)}",
         )
         return
 
@@ -782,6 +5121,147 @@ class FlashcardsServer(ThreadingHTTPServer):
         super().handle_error(request, client_address)
 
 
+def request_priority(head: bytes) -> int:
+    """Classify a connection by the first request line peeked from its socket."""
+    method, _, rest = head.split(b"\r\n", 1)[0].decode("latin-1").partition(" ")
+    path = urlparse(rest.split(" ", 1)[0]).path
+    if path == "/api/health" or (method in ("PUT", "POST") and path.startswith("/api/progress")):
+        return PRIORITY_HIGH
+    parts = api_parts(path)
+    if method == "GET" and parts is not None and len(parts) == 1 and parts[0] in KEY_FIELDS:
+        return PRIORITY_BULK
+    if (method, path) in (("POST", "/api/import"), ("GET", "/api/export")):
+        return PRIORITY_BULK
+    return PRIORITY_NORMAL
+
+
+def is_stream_request(head: bytes) -> bool:
+    line = head.split(b"\r\n", 1)[0]
+    return line.startswith(b"GET ") and b"/api/changes/stream" in line
+
+
+class PooledFlashcardsServer(FlashcardsServer):
+    """
+    FlashcardsServer with a fixed number of worker threads fed by a bounded
+    priority queue of accepted connections. When the queue is full new
+    connections get an immediate 503 with Retry-After instead of a thread.
+    Idle keep-alive connections are closed after `keepalive_timeout_s` so they
+    do not pin workers; change-feed streams run on their own capped threads.
+    A stream that arrives on a reused keep-alive connection is already on a
+    worker: that worker takes a stream slot and is replaced in the pool.
+    """
+
+    def __init__(
+        self,
+        server_address,
+        handler_class,
+        *,
+        workers: int,
+        queue_size: int = POOL_QUEUE_SIZE,
+        keepalive_timeout_s: float = POOL_KEEPALIVE_TIMEOUT_S,
+        retry_after_s: int = POOL_RETRY_AFTER_S,
+        max_streams: int = POOL_MAX_STREAMS,
+    ) -> None:
+        super().__init__(server_address, handler_class)
+        self.workers = max(1, int(workers))
+        self.work_queue: queue.PriorityQueue = queue.PriorityQueue(maxsize=max(1, int(queue_size)))
+        self.keepalive_timeout_s = float(keepalive_timeout_s)
+        self.retry_after_s = int(retry_after_s)
+        self.stream_slots = threading.BoundedSemaphore(max(1, int(max_streams)))
+        self.rejected = 0
+        self._seq = itertools.count()
+        self._worker_ids = itertools.count()
+        for _ in range(self.workers):
+            self._spawn_worker()
+
+    def _spawn_worker(self) -> None:
+        threading.Thread(target=self._worker, name=f"http-worker-{next(self._worker_ids)}", daemon=True).start()
+
+    def process_request(self, request, client_address) -> None:
+        priority = PRIORITY_NORMAL
+        try:
+            # Non-blocking peek: most clients send the request line with the handshake.
+            request.setblocking(False)
+            head = request.recv(POOL_PEEK_BYTES, socket.MSG_PEEK)
+            if head:
+                priority = request_priority(head)
+        except (BlockingIOError, OSError):
+            pass
+        finally:
+            request.setblocking(True)
+        try:
+            self.work_queue.put_nowait((priority, next(self._seq), time.perf_counter(), request, client_address))
+        except queue.Full:
+            self._reject(request)
+
+    def _reject(self, request) -> None:
+        self.rejected += 1
+        body = b'{"error":"Server busy"}'
+        response = (
+            "HTTP/1.1 503 Service Unavailable\r\n"
+            f"Retry-After: {self.retry_after_s}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            "Access-Control-Allow-Origin: *\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode("ascii") + body
+        try:
+            request.settimeout(1.0)
+            request.sendall(response)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def _worker(self) -> None:
+        REQUEST_CONTEXT.pool_worker = True
+        while True:
+            _, _, enqueued_at, request, client_address = self.work_queue.get()
+            REQUEST_CONTEXT.queue_ms = (time.perf_counter() - enqueued_at) * 1000.0
+            try:
+                request.settimeout(self.keepalive_timeout_s)
+                head = request.recv(POOL_PEEK_BYTES, socket.MSG_PEEK)
+            except OSError:
+                head = b""
+            if not head:
+                # Closed or idle past the keep-alive timeout before sending anything.
+                self.shutdown_request(request)
+                continue
+            if is_stream_request(head):
+                self._start_stream(request, client_address)
+                continue
+            self.process_request_thread(request, client_address)
+            if not REQUEST_CONTEXT.pool_worker:
+                # This thread served a change stream and was replaced; see detach_stream_worker().
+                self.stream_slots.release()
+                return
+
+    def detach_stream_worker(self) -> bool:
+        """
+        Turn the calling worker into a stream thread for a change stream found
+        on a keep-alive connection. Takes a stream slot and starts a replacement
+        worker; the slot is released when the connection ends. Returns False
+        when all stream slots are in use.
+        """
+        if not self.stream_slots.acquire(blocking=False):
+            return False
+        REQUEST_CONTEXT.pool_worker = False
+        self._spawn_worker()
+        return True
+
+    def _start_stream(self, request, client_address) -> None:
+        if not self.stream_slots.acquire(blocking=False):
+            self._reject(request)
+            return
+
+        def run() -> None:
+            try:
+                self.process_request_thread(request, client_address)
+            finally:
+                self.stream_slots.release()
+
+        threading.Thread(target=run, name="http-stream", daemon=True).start()
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Serve flashcards app with shared SQLite backend")
     parser.add_argument("--host", default="0.0.0.0", help="Host interface to bind")
@@ -802,24 +5282,325 @@ def parse_args() -> argparse.Namespace:
         default=0.0,
         help="Only print traces slower than this threshold in milliseconds.",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Serve with a bounded pool of N worker threads (0 keeps one thread per connection).",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=POOL_QUEUE_SIZE,
+        help="Connections waiting for a worker before new ones get 503 (pool mode).",
+    )
+    parser.add_argument(
+        "--keepalive-timeout-s",
+        type=float,
+        default=POOL_KEEPALIVE_TIMEOUT_S,
+        help="Close keep-alive connections idle this long (pool mode).",
+    )
+    parser.add_argument(
+        "--retry-after-s",
+        type=int,
+        default=POOL_RETRY_AFTER_S,
+        help="Retry-After value sent with 503 rejections (pool mode).",
+    )
+    parser.add_argument(
+        "--max-streams",
+        type=int,
+        default=POOL_MAX_STREAMS,
+        help="Concurrent /api/changes/stream connections, served outside the pool (pool mode).",
+    )
+    parser.add_argument(
+        "--response-cache-mb",
+        type=float,
+        default=RESPONSE_CACHE_MAX_BYTES / (1024 * 1024),
+        help="Memory for cached compressed API responses in MB (0 disables the cache).",
+    )
+    parser.add_argument(
+        "--db-profile",
+        choices=sorted(DB_PROFILES),
+        default=DB_PROFILE,
+        help="SQLite tuning applied to every connection (mmap, cache, temp store, busy timeout, checkpoints).",
+    )
+    parser.add_argument(
+        "--session-ttl-min",
+        type=float,
+        default=SESSION_TTL_S / 60.0,
+        help="Drop server-built study sessions unused for this many minutes.",
+    )
+    parser.add_argument(
+        "--max-sessions",
+        type=int,
+        default=SESSION_MAX,
+        help="Study sessions held in memory at once (least recently used are dropped first).",
+    )
+    parser.add_argument(
+        "--shard-dir",
+        default="",
+        help=f"Give each owner (X-Owner-Id / X-Owner-Token) its own database in this directory (e.g. {SHARD_DIR.name}).",
+    )
+    parser.add_argument(
+        "--shard-tokens",
+        default="",
+        help="JSON file mapping X-Owner-Token values to owner ids; X-Owner-Id is then ignored.",
+    )
+    parser.add_argument(
+        "--shard-require-owner",
+        action="store_true",
+        help="Reject /api requests without an owner (401) instead of serving the main database.",
+    )
+    parser.add_argument(
+        "--shard-max-open",
+        type=int,
+        default=SHARD_MAX_OPEN,
+        help="Owner shards kept open at once (least recently used are closed first).",
+    )
+    parser.add_argument(
+        "--shard-idle-s",
+        type=float,
+        default=SHARD_IDLE_S,
+        help="Close owner shards unused for this many seconds (0 keeps them until evicted by --shard-max-open).",
+    )
+    parser.add_argument(
+        "--sql-stats",
+        action="store_true",
+        help="Time every SQL statement; see /api/admin/sql and the sql= trace field.",
+    )
+    parser.add_argument(
+        "--sql-slow-ms",
+        type=float,
+        default=SQL_SLOW_MS,
+        help="Capture EXPLAIN QUERY PLAN for statements slower than this (with --sql-stats).",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile selected requests with cProfile; see /api/admin/profiles.",
+    )
+    parser.add_argument(
+        "--profile-routes",
+        default="",
+        help="Comma-separated path prefixes to profile (default: all non-admin routes).",
+    )
+    parser.add_argument(
+        "--profile-sample-rate",
+        type=float,
+        default=0.0,
+        help="Profile only this fraction of matching requests (0 profiles all of them).",
+    )
+    parser.add_argument(
+        "--profile-slow-ms",
+        type=float,
+        default=0.0,
+        help="Keep profiles only for requests slower than this many milliseconds.",
+    )
+    parser.add_argument("--profile-dir", default=str(PROFILE_DIR), help="Directory for saved .prof files.")
+    parser.add_argument(
+        "--admin-token",
+        default="",
+        help="Token required in X-Admin-Token for /api/admin/* (default: admin endpoints are loopback-only).",
+    )
+    parser.add_argument("--backup-dir", default=str(BACKUP_DIR), help="Directory for database backups.")
+    parser.add_argument("--backup-compress", action="store_true", help="Gzip-compress backups.")
+    parser.add_argument(
+        "--backup-keep",
+        type=int,
+        default=0,
+        help="Keep only the newest N backups after each snapshot (0 keeps all).",
+    )
+    parser.add_argument(
+        "--backup-interval-min",
+        type=float,
+        default=0.0,
+        help="Take a background backup every N minutes while serving (0 disables).",
+    )
+    parser.add_argument(
+        "--maintenance-interval-s",
+        type=float,
+        default=MAINTENANCE_INTERVAL_S,
+        help="Check every N seconds for an idle period to run database maintenance in (0 disables).",
+    )
+    parser.add_argument(
+        "--maintenance-quiet-s",
+        type=float,
+        default=MAINTENANCE_QUIET_S,
+        help="Seconds without requests that count as idle for maintenance.",
+    )
+    parser.add_argument(
+        "--maintenance-budget-ms",
+        type=float,
+        default=MAINTENANCE_BUDGET_MS,
+        help="Time budget of one idle maintenance pass; remaining tasks wait for the next one.",
+    )
+    parser.add_argument(
+        "--migrate-schema",
+        action="store_true",
+        help="Migrate the database to the per-store table layout (schema v2) and exit.",
+    )
+    parser.add_argument(
+        "--payload-compression",
+        choices=PAYLOAD_CODECS,
+        default=PAYLOAD_COMPRESSION,
+        help="Compress large card/cardbank/knowledge payloads on write (zdict uses a preset card dictionary).",
+    )
+    parser.add_argument(
+        "--rewrite-payloads",
+        choices=PAYLOAD_CODECS,
+        default="",
+        help="Re-encode stored card/cardbank/knowledge payloads with this codec and exit.",
+    )
+    parser.add_argument(
+        "--dedupe-payloads",
+        action="store_true",
+        help="Move cards/cardbank content into the shared content table, drop orphaned blobs and exit.",
+    )
+    parser.add_argument("--backup", action="store_true", help="Create one backup and exit.")
+    parser.add_argument("--list-backups", action="store_true", help="List backups and exit.")
+    parser.add_argument("--restore", default="", help="Restore this backup (name or path) into the database and exit.")
     return parser.parse_args()
 
 
 def main() -> None:
+    global DB_PROFILE, PAYLOAD_COMPRESSION
     args = parse_args()
+    DB_PROFILE = str(args.db_profile)
     init_db()
+    PAYLOAD_COMPRESSION = str(args.payload_compression)
+
+    backup_dir = Path(args.backup_dir)
+    if args.migrate_schema:
+        result = migrate_to_v2()
+        if result["migrated"]:
+            print(f"Migrated {result['rows']} rows to schema v{SCHEMA_V2} in {result['ms']:.0f} ms")
+        else:
+            print(f"Database already uses schema v{SCHEMA_V2}")
+        return
+    if args.rewrite_payloads:
+        result = rewrite_payloads(args.rewrite_payloads)
+        print(
+            f"Rewrote {result['rewritten']}/{result['rows']} payloads with {args.rewrite_payloads}: "
+            f"{result['bytesBefore'] / 1024:.1f} KB -> {result['bytesAfter'] / 1024:.1f} KB ({result['ms']:.0f} ms)"
+        )
+        return
+    if args.dedupe_payloads:
+        result = dedupe_payloads()
+        print(
+            f"Deduplicated {result['converted']}/{result['rows']} rows into {result['blobs']} blobs "
+            f"({result['orphansRemoved']} orphans removed): "
+            f"{result['bytesBefore'] / 1024:.1f} KB -> {result['bytesAfter'] / 1024:.1f} KB ({result['ms']:.0f} ms)"
+        )
+        return
+    if args.list_backups:
+        for item in list_backups(backup_dir):
+            print(f"{item['name']}  {item['bytes'] / 1024:.1f} KB")
+        return
+    if args.backup:
+        result = create_backup(backup_dir, compress=bool(args.backup_compress), keep=int(args.backup_keep))
+        print(f"Backup created: {result['path']} ({result['bytes'] / 1024:.1f} KB, {result['ms']:.0f} ms)")
+        for name in result["rotated"]:
+            print(f"Rotated out: {name}")
+        return
+    if args.restore:
+        result = restore_backup(resolve_backup_path(args.restore, backup_dir))
+        print(f"Restored {result['name']} into {DB_PATH} ({result['pages']} pages, {result['ms']:.0f} ms)")
+        return
 
-    server = FlashcardsServer((args.host, args.port), FlashcardsHandler)
+    if args.workers > 0:
+        server = PooledFlashcardsServer(
+            (args.host, args.port),
+            FlashcardsHandler,
+            workers=args.workers,
+            queue_size=args.queue_size,
+            keepalive_timeout_s=args.keepalive_timeout_s,
+            retry_after_s=args.retry_after_s,
+            max_streams=args.max_streams,
+        )
+    else:
+        server = FlashcardsServer((args.host, args.port), FlashcardsHandler)
+    server.admin_token = str(args.admin_token or "")
+    server.backup_dir = backup_dir
+    server.backup_compress = bool(args.backup_compress)
+    server.backup_keep = int(args.backup_keep)
+    server.shards = None
+    if args.shard_dir:
+        server.shards = ShardRegistry(
+            Path(args.shard_dir).expanduser(),
+            max_open=args.shard_max_open,
+            idle_s=args.shard_idle_s,
+            tokens=load_shard_tokens(args.shard_tokens) if args.shard_tokens else None,
+            require_owner=bool(args.shard_require_owner),
+        )
+        server.shards.start_janitor()
+    if args.backup_interval_min > 0:
+        start_backup_scheduler(float(args.backup_interval_min), backup_dir, server.backup_compress, server.backup_keep)
+    MAINTENANCE.interval_s = max(0.0, float(args.maintenance_interval_s))
+    MAINTENANCE.quiet_s = max(0.0, float(args.maintenance_quiet_s))
+    MAINTENANCE.budget_ms = max(1.0, float(args.maintenance_budget_ms))
+    MAINTENANCE.shards = server.shards
+    MAINTENANCE.start()
+    SQL_STATS.enabled = bool(args.sql_stats)
+    SQL_STATS.slow_ms = max(0.0, float(args.sql_slow_ms))
+    SQL_STATS.log_slow = bool(args.trace_requests)
+    PROFILER.out_dir = Path(args.profile_dir)
+    PROFILER.configure(
+        enabled=bool(args.profile),
+        routes=str(args.profile_routes or "").split(","),
+        sample_rate=float(args.profile_sample_rate),
+        slow_ms=float(args.profile_slow_ms),
+    )
+    RESPONSE_CACHE.max_bytes = int(max(0.0, float(args.response_cache_mb)) * 1024 * 1024)
+    STUDY_SESSIONS.ttl_s = max(60.0, float(args.session_ttl_min) * 60.0)
+    STUDY_SESSIONS.max_sessions = max(1, int(args.max_sessions))
     server.trace_requests = bool(args.trace_requests)
     server.trace_ip = str(args.trace_ip or "").strip()
     server.trace_slow_ms = float(args.trace_slow_ms or 0.0)
     url_host = "127.0.0.1" if args.host == "0.0.0.0" else args.host
     print(f"Flashcards server running on http://{url_host}:{args.port}")
-    print(f"Database file: {DB_PATH}")
+    print(f"Database file: {DB_PATH} (schema v{SCHEMA_LAYOUT})")
     if server.trace_requests:
         suffix = f" (ip={server.trace_ip})" if server.trace_ip else ""
         threshold = f", slow>{server.trace_slow_ms:.0f}ms" if server.trace_slow_ms > 0 else ""
         print(f"Request tracing enabled{suffix}{threshold}")
+    report = db_profile_report()
+    print(
+        f"DB profile: {report['profile']} (mmap={report['mmap_size'] / 1024 / 1024:.0f}MB"
+        f"{' covers db' if report['mmapCoversDb'] else ''}, cache_size={report['cache_size']}, "
+        f"temp_store={report['temp_store']}, busy_timeout={report['busy_timeout']}ms, "
+        f"synchronous={report['synchronous']}, wal_autocheckpoint={report['wal_autocheckpoint']}, "
+        f"db={report['dbBytes'] / 1024 / 1024:.1f}MB)"
+    )
+    print(f"Response encodings: {', '.join(RESPONSE_CODECS)}")
+    if SQL_STATS.enabled:
+        print(f"SQL statement stats enabled (plans for statements >= {SQL_STATS.slow_ms:g}ms)")
+    if PROFILER.enabled:
+        routes = ", ".join(PROFILER.routes) or "all routes"
+        print(
+            f"Profiling {routes} (sample={PROFILER.sample_rate:g}, slow>={PROFILER.slow_ms:g}ms) "
+            f"into {PROFILER.out_dir}"
+        )
+    if isinstance(server, PooledFlashcardsServer):
+        print(
+            f"Worker pool: {server.workers} workers, queue {server.work_queue.maxsize}, "
+            f"keep-alive {server.keepalive_timeout_s:g}s"
+        )
+    if server.shards is not None:
+        owner_source = "X-Owner-Token" if server.shards.tokens else "X-Owner-Id"
+        fallback = "required" if server.shards.require_owner else "optional, main database otherwise"
+        print(
+            f"Owner shards: {server.shards.root} via {owner_source} ({fallback}; "
+            f"max open {server.shards.max_open}, idle {server.shards.idle_s:g}s)"
+        )
+    if PAYLOAD_COMPRESSION != "off":
+        print(f"Payload compression: {PAYLOAD_COMPRESSION} (>= {PAYLOAD_COMPRESS_MIN_BYTES} bytes)")
+    if args.backup_interval_min > 0:
+        print(f"Backups every {args.backup_interval_min:g} min into {backup_dir}")
+    if MAINTENANCE.interval_s > 0:
+        print(
+            f"Idle maintenance: checked every {MAINTENANCE.interval_s:g}s after {MAINTENANCE.quiet_s:g}s quiet, "
+            f"budget {MAINTENANCE.budget_ms:g}ms (WAL {report['walBytes'] / 1024 / 1024:.1f}MB)"
+        )
     server.serve_forever()
 
 